@@ -6,6 +6,7 @@ from autoproofreader.models import (
     DiluvianModel,
     AutoproofreaderResult,
     ImageVolumeConfig,
+    JobStageMetric,
 )
 
 admin.site.register(ComputeServer)
@@ -13,3 +14,4 @@ admin.site.register(ConfigFile)
 admin.site.register(DiluvianModel)
 admin.site.register(AutoproofreaderResult)
 admin.site.register(ImageVolumeConfig)
+admin.site.register(JobStageMetric)
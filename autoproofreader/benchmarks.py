@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""Synthetic skeletons and sarbor outputs for benchmarking result ingestion.
+
+Skeletons are generated as trees of gently curving segments. Every node
+continues the segment of the node before it, except for the first node of
+a new branch, which attaches to a random earlier node. The fake outputs
+match the files sarbor writes to the outputs directory of a job: pickled
+nodes and rankings, an ASCII STL mesh and a small n5 segmentation.
+"""
+from collections import namedtuple
+import json
+import math
+import pickle
+import struct
+
+import numpy as np
+
+# A generated skeleton. parents holds the index of the parent of every node,
+# -1 for the root, positions the x, y, z of every node in nm.
+Skeleton = namedtuple("Skeleton", ["node_ids", "parents", "positions"])
+
+# Node ids of generated skeletons start here, so they don't look like indices
+FIRST_NODE_ID = 1000000
+
+# Mean distance between neighboring nodes in nm
+NODE_SPACING = 80.0
+
+
+def generate_skeleton(n_nodes, seed=0, branch_probability=0.02):
+    """
+    A random skeleton of n_nodes nodes, in which every node starts a new
+    branch with the given probability.
+    """
+    rng = np.random.RandomState(seed)
+    branch_starts = rng.rand(n_nodes) < branch_probability
+    branch_starts[0] = True
+
+    parents = np.arange(-1, n_nodes - 1, dtype=np.int64)
+    starts = np.flatnonzero(branch_starts)
+    # Branches attach to a random node before them
+    parents[starts[1:]] = (rng.rand(len(starts) - 1) * starts[1:]).astype(np.int64)
+
+    # Every segment keeps a direction with some jitter per node
+    directions = rng.normal(size=(len(starts), 3))
+    directions /= np.linalg.norm(directions, axis=1)[:, np.newaxis]
+    segments = np.cumsum(branch_starts) - 1
+    steps = directions[segments] + 0.3 * rng.normal(size=(n_nodes, 3))
+    steps *= NODE_SPACING / np.linalg.norm(steps, axis=1)[:, np.newaxis]
+
+    positions = np.empty((n_nodes, 3))
+    positions[0] = rng.rand(3) * 100000
+    ends = np.append(starts[1:], n_nodes)
+    for start, end in zip(starts, ends):
+        origin = positions[parents[start]] if start > 0 else positions[0] - steps[0]
+        positions[start:end] = origin + np.cumsum(steps[start:end], axis=0)
+
+    return Skeleton(
+        np.arange(FIRST_NODE_ID, FIRST_NODE_ID + n_nodes, dtype=np.int64),
+        parents,
+        positions,
+    )
+
+
+def parent_ids(skeleton):
+    """Node id of the parent of every node, None for the root."""
+    ids = skeleton.node_ids.tolist()
+    return [None if p < 0 else ids[p] for p in skeleton.parents.tolist()]
+
+
+def write_skeleton_csv(skeleton, path):
+    """Write a skeleton in the format of an uploaded skeleton.csv."""
+    with path.open("w") as f:
+        for node_id, parent_id, (x, y, z) in zip(
+            skeleton.node_ids.tolist(),
+            parent_ids(skeleton),
+            skeleton.positions.tolist(),
+        ):
+            f.write(
+                "{},{},{},{},{}\n".format(
+                    node_id, node_id if parent_id is None else parent_id, x, y, z
+                )
+            )
+
+
+def write_stl(path, n_triangles, center, radius):
+    """Write an ASCII STL sphere with about n_triangles triangles."""
+    rings = max(int(math.sqrt(n_triangles / 2)), 2)
+    theta = np.linspace(0, np.pi, rings + 1)
+    phi = np.linspace(0, 2 * np.pi, rings + 1)
+    grid = np.stack(
+        [
+            np.outer(np.sin(theta), np.cos(phi)),
+            np.outer(np.sin(theta), np.sin(phi)),
+            np.outer(np.cos(theta), np.ones_like(phi)),
+        ],
+        axis=-1,
+    )
+    grid = center + radius * grid
+    with path.open("w") as f:
+        f.write("solid mesh\n")
+        for i in range(rings):
+            for j in range(rings):
+                quad = (grid[i, j], grid[i + 1, j], grid[i + 1, j + 1], grid[i, j + 1])
+                for triangle in (
+                    (quad[0], quad[1], quad[2]),
+                    (quad[0], quad[2], quad[3]),
+                ):
+                    f.write("facet normal 0 0 0\nouter loop\n")
+                    for vertex in triangle:
+                        f.write("vertex {} {} {}\n".format(*vertex))
+                    f.write("endloop\nendfacet\n")
+        f.write("endsolid mesh\n")
+
+
+def write_n5(path, block_size=16):
+    """Write an n5 container with a single raw uint8 block."""
+    dataset = path / "segmentation"
+    dataset.mkdir(parents=True)
+    (path / "attributes.json").write_text(json.dumps({"n5": "2.0.0"}))
+    (dataset / "attributes.json").write_text(
+        json.dumps(
+            {
+                "dimensions": [block_size] * 3,
+                "blockSize": [block_size] * 3,
+                "dataType": "uint8",
+                "compression": {"type": "raw"},
+            }
+        )
+    )
+    block = dataset / "0" / "0" / "0"
+    block.parent.mkdir(parents=True)
+    # mode, number of dimensions and size of the block, big endian
+    header = struct.pack(">HH3I", 0, 3, block_size, block_size, block_size)
+    data = np.random.RandomState(0).randint(0, 4, size=block_size ** 3)
+    block.write_bytes(header + data.astype(np.uint8).tobytes())
+
+
+def write_fake_outputs(skeleton, directory, seed=0):
+    """
+    Write the outputs sarbor would produce for a skeleton to
+    directory/outputs. The mesh gets about one triangle per ten nodes.
+    """
+    rng = np.random.RandomState(seed)
+    outputs = directory / "outputs"
+    outputs.mkdir(parents=True)
+
+    node_ids = skeleton.node_ids.tolist()
+    parents = parent_ids(skeleton)
+    nodes = [
+        (node_id, parent_id, x, y, z)
+        for node_id, parent_id, (x, y, z) in zip(
+            node_ids, parents, skeleton.positions.tolist()
+        )
+    ]
+    with (outputs / "nodes.obj").open("wb") as f:
+        pickle.dump(nodes, f)
+
+    n_nodes = len(node_ids)
+    connectivity = rng.rand(n_nodes).tolist()
+    branch = rng.beta(0.5, 5, size=n_nodes).tolist()
+    branch_directions = rng.normal(size=(n_nodes, 3)).tolist()
+    rankings = [
+        (node_id, parent_id, None if parent_id is None else c, b, dx, dy, dz)
+        for node_id, parent_id, c, b, (dx, dy, dz) in zip(
+            node_ids, parents, connectivity, branch, branch_directions
+        )
+    ]
+    with (outputs / "rankings.obj").open("wb") as f:
+        pickle.dump(rankings, f)
+
+    center = skeleton.positions.mean(axis=0)
+    radius = float(np.abs(skeleton.positions - center).max()) + NODE_SPACING
+    write_stl(outputs / "mesh.stl", max(n_nodes // 10, 100), center, radius)
+    write_n5(outputs / "segmentations.n5")
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""Hashing and compression of the content stored in Blob rows.
+
+Blobs are compressed with zstd if the optional `zstandard` package is
+installed and with zlib otherwise. The compression used is stored with
+every blob, so both can be read no matter which one is available when
+the blob is written.
+"""
+import hashlib
+import io
+import zlib
+
+from django.conf import settings
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Size of the chunks files are read in
+CHUNK_SIZE = 1024 * 1024
+
+
+def content_hash(content):
+    """sha256 hex digest of the uncompressed content."""
+    return hashlib.sha256(content).hexdigest()
+
+
+def hash_file(path):
+    """sha256 hex digest and size of a file, read in chunks."""
+    digest = hashlib.sha256()
+    size = 0
+    with open(str(path), "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def compress(content):
+    """Compress bytes, returns the compression used and the compressed data."""
+    return compress_file(io.BytesIO(content))
+
+
+def compress_file(path_or_file):
+    """
+    Compress a file chunk by chunk, returns the compression used and the
+    compressed data. Only the compressed data is held in memory.
+    """
+    if hasattr(path_or_file, "read"):
+        f = path_or_file
+    else:
+        f = open(str(path_or_file), "rb")
+    with f:
+        if zstandard is not None:
+            level = getattr(settings, "AUTOPROOFREADER_ZSTD_LEVEL", 10)
+            out = io.BytesIO()
+            zstandard.ZstdCompressor(level=level).copy_stream(f, out)
+            return "zstd", out.getvalue()
+        compressor = zlib.compressobj(9)
+        chunks = [
+            compressor.compress(chunk)
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b"")
+        ]
+        chunks.append(compressor.flush())
+        return "zlib", b"".join(chunks)
+
+
+def decompress(compression, data):
+    data = bytes(data)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("Reading zstd compressed blobs requires zstandard")
+        # streamed frames don't record their content size
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    elif compression == "zlib":
+        return zlib.decompress(data)
+    elif compression == "none":
+        return data
+    raise ValueError("Unknown blob compression: {}".format(compression))
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""Coalesced broadcasts of review changes.
+
+Reviewers working through the same result see each other's reviews as
+they happen. Sending a message to every viewer for every toggle would
+flood the websocket when nodes are reviewed in quick succession, so
+changes are collected for a short delay and sent as one batch per
+result. Only the last state of a node toggled several times within the
+delay is sent. The timer thread doesn't keep a worker alive, so owners of
+a broadcaster flush it when the worker exits.
+"""
+from collections import OrderedDict
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class ReviewBroadcaster(object):
+    """
+    Collects review changes and passes them to send(result_id, changes)
+    in batches, with changes a list of (node_id, reviewed, editor_id) in
+    the order nodes were first changed. Batches are sent from a timer
+    thread delay seconds after the first change of a batch.
+    """
+
+    def __init__(self, send):
+        self.send = send
+        self.lock = threading.Lock()
+        self.pending = OrderedDict()
+        self.timer = None
+
+    def add(self, result_id, node_id, reviewed, editor_id, delay):
+        with self.lock:
+            changes = self.pending.setdefault(result_id, OrderedDict())
+            changes[node_id] = (node_id, reviewed, editor_id)
+            if self.timer is None:
+                self.timer = threading.Timer(delay, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        """Send all pending changes now."""
+        with self.lock:
+            pending, self.pending = self.pending, OrderedDict()
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        for result_id, changes in pending.items():
+            try:
+                self.send(result_id, list(changes.values()))
+            except Exception:
+                logger.exception(
+                    "Failed to broadcast reviews of result {}".format(result_id)
+                )
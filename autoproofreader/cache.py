@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""In-process cache for decoded result nodes and pre-encoded responses.
+
+Every worker process holds one cache bounded by the total size of its
+entries in bytes. Entries are stored together with a fingerprint of the
+mutable state they were built from (e.g. the review state of a result),
+so a change made by another process is detected on the next lookup.
+Changes made by this process invalidate entries explicitly.
+"""
+from collections import OrderedDict
+import threading
+
+import numpy as np
+
+from django.conf import settings
+
+
+class ByteLRUCache(object):
+    """
+    A thread safe least recently used cache bounded by the total size of
+    its values in bytes. Keys are tuples whose first two items are the
+    kind of entry and the id it belongs to, e.g. ("node-response", 5).
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, fingerprint=None):
+        """
+        Return the value stored under key, or None. Values stored with a
+        different fingerprint are stale and are dropped.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] != fingerprint:
+                self._remove(key)
+                self.invalidations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, fingerprint=None, nbytes=None):
+        if nbytes is None:
+            nbytes = estimate_size(value)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (fingerprint, value, nbytes)
+            self._size += nbytes
+            while self._size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, kind=None, owner=None):
+        """
+        Drop all entries of the given kind and/or owner id. Without
+        arguments the whole cache is cleared.
+        """
+        with self._lock:
+            stale = [
+                key
+                for key in self._entries
+                if (kind is None or key[0] == kind)
+                and (owner is None or key[1] == owner)
+            ]
+            for key in stale:
+                self._remove(key)
+            self.invalidations += len(stale)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size": self._size,
+                "max_size": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _remove(self, key):
+        self._size -= self._entries.pop(key)[2]
+
+
+def estimate_size(value):
+    """Approximate size in bytes of encoded responses and node columns."""
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(estimate_size(v) for v in value.values())
+    return 64
+
+
+# The cache shared by all requests handled by this process
+result_cache = ByteLRUCache(
+    getattr(settings, "AUTOPROOFREADER_CACHE_SIZE", 256 * 1024 * 1024)
+)
+
+
+def invalidate_result(result):
+    """Drop everything cached about a result and the listings containing it."""
+    result_cache.invalidate("node-arrays", result.id)
+    result_cache.invalidate("node-response", result.id)
+    result_cache.invalidate("result-listing", result.project_id)
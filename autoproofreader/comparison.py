@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""Comparison of the rankings of two results.
+
+Results of the same skeleton run with different models or sarbor settings
+are joined node by node, by node id if both have the same nodes and by
+nearest position otherwise, e.g. if they were resampled differently. The
+scores of joined nodes are compared by their differences, their Spearman
+rank correlation and the nodes they disagree on most.
+
+Nearest nodes are found without a spatial index: nodes are hashed into a
+grid of cells as large as the largest allowed distance, so the nearest
+node within that distance is in one of the 27 cells around a node. All
+candidates of a cell are compared at once with array operations.
+"""
+from collections import OrderedDict
+import itertools
+
+import numpy as np
+
+# Scores compared between results
+COMPARED_SCORES = ("branch_score", "connectivity_score")
+
+# Ways of joining the nodes of two results
+MATCH_MODES = ("auto", "node_id", "position")
+
+# Largest distance in nm between nodes joined by position, by default and
+# at most. Larger distances put too many nodes in every grid cell.
+DEFAULT_MAX_DISTANCE = 500.0
+MAX_DISTANCE = 10000.0
+
+# Number of disagreements returned by default
+DEFAULT_TOP_K = 20
+
+# Nodes searched for their nearest node at once
+MATCH_CHUNK_SIZE = 65536
+
+# Candidate pairs compared at once, chunks pairing more nodes are split
+MAX_CANDIDATE_PAIRS = 2 ** 24
+
+
+def match_by_node_id(node_ids_a, node_ids_b):
+    """Indices of the nodes of a and b that have the same node id."""
+    _, index_a, index_b = np.intersect1d(
+        node_ids_a, node_ids_b, assume_unique=True, return_indices=True
+    )
+    return index_a, index_b
+
+
+def match_by_position(positions_a, positions_b, max_distance):
+    """
+    Join every node of a with the nearest node of b that is at most
+    max_distance away. Returns the indices of the joined nodes of a and b
+    and their distances. Several nodes of a may be joined with the same
+    node of b. Raises ValueError if a single node has more than
+    MAX_CANDIDATE_PAIRS candidates.
+    """
+    empty = np.empty(0, dtype=np.int64)
+    if len(positions_a) == 0 or len(positions_b) == 0:
+        return empty, empty, np.empty(0)
+    origin = np.minimum(positions_a.min(axis=0), positions_b.min(axis=0))
+    cells_a = np.floor((positions_a - origin) / max_distance).astype(np.int64)
+    cells_b = np.floor((positions_b - origin) / max_distance).astype(np.int64)
+    # Cells are shifted by one so their neighbors have non-negative keys
+    extent = np.maximum(cells_a.max(axis=0), cells_b.max(axis=0)) + 3
+
+    def cell_keys(cells):
+        return ((cells[:, 0] + 1) * extent[1] + cells[:, 1] + 1) * extent[2] + (
+            cells[:, 2] + 1
+        )
+
+    order_b = np.argsort(cell_keys(cells_b), kind="stable")
+    sorted_keys = cell_keys(cells_b)[order_b]
+
+    nearest = np.full(len(positions_a), -1, dtype=np.int64)
+    distances = np.full(len(positions_a), np.inf)
+    for start in range(0, len(positions_a), MATCH_CHUNK_SIZE):
+        rows = np.arange(start, min(start + MATCH_CHUNK_SIZE, len(positions_a)))
+        for offset in itertools.product((-1, 0, 1), repeat=3):
+            keys = cell_keys(cells_a[rows] + np.array(offset))
+            first = np.searchsorted(sorted_keys, keys, side="left")
+            counts = np.searchsorted(sorted_keys, keys, side="right") - first
+            if len(counts) == 0 or counts.max() == 0:
+                continue
+            if counts.max() > MAX_CANDIDATE_PAIRS:
+                raise ValueError(
+                    "Too many nodes within max_distance, use a smaller max_distance"
+                )
+
+            # Rows are split into parts of at most MAX_CANDIDATE_PAIRS pairs
+            ends = np.cumsum(counts)
+            part_start = 0
+            while part_start < len(rows):
+                paired = ends[part_start] - counts[part_start]
+                part_end = np.searchsorted(
+                    ends, paired + MAX_CANDIDATE_PAIRS, side="right"
+                )
+                part = slice(part_start, part_end)
+                _join_closest(
+                    rows[part],
+                    first[part],
+                    counts[part],
+                    order_b,
+                    positions_a,
+                    positions_b,
+                    nearest,
+                    distances,
+                )
+                part_start = part_end
+
+    joined = np.flatnonzero(distances <= max_distance)
+    return joined, nearest[joined], distances[joined]
+
+
+def _join_closest(
+    rows, first, counts, order_b, positions_a, positions_b, nearest, distances
+):
+    """
+    Pair every node of a in rows with the counts nodes of b starting at
+    first in order_b, and keep the closest of them if it is closer than
+    the nearest node found so far.
+    """
+    total = counts.sum()
+    if total == 0:
+        return
+    pair_rows = np.repeat(rows, counts)
+    pair_starts = np.repeat(first - (np.cumsum(counts) - counts), counts)
+    candidates = order_b[np.arange(total) + pair_starts]
+    pair_distances = np.linalg.norm(
+        positions_a[pair_rows] - positions_b[candidates], axis=1
+    )
+
+    # The closest candidate of every node comes first
+    order = np.lexsort((pair_distances, pair_rows))
+    closest = np.ones(total, dtype=bool)
+    closest[1:] = pair_rows[order][1:] != pair_rows[order][:-1]
+    best = order[closest]
+    best_rows = pair_rows[best]
+    better = pair_distances[best] < distances[best_rows]
+    nearest[best_rows[better]] = candidates[best][better]
+    distances[best_rows[better]] = pair_distances[best][better]
+
+
+def rank(values):
+    """Ranks of values starting at 1, tied values share their mean rank."""
+    order = np.argsort(values, kind="mergesort")
+    sorted_values = values[order]
+    first = np.ones(len(values), dtype=bool)
+    first[1:] = sorted_values[1:] != sorted_values[:-1]
+    starts = np.flatnonzero(first)
+    ends = np.append(starts[1:], len(values))
+    ranks = np.empty(len(values))
+    ranks[order] = ((starts + ends + 1) / 2)[np.cumsum(first) - 1]
+    return ranks
+
+
+def rank_correlation(x, y):
+    """Spearman rank correlation, None if either side is constant."""
+    if len(x) < 2:
+        return None
+    rank_x, rank_y = rank(x), rank(y)
+    if np.all(rank_x == rank_x[0]) or np.all(rank_y == rank_y[0]):
+        return None
+    return float(np.corrcoef(rank_x, rank_y)[0, 1])
+
+
+def review_order(scores):
+    """
+    Position of every node when reviewing by descending score, starting at
+    1. Nodes without a score have none.
+    """
+    positions = np.full(len(scores), np.nan)
+    scored = np.flatnonzero(np.isfinite(scores))
+    order = scored[np.argsort(-scores[scored], kind="stable")]
+    positions[order] = np.arange(1, len(order) + 1)
+    return positions
+
+
+def _position(value):
+    return None if not np.isfinite(value) else int(value)
+
+
+def compare_nodes(
+    columns_a,
+    columns_b,
+    match="auto",
+    max_distance=DEFAULT_MAX_DISTANCE,
+    top_k=DEFAULT_TOP_K,
+    score="branch_score",
+):
+    """
+    Compare the decoded nodes of two results (see decode_result_nodes).
+    Returns the number of joined nodes, for every score the mean and
+    largest differences of b to a and their rank correlation, and the top_k
+    joined nodes whose score differs the most.
+    """
+    if match not in MATCH_MODES:
+        raise ValueError(
+            "Unknown match {}, expected one of {}".format(match, ", ".join(MATCH_MODES))
+        )
+    if score not in COMPARED_SCORES:
+        raise ValueError(
+            "Unknown score {}, expected one of {}".format(
+                score, ", ".join(COMPARED_SCORES)
+            )
+        )
+    if not 0 < max_distance <= MAX_DISTANCE:
+        raise ValueError(
+            "max_distance has to be positive and at most {}".format(MAX_DISTANCE)
+        )
+
+    node_ids_a, node_ids_b = columns_a["node_id"], columns_b["node_id"]
+    if match == "auto":
+        same_nodes = len(node_ids_a) == len(node_ids_b) and np.array_equal(
+            np.sort(node_ids_a), np.sort(node_ids_b)
+        )
+        match = "node_id" if same_nodes else "position"
+
+    positions_a, positions_b = (
+        np.stack([columns[axis] for axis in ("x", "y", "z")], axis=1).reshape(-1, 3)
+        for columns in (columns_a, columns_b)
+    )
+    if match == "node_id":
+        index_a, index_b = match_by_node_id(node_ids_a, node_ids_b)
+        distances = None
+    else:
+        index_a, index_b, distances = match_by_position(
+            positions_a, positions_b, max_distance
+        )
+
+    comparison = OrderedDict(
+        [
+            ("match", match),
+            ("nodes_a", len(node_ids_a)),
+            ("nodes_b", len(node_ids_b)),
+            ("matched", len(index_a)),
+            ("unmatched_a", len(node_ids_a) - len(np.unique(index_a))),
+            ("unmatched_b", len(node_ids_b) - len(np.unique(index_b))),
+            (
+                "mean_distance",
+                None
+                if distances is None or len(distances) == 0
+                else float(distances.mean()),
+            ),
+            ("scores", OrderedDict()),
+        ]
+    )
+    for name in COMPARED_SCORES:
+        a = columns_a[name][index_a].astype(np.float64)
+        b = columns_b[name][index_b].astype(np.float64)
+        valid = np.isfinite(a) & np.isfinite(b)
+        deltas = b[valid] - a[valid]
+        comparison["scores"][name] = OrderedDict(
+            [
+                ("compared", int(valid.sum())),
+                ("mean_delta", float(deltas.mean()) if len(deltas) > 0 else None),
+                (
+                    "mean_abs_delta",
+                    float(np.abs(deltas).mean()) if len(deltas) > 0 else None,
+                ),
+                (
+                    "max_abs_delta",
+                    float(np.abs(deltas).max()) if len(deltas) > 0 else None,
+                ),
+                ("rank_correlation", rank_correlation(a[valid], b[valid])),
+            ]
+        )
+
+    scores_a = columns_a[score].astype(np.float64)
+    scores_b = columns_b[score].astype(np.float64)
+    deltas = scores_b[index_b] - scores_a[index_a]
+    valid = np.flatnonzero(np.isfinite(deltas))
+    if len(valid) > top_k:
+        valid = valid[np.argpartition(-np.abs(deltas[valid]), top_k)[:top_k]]
+    top = valid[np.argsort(-np.abs(deltas[valid]), kind="stable")]
+    order_a, order_b = review_order(scores_a), review_order(scores_b)
+    comparison["disagreements"] = [
+        OrderedDict(
+            [
+                ("node_id_a", int(node_ids_a[index_a[i]])),
+                ("node_id_b", int(node_ids_b[index_b[i]])),
+                ("x", float(positions_a[index_a[i], 0])),
+                ("y", float(positions_a[index_a[i], 1])),
+                ("z", float(positions_a[index_a[i], 2])),
+                ("score_a", float(scores_a[index_a[i]])),
+                ("score_b", float(scores_b[index_b[i]])),
+                ("delta", float(deltas[i])),
+                ("review_order_a", _position(order_a[index_a[i]])),
+                ("review_order_b", _position(order_b[index_b[i]])),
+            ]
+        )
+        for i in top.tolist()
+    ]
+    return comparison
@@ -1,10 +1,73 @@
 # -*- coding: utf-8 -*-
 """Methods called by API endpoints"""
 from rest_framework.decorators import api_view
-from django.http import JsonResponse
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import (
+    HttpResponse,
+    HttpResponseForbidden,
+    HttpResponseNotFound,
+    JsonResponse,
+)
+
+from catmaid.control.authentication import requires_user_role
+from catmaid.models import UserRole
+
+from autoproofreader.cache import result_cache
+from autoproofreader.monitoring import render_metrics
+from autoproofreader.profiling import list_profiles, profile_path
 
 
 @api_view(['GET'])
 def is_installed(request, project_id=None):
     """Check whether the extension CATMAID-autoproofreader is installed."""
     return JsonResponse({'is_installed': True, 'msg': 'CATMAID-autoproofreader is installed'})
+
+
+@api_view(['GET'])
+@requires_user_role(UserRole.Admin)
+def cache_stats(request, project_id):
+    """Hit, miss and eviction counters of this worker's result cache."""
+    return JsonResponse(result_cache.stats())
+
+
+@api_view(['GET'])
+@requires_user_role(UserRole.Admin)
+def profiles(request, project_id):
+    """List the stored profiles of views and job stages, newest first."""
+    return JsonResponse(
+        list_profiles(),
+        safe=False,
+        encoder=DjangoJSONEncoder,
+        json_dumps_params={"sort_keys": True, "indent": 4},
+    )
+
+
+@api_view(['GET'])
+@requires_user_role(UserRole.Admin)
+def download_profile(request, project_id, name):
+    """Download a stored profile in the collapsed stack format."""
+    path = profile_path(name)
+    if path is None:
+        return HttpResponseNotFound("No profile named {}".format(name))
+    response = HttpResponse(path.read_text(), content_type="text/plain")
+    response["Content-Disposition"] = 'attachment; filename="{}"'.format(path.name)
+    return response
+
+
+def monitoring_metrics(request):
+    """Operational metrics in the Prometheus text exposition format.
+
+    Scrapers authenticate with the AUTOPROOFREADER_MONITORING_TOKEN setting
+    as bearer token, superusers can read the metrics without it.
+    """
+    token = getattr(settings, "AUTOPROOFREADER_MONITORING_TOKEN", None)
+    authorization = request.META.get("HTTP_AUTHORIZATION", "")
+    if not (
+        (token is not None and authorization == "Bearer {}".format(token))
+        or request.user.is_superuser
+    ):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -1,22 +1,34 @@
 # -*- coding: utf-8 -*-
 import datetime
+import heapq
+import shutil
 import subprocess
+import threading
+import uuid
 from pathlib import Path
 import json
 import pickle
 import pytz
-from collections import namedtuple
+from collections import Counter, OrderedDict, namedtuple
 import logging
 
 from django.conf import settings
-from django.http import JsonResponse, HttpResponseNotFound
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import (
+    HttpResponse,
+    JsonResponse,
+    HttpResponseBadRequest,
+    HttpResponseNotFound,
+)
 from django.utils.decorators import method_decorator
+from django.db import connection, transaction
 from django.db.models import Q
 from django.shortcuts import get_object_or_404
 
 from catmaid.consumers import msg_user
 from catmaid.control.authentication import requires_user_role
-from catmaid.models import Message, User, UserRole, Volume
+from catmaid.control.common import get_request_bool
+from catmaid.models import ClassInstance, Message, User, UserRole, Volume
 from catmaid.control.message import notify_user
 from catmaid.control.volume import (
     TriangleMeshVolume,
@@ -24,25 +36,104 @@ from catmaid.control.volume import (
     _stl_ascii_to_indexed_triangles,
 )
 
+from celery import current_app
 from celery.task import task
 
 from rest_framework.views import APIView
 from rest_framework.decorators import api_view
 
 from autoproofreader.models import (
+    AutoproofreaderBatch,
     AutoproofreaderResult,
+    AutoproofreaderResultListingSerializer,
     AutoproofreaderResultSerializer,
-    ConfigFile,
+    AutoproofreaderResultSummarySerializer,
+    Blob,
     ComputeServer,
+    ConfigFile,
     DiluvianModel,
     ProofreadTreeNodes,
 )
+from autoproofreader.cache import result_cache
 from autoproofreader.control.compute_server import GPUUtilAPI
+from autoproofreader.control.proofread_tree_nodes import (
+    copy_proofread_nodes,
+    score_row_columns,
+    store_result_summary,
+)
+from autoproofreader.metrics import JobMetrics, directory_size
+from autoproofreader.node_arrays import node_storage_mode, write_node_arrays
+from autoproofreader.resampling import resample_skeleton_csv
+from autoproofreader.transports import PROCESS_MARKER, get_transport
+from autoproofreader.uploads import export_skeleton, stream_upload
 
 
 # The path were server side exported files get stored in
 output_path = Path(settings.MEDIA_ROOT, settings.MEDIA_EXPORT_SUBDIRECTORY)
 
+# Stages of a job in the order they are run in. Completed stages are recorded
+# on the result, so an interrupted job resumes after the last of them.
+STAGES = (
+    "stage_in",
+    "compute",
+    "stage_out",
+    "ingest",
+    "mesh",
+    "segmentation",
+    "cleanup",
+)
+
+# Statuses of running jobs. Jobs are "partial" once some of their rankings
+# were ingested while sarbor is still running (see PartialIngester).
+RUNNING_STATUSES = ("computing", "partial")
+
+# Statuses of jobs that are not done yet
+ACTIVE_STATUSES = ("queued",) + RUNNING_STATUSES
+
+# Priority levels of jobs, jobs with higher levels are dispatched first
+PRIORITIES = OrderedDict([("low", 0), ("normal", 1), ("high", 2)])
+
+# Files every job submission has to include
+REQUIRED_FILES = ("job_config.json", "sarbor_config.toml", "all_settings.toml")
+
+# Result fields that can change after a result was created. A cached result
+# listing is only reused if none of these changed.
+LISTING_STATE_FIELDS = (
+    "id",
+    "status",
+    "private",
+    "permanent",
+    "completion_time",
+    "edition_time",
+    "volume_id",
+    "node_storage",
+    "partial_nodes",
+)
+
+# Fields returned by the summary mode of the results listing
+SUMMARY_FIELDS = (
+    "id",
+    "name",
+    "status",
+    "skeleton",
+    "model",
+    "config",
+    "volume",
+    "user",
+    "project",
+    "creation_time",
+    "edition_time",
+    "completion_time",
+    "private",
+    "permanent",
+    "node_storage",
+    "partial_nodes",
+    "batch",
+)
+
+# Default number of results per page in summary mode
+RESULTS_PAGE_SIZE = 100
+
 
 class AutoproofreaderTaskAPI(APIView):
     @method_decorator(requires_user_role(UserRole.QueueComputeTask))
@@ -57,7 +148,10 @@ class AutoproofreaderTaskAPI(APIView):
         ---
         parameters:
           - name: job_config.json
-            description: Config file containing job initialization information
+            description: |
+              Config file containing job initialization information. Any file
+              may instead be uploaded gzip compressed with a .gz suffix, e.g.
+              skeleton.csv.gz
             required: true
             type: file
             paramType: form
@@ -67,8 +161,13 @@ class AutoproofreaderTaskAPI(APIView):
             type: file
             paramType: form
           - name: skeleton.csv
-            description: Csv file containing rows of (node_id, parent_id, x, y, z)
-            required: true
+            description: |
+              Csv file containing rows of (node_id, parent_id, x, y, z). If it
+              is not provided, the skeleton given by skeleton_id in
+              job_config.json is exported from the database. With a
+              resample_spacing in job_config.json it is resampled to sample
+              points that far apart in nm before it is sent to sarbor.
+            required: false
             type: file
             paramType: form
           - name: all_settings.toml
@@ -93,27 +192,37 @@ class AutoproofreaderTaskAPI(APIView):
             paramType: form
         """
 
-        files = {f.name: f.read().decode("utf-8") for f in request.FILES.values()}
-        all_settings, job_config, job_name, local_temp_dir = self._handle_files(files)
-        settings_config = ConfigFile(
-            user_id=request.user.id, project_id=project_id, config=all_settings
+        try:
+            all_settings, job_config, job_name, local_temp_dir = self._handle_files(
+                request.FILES.values(), project_id
+            )
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+        segmentation_type = job_config.get("segmentation_type", None)
+        if segmentation_type is None:
+            shutil.rmtree(str(local_temp_dir), ignore_errors=True)
+            return HttpResponseBadRequest(
+                "Segmentation type not available: {}".format(job_config)
+            )
+        try:
+            skeleton_id = get_config_id(job_config, "skeleton_id")
+            references = get_job_references(job_config, project_id, [skeleton_id])
+            priority = get_priority(job_config, "normal")
+            limits = get_job_limits(job_config)
+        except ValueError as e:
+            shutil.rmtree(str(local_temp_dir), ignore_errors=True)
+            return HttpResponseBadRequest(str(e))
+        # The snapshot keeps every treenode, sarbor may only get samples
+        skeleton_blob = Blob.store_file(local_temp_dir / "skeleton.csv")
+        try:
+            sample_mapping_blob = resample_job_skeleton(local_temp_dir, job_config)
+        except ValueError as e:
+            Blob.release(skeleton_blob.id)
+            shutil.rmtree(str(local_temp_dir), ignore_errors=True)
+            return HttpResponseBadRequest(str(e))
+        settings_config = ConfigFile.for_content(
+            request.user.id, project_id, all_settings
         )
-        settings_config.save()
-
-        # retrieve necessary paths from the chosen server and model
-        server = ComputeServer.objects.get(id=job_config["server_id"])
-        server_paths = {
-            "address": server.address,
-            "working_dir": server.diluvian_path[2:]
-            if server.diluvian_path.startswith("~/")
-            else server.diluvian_path,
-            "results_dir": server.results_directory,
-            "env_source": server.environment_source_path,
-        }
-
-        # Get the ssh key for the desired server
-        ssh_key = settings.SSH_KEY_PATH + "/" + server.ssh_key
-        ssh_user = server.ssh_user
 
         # store a job in the database now so that information about
         # ongoing jobs can be retrieved.
@@ -124,92 +233,66 @@ class AutoproofreaderTaskAPI(APIView):
             user_id=request.user.id,
             project_id=project_id,
             config_id=settings_config.id,
-            skeleton_id=job_config["skeleton_id"],
-            skeleton_csv=files["skeleton.csv"],
-            model_id=job_config["model_id"],
+            skeleton_id=skeleton_id,
+            skeleton_blob=skeleton_blob,
+            sample_mapping_blob=sample_mapping_blob,
+            segmentation_type=segmentation_type,
+            priority=priority,
             name=job_name,
             status="queued",
             private=True,
             # gpus=gpus,
+            **references,
+            **limits
         )
         result.save()
 
-        media_folder = Path(settings.MEDIA_ROOT)
-        segmentations_dir = (
-            media_folder / "proofreading_segmentations" / str(result.uuid)
-        )
-
         msg_user(request.user.id, "autoproofreader-result-update", {"status": "queued"})
 
         # if self._check_gpu_conflict():
         #     raise Exception("Not enough compute resources for this job")
 
-        if job_config.get("segmentation_type", None) == "diluvian":
-
-            # retrieve the configurations used during the chosen models training.
-            # this is used as the base configuration when running since most
-            # settings should not be changed or are irrelevant to autoproofreading a
-            # skeleton. The settings that do need to be overridden are handled
-            # by the config generated by the widget.
-            model = DiluvianModel.objects.get(id=job_config["model_id"])
-            if model.config_id is not None:
-                query = ConfigFile.objects.get(id=int(model.config_id))
-                model_config = query.config
-                file_path = local_temp_dir / "model_config.toml"
-                file_path.write_text(model_config)
-
-            server_paths["model_file"] = model.model_source_path
-
-        if job_config.get("segmentation_type", None) is not None:
-            # Retrieve segmentation
-            x = query_segmentation_async.delay(
-                result,
-                project_id,
-                request.user.id,
-                ssh_key,
-                ssh_user,
-                local_temp_dir,
-                segmentations_dir,
-                server_paths,
-                job_name,
-                job_config["segmentation_type"],
-            )
-        else:
-            raise ValueError("Segmentation type not available: {}".format(job_config))
+        if segmentation_type == "diluvian":
+            write_model_config(result.model, local_temp_dir)
 
-        # Send a response to let the user know the async funcion has started
-        return JsonResponse({"task_id": x.task_id, "status": "queued"})
+        request_dispatch(result.server_id)
 
-    def _handle_files(self, files):
-        # Check for basic files
-        for x in [
-            "job_config.json",
-            "sarbor_config.toml",
-            "skeleton.csv",
-            "all_settings.toml",
-        ]:
-            if x not in files.keys():
-                raise Exception(x + " is missing!")
-
-        job_config = json.loads(files["job_config.json"])
-        all_settings = files["all_settings.toml"]
-
-        # the name of the job, used for storing temporary files
-        # and refering to past runs
-        job_name = self._get_job_name(job_config)
-
-        # If the temporary directory doesn't exist, create it
-        media_folder = Path(settings.MEDIA_ROOT)
-        if not (media_folder / job_name).exists():
-            (media_folder / job_name).mkdir()
-        local_temp_dir = media_folder / job_name
-
-        # Create a copy of the files sent in the request in the
-        # temporary directory so that it can be copied with scp
-        # in the async function
-        for f in files:
-            file_path = local_temp_dir / f
-            file_path.write_text(files[f])
+        # Send a response to let the user know the job was queued. Jobs are
+        # dispatched by a task, so their task id isn't known yet.
+        return JsonResponse(
+            {"task_id": result.task_id, "result_id": result.id, "status": "queued"}
+        )
+
+    def _handle_files(self, uploads, project_id):
+        """
+        Stage the uploaded files and move them to the directory of the job
+        once the job config has been read. Without an uploaded
+        skeleton.csv the skeleton is exported server side.
+        """
+        staging_dir, job_config = stage_uploads(uploads)
+        try:
+            all_settings = (staging_dir / "all_settings.toml").read_text()
+            if not (staging_dir / "skeleton.csv").exists():
+                if job_config.get("skeleton_id", None) is None:
+                    raise ValueError("skeleton.csv or skeleton_id is missing!")
+                export_skeleton(job_config["skeleton_id"], project_id, staging_dir)
+
+            # the name of the job, used for storing temporary files
+            # and refering to past runs
+            job_name = self._get_job_name(job_config)
+        except Exception:
+            shutil.rmtree(str(staging_dir), ignore_errors=True)
+            raise
+
+        # Move the files to the temporary directory of this job so that
+        # they can be copied with scp in the async function
+        local_temp_dir = Path(settings.MEDIA_ROOT) / job_name
+        if not local_temp_dir.exists():
+            staging_dir.rename(local_temp_dir)
+        else:
+            for f in staging_dir.iterdir():
+                f.replace(local_temp_dir / f.name)
+            staging_dir.rmdir()
 
         return all_settings, job_config, job_name, local_temp_dir
 
@@ -265,246 +348,1095 @@ class AutoproofreaderTaskAPI(APIView):
 
     def _get_diluvian_config(self, user_id, project_id, config):
         """
-        get a configuration object for this project. It may make sense to reuse
-        configurations accross runs, but that is currently not supported.
+        get a configuration object for this project. Identical configurations
+        are shared accross runs.
         """
-        return ConfigFile(user_id=user_id, project_id=project_id, config=config)
+        return ConfigFile.for_content(user_id, project_id, config)
 
 
-@task()
-def query_segmentation_async(
-    result,
-    project_id,
-    user_id,
-    ssh_key,
-    ssh_user,
-    local_temp_dir,
-    segmentations_dir,
-    server,
-    job_name,
-    job_type,
-):
-    result.status = "computing"
+def stage_uploads(uploads):
+    """
+    Stream uploaded job files into a new staging directory in MEDIA_ROOT.
+    Returns the directory and the parsed job config.
+    """
+    staging_dir = Path(settings.MEDIA_ROOT) / "upload_{}".format(uuid.uuid4().hex)
+    staging_dir.mkdir()
+    try:
+        for upload in uploads:
+            stream_upload(upload, staging_dir)
+
+        # Check for basic files
+        for x in REQUIRED_FILES:
+            if not (staging_dir / x).exists():
+                raise ValueError(x + " is missing!")
+
+        job_config = json.loads((staging_dir / "job_config.json").read_text())
+    except Exception:
+        shutil.rmtree(str(staging_dir), ignore_errors=True)
+        raise
+    return staging_dir, job_config
+
+
+def write_model_config(model, directory):
+    """
+    Write the configuration used during the chosen models training to
+    directory. This is used as the base configuration when running since
+    most settings should not be changed or are irrelevant to
+    autoproofreading a skeleton. The settings that do need to be
+    overridden are handled by the config generated by the widget.
+    """
+    if model.config_id is not None:
+        model_config = ConfigFile.objects.get(id=int(model.config_id)).content
+        (directory / "model_config.toml").write_text(model_config)
+
+
+def get_server_paths(server):
+    """Paths on a compute server needed to run a job."""
+    return {
+        "address": server.address,
+        "working_dir": server.diluvian_path[2:]
+        if server.diluvian_path.startswith("~/")
+        else server.diluvian_path,
+        "results_dir": server.results_directory,
+        "env_source": server.environment_source_path,
+        "worker_socket": server.worker_socket,
+    }
+
+
+def enqueue_jobs(results):
+    """
+    Start one celery task running the given jobs as a pack. The task id is
+    stored on the results before the task is sent, so the task can always
+    be found from its jobs.
+    """
+    task_id = str(uuid.uuid4())
+    for result in results:
+        result.task_id = task_id
+        result.save()
+    result_ids = tuple(result.id for result in results)
+    transaction.on_commit(
+        lambda: query_segmentation_async.apply_async(result_ids, task_id=task_id)
+    )
+    return task_id
+
+
+def stage_batch_job(batch, result):
+    """
+    Fill the directory of a job in a batch with the files shared by the
+    batch and a snapshot of its skeleton, resampled if the batch config
+    asks for it. Returns the number of nodes sent to sarbor.
+    """
+    local_temp_dir = result.staging_dir
+    local_temp_dir.mkdir(exist_ok=True)
+    for f in batch.staging_dir.iterdir():
+        shutil.copy(str(f), str(local_temp_dir / f.name))
+
+    job_config_path = local_temp_dir / "job_config.json"
+    job_config = json.loads(job_config_path.read_text())
+    job_config["skeleton_id"] = result.skeleton_id
+    job_config["job_name"] = result.name
+    job_config_path.write_text(json.dumps(job_config))
+
+    skeleton_path = export_skeleton(
+        result.skeleton_id, result.project_id, local_temp_dir
+    )
+    skeleton_blob = Blob.store_file(skeleton_path)
+    try:
+        result.sample_mapping_blob = resample_job_skeleton(local_temp_dir, job_config)
+    except ValueError:
+        Blob.release(skeleton_blob.id)
+        raise
+    result.skeleton_blob = skeleton_blob
     result.save()
-    msg_user(user_id, "autoproofreader-result-update", {"status": "computing"})
-
-    # copy temp files from django local temp media storage to server temp storage
-    setup = (
-        "scp -i {ssh_key} -pr {local_dir} "
-        + "{ssh_user}@{server_address}:{server_results_dir}/{job_dir}"
-    ).format(
-        **{
-            "local_dir": local_temp_dir,
-            "server_address": server["address"],
-            "server_results_dir": server["results_dir"],
-            "job_dir": job_name,
-            "ssh_key": ssh_key,
-            "ssh_user": ssh_user,
-        }
+    with skeleton_path.open() as f:
+        return sum(1 for _ in f)
+
+
+def stage_job(result):
+    """
+    Prepare the directory of a job before it is dispatched. Jobs of a
+    batch are staged from the files shared by the batch. Returns the
+    number of nodes of the skeleton.
+    """
+    if result.batch_id is not None and result.skeleton_blob_id is None:
+        return stage_batch_job(result.batch, result)
+    skeleton_path = result.staging_dir / "skeleton.csv"
+    with skeleton_path.open() as f:
+        return sum(1 for _ in f)
+
+
+def get_queue(server_id):
+    """
+    Jobs on a server that have not been dispatched yet, in the order they
+    will be dispatched in, and the number of tasks running on the server.
+
+    Jobs with a higher priority go first. Within a priority level, the job
+    of the user and then project with the fewest jobs running or ahead in
+    the queue goes first, so no single user or project can hold up
+    everyone else.
+    """
+    jobs = AutoproofreaderResult.objects.filter(
+        server_id=server_id, status__in=ACTIVE_STATUSES
     )
-    files = {}
-    for f in local_temp_dir.iterdir():
-        files[f.name.split(".")[0]] = Path(
-            "~/", server["results_dir"], job_name, f.name
+    running = jobs.filter(task_id__isnull=False)
+    n_tasks = running.values("task_id").distinct().count()
+    by_user = Counter(running.values_list("user_id", flat=True))
+    by_project = Counter(running.values_list("project_id", flat=True))
+
+    def share(result):
+        return (
+            -result.priority,
+            by_user[result.user_id],
+            by_project[result.project_id],
+            result.id,
         )
 
-    if job_type == "diluvian":
-        extra_parameters = (
-            "--model-weights-file {model_file} "
-            + "--model-training-config {model_config_file} "
-            + "--model-job-config {job_config_file} "
-            + "--volume-file {volume_file} "
-        ).format(
-            **{
-                "model_file": server["model_file"],
-                "model_config_file": files["model_config"],
-                "job_config_file": files["diluvian_config"],
-                "volume_file": files["volume"],
-            }
+    # Shares only grow, so entries with an outdated share are pushed back
+    # with their current one until the first entry is up to date.
+    heap = [
+        (share(result), result)
+        for result in jobs.filter(status="queued", task_id__isnull=True)
+    ]
+    heapq.heapify(heap)
+    queue = []
+    while len(heap) > 0:
+        key, result = heapq.heappop(heap)
+        current = share(result)
+        if current != key:
+            heapq.heappush(heap, (current, result))
+            continue
+        queue.append(result)
+        by_user[result.user_id] += 1
+        by_project[result.project_id] += 1
+    return queue, n_tasks
+
+
+def dispatch_jobs(server_id):
+    """
+    Start queued jobs of a server in queue order until max_concurrent_jobs
+    tasks are running on it. Called whenever jobs are queued and whenever
+    a task finishes.
+
+    Small jobs with the same model and segmentation type are packed into
+    a single task of up to AUTOPROOFREADER_PACK_SIZE jobs, which copies
+    their files at once and runs sarbor for each of them in one session on
+    the server. Skeletons with more than AUTOPROOFREADER_PACK_MAX_NODES
+    nodes always run on their own. A batch never runs more than its own
+    max_concurrent_jobs tasks at once.
+    """
+    if server_id is None:
+        return
+    pack_size = getattr(settings, "AUTOPROOFREADER_PACK_SIZE", 4)
+    pack_max_nodes = getattr(settings, "AUTOPROOFREADER_PACK_MAX_NODES", 10000)
+
+    with transaction.atomic():
+        server = ComputeServer.objects.select_for_update().filter(id=server_id).first()
+        if server is None:
+            # The server was deleted, its jobs don't belong to it anymore
+            return
+        queue, n_tasks = get_queue(server_id)
+        batch_tasks = Counter(
+            batch_id
+            for batch_id, task_id in AutoproofreaderResult.objects.filter(
+                server_id=server_id,
+                status__in=ACTIVE_STATUSES,
+                batch__isnull=False,
+                task_id__isnull=False,
+            )
+            .values_list("batch_id", "task_id")
+            .distinct()
         )
-    elif job_type == "cached_lsd":
-        extra_parameters = "--cached-lsd-config {} ".format(files["cached_lsd_config"])
-    else:
-        extra_parameters = ""
-
-    # connect to the server and run the autoproofreader algorithm on the provided skeleton
-    query_seg = (
-        "ssh -i {ssh_key} {ssh_user}@{server}\n"
-        + "source {server_ff_env_path}\n"
-        + "sarbor-error-detector "
-        + "--skeleton-csv {skeleton_file} "
-        + "--sarbor-config {sarbor_config} "
-        + "--output-file {output_file} "
-        + "{segmentation_type} "
-        + "{type_parameters}"
-    ).format(
-        **{
-            "ssh_key": ssh_key,
-            "ssh_user": ssh_user,
-            "server": server["address"],
-            "server_ff_env_path": server["env_source"],
-            "skeleton_file": files["skeleton"],
-            "sarbor_config": files["sarbor_config"],
-            "output_file": Path(server["results_dir"], job_name, "outputs"),
-            "segmentation_type": job_type.replace("_", "-"),
-            "type_parameters": extra_parameters,
-        }
+
+        def batch_full(result, batch_ids=()):
+            batch = result.batch
+            return (
+                batch is not None
+                and batch.id not in batch_ids
+                and batch_tasks[batch.id] >= batch.max_concurrent_jobs
+            )
+
+        free = server.max_concurrent_jobs - n_tasks
+        dispatched = set()
+        for i, result in enumerate(queue):
+            if free <= 0:
+                break
+            if result.id in dispatched or batch_full(result):
+                continue
+            try:
+                n_nodes = stage_job(result)
+            except (ValueError, OSError) as e:
+                fail_unstaged_job(result, e)
+                continue
+
+            pack = [result]
+            batch_ids = {result.batch_id} - {None}
+            if n_nodes <= pack_max_nodes:
+                start = i + 1
+                for other in queue[start:]:
+                    if len(pack) >= pack_size:
+                        break
+                    if (
+                        other.id in dispatched
+                        or other.model_id != result.model_id
+                        or other.segmentation_type != result.segmentation_type
+                        or batch_full(other, batch_ids)
+                    ):
+                        continue
+                    try:
+                        other_nodes = stage_job(other)
+                    except (ValueError, OSError) as e:
+                        fail_unstaged_job(other, e)
+                        dispatched.add(other.id)
+                        continue
+                    # Large skeletons are left for a task of their own
+                    if other_nodes <= pack_max_nodes:
+                        pack.append(other)
+                        dispatched.add(other.id)
+                        if other.batch_id is not None:
+                            batch_ids.add(other.batch_id)
+
+            enqueue_jobs(pack)
+            free -= 1
+            for batch_id in batch_ids:
+                batch_tasks[batch_id] += 1
+
+
+@task()
+def dispatch_jobs_async(server_id):
+    dispatch_jobs(server_id)
+
+
+def request_dispatch(server_id):
+    """
+    Dispatch the queued jobs of a server in a task once the current
+    transaction is committed, so requests don't wait for jobs to be staged.
+    """
+    if server_id is not None:
+        transaction.on_commit(lambda: dispatch_jobs_async.delay(server_id))
+
+
+def fail_unstaged_job(result, error):
+    shutil.rmtree(str(result.staging_dir), ignore_errors=True)
+    result.status = "failed"
+    result.errors = str(error)
+    result.save()
+
+
+def finish_batch(batch_id):
+    """Remove the files shared by a batch once all of its jobs are done."""
+    left = AutoproofreaderResult.objects.filter(
+        batch_id=batch_id, status__in=ACTIVE_STATUSES
     )
+    if not left.exists():
+        batch = AutoproofreaderBatch.objects.get(id=batch_id)
+        shutil.rmtree(str(batch.staging_dir), ignore_errors=True)
+
+
+def get_average_duration(server_id):
+    """Average run time of recent jobs on a server."""
+    durations = [
+        completion_time - start_time
+        for start_time, completion_time in AutoproofreaderResult.objects.filter(
+            server_id=server_id,
+            status="complete",
+            start_time__isnull=False,
+            completion_time__isnull=False,
+        )
+        .order_by("-completion_time")
+        .values_list("start_time", "completion_time")[:50]
+    ]
+    if len(durations) == 0:
+        return datetime.timedelta(
+            seconds=getattr(settings, "AUTOPROOFREADER_DEFAULT_JOB_DURATION", 3600)
+        )
+    return sum(durations, datetime.timedelta()) / len(durations)
+
 
-    # Copy the numpy file containing the volume mesh and the csv containing the node connections
-    # predicted by the autoproofreader run.
-
-    fetch_files = (
-        "scp -i {ssh_key} -r {ssh_user}@{server}:"
-        + "{server_results_dir}/{server_job_dir}/* {local_temp_dir}\n"
-    ).format(
-        **{
-            "ssh_key": ssh_key,
-            "ssh_user": ssh_user,
-            "server": server["address"],
-            "server_results_dir": server["results_dir"],
-            "server_job_dir": job_name,
-            "local_temp_dir": local_temp_dir,
-        }
+def get_queue_estimates(server):
+    """
+    Map the undispatched jobs of a server to their queue position and
+    estimated start time. Estimates assume jobs take as long as recent
+    jobs on the server and ignore packing.
+    """
+    queue, n_tasks = get_queue(server.id)
+    duration = get_average_duration(server.id)
+    now = datetime.datetime.now(pytz.utc)
+    slots = max(server.max_concurrent_jobs, 1)
+    free = max(server.max_concurrent_jobs - n_tasks, 0)
+
+    estimates = {}
+    for position, result in enumerate(queue):
+        if position < free:
+            start = now
+        else:
+            start = now + ((position - free) // slots + 1) * duration
+        estimates[result.id] = (position, start)
+    return estimates
+
+
+def get_listing_estimates(result_ids):
+    """
+    Queue position and estimated start time of the undispatched jobs
+    among result_ids, by result id.
+    """
+    queued = AutoproofreaderResult.objects.filter(
+        id__in=result_ids, status="queued", task_id__isnull=True, server__isnull=False
+    )
+    estimates = {}
+    for server in ComputeServer.objects.filter(id__in=queued.values("server_id")):
+        estimates.update(get_queue_estimates(server))
+    return {
+        result_id: estimates[result_id]
+        for result_id in result_ids
+        if result_id in estimates
+    }
+
+
+class TransientJobError(Exception):
+    """A job failed in a way that is worth retrying, e.g. a dropped connection."""
+
+
+@task(bind=True, acks_late=True)
+def query_segmentation_async(self, *result_ids):
+    results = list(
+        AutoproofreaderResult.objects.filter(id__in=result_ids)
+        .exclude(status="cancelled")
+        .order_by("id")
     )
+    if len(results) == 0:
+        return "cancelled"
+    try:
+        return run_jobs(results)
+    except TransientJobError as e:
+        # Retry with exponential backoff, resuming after the last completed stage
+        max_retries = getattr(settings, "AUTOPROOFREADER_MAX_RETRIES", 5)
+        if self.request.retries < max_retries:
+            delay = getattr(settings, "AUTOPROOFREADER_RETRY_DELAY", 30)
+            raise self.retry(
+                exc=e,
+                countdown=delay * 2 ** self.request.retries,
+                max_retries=max_retries,
+            )
+        fail_jobs(results, e)
+        raise
+    except Exception as e:
+        fail_jobs(results, e)
+        raise
+    finally:
+        for batch_id in {r.batch_id for r in results if r.batch_id is not None}:
+            finish_batch(batch_id)
+        dispatch_jobs(results[0].server_id)
+
+
+def fail_jobs(results, error):
+    for result in results:
+        result.refresh_from_db(fields=["status", "remote_pid"])
+        if result.status not in ("complete", "cancelled", "failed"):
+            result.status = "failed"
+            result.errors = str(error)
+            result.save()
+            remove_job_files(result)
+
+
+def remove_job_files(result):
+    """
+    Kill the remote process group of a job that is stopped early and
+    remove its files locally and on the compute server.
+    """
+    if result.server_id is not None:
+        transport = get_transport(result.server)
+        run_bash(transport.kill_command(get_job_context(result), result.remote_pid))
+    shutil.rmtree(str(result.staging_dir), ignore_errors=True)
+
+
+def cancel_job(result):
+    """
+    Stop a queued or running job. Its celery task is revoked, the remote
+    process group is killed and the files of the job are removed locally
+    and on the compute server.
+    """
+    was_computing = result.status in RUNNING_STATUSES
+    result.status = "cancelled"
+    result.save()
+
+    if result.task_id is not None:
+        # Packed jobs share a task, which is only stopped once none of
+        # its jobs are left
+        left = AutoproofreaderResult.objects.filter(
+            task_id=result.task_id, status__in=ACTIVE_STATUSES
+        )
+        if not left.exists():
+            current_app.control.revoke(result.task_id, terminate=True)
+
+    if was_computing:
+        remove_job_files(result)
+    else:
+        shutil.rmtree(str(result.staging_dir), ignore_errors=True)
+
+    msg_user(result.user_id, "autoproofreader-result-update", {"status": "cancelled"})
+    result_cache.invalidate("result-listing", result.project_id)
+
+    if result.batch_id is not None:
+        finish_batch(result.batch_id)
+    request_dispatch(result.server_id)
 
+
+def run_bash(script):
     process = subprocess.Popen(
         "/bin/bash", stdin=subprocess.PIPE, stdout=subprocess.PIPE, encoding="utf8"
     )
-    out, err = process.communicate(setup)
+    out, err = process.communicate(script)
     logging.info(out)
+    return process.returncode
+
 
+def run_bash_streaming(script, handle_line):
+    """Like run_bash, but passes every line of output on as soon as it arrives."""
     process = subprocess.Popen(
         "/bin/bash", stdin=subprocess.PIPE, stdout=subprocess.PIPE, encoding="utf8"
     )
-    out, err = process.communicate(query_seg)
-    logging.info(out)
+    process.stdin.write(script)
+    process.stdin.close()
+    for line in process.stdout:
+        logging.info(line.rstrip())
+        handle_line(line)
+    return process.wait()
+
+
+def get_job_context(result):
+    """Everything needed to build the commands of a job."""
+    server = get_server_paths(result.server)
+    if result.segmentation_type == "diluvian":
+        server["model_file"] = result.model.model_source_path
+    return {
+        "server": server,
+        "ssh_key": settings.SSH_KEY_PATH + "/" + result.server.ssh_key,
+        "ssh_user": result.server.ssh_user,
+        "job_name": result.name,
+        "job_type": result.segmentation_type,
+        "local_temp_dir": result.staging_dir,
+        "result_id": result.id,
+        "remote_pid": result.remote_pid,
+        "time_limit": result.time_limit,
+        "memory_limit": result.memory_limit,
+    }
+
+
+def get_priority(job_config, default):
+    """Priority of a job given by its name in the job config."""
+    priority = job_config.get("priority", default)
+    if priority not in PRIORITIES:
+        raise ValueError(
+            "Unknown priority {}, expected one of {}".format(
+                priority, ", ".join(PRIORITIES)
+            )
+        )
+    return PRIORITIES[priority]
 
-    process = subprocess.Popen(
-        "/bin/bash", stdin=subprocess.PIPE, stdout=subprocess.PIPE, encoding="utf8"
+
+def get_config_id(job_config, name):
+    """Id given by name in a job config, raises ValueError if it has none."""
+    try:
+        return int(job_config[name])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("{} is missing from the job config".format(name))
+
+
+def get_job_references(job_config, project_id, skeleton_ids):
+    """
+    Ids of the model and compute server of jobs from their config. Raises
+    ValueError if either of them or any of the skeletons to proofread
+    doesn't exist in the project.
+    """
+    references = {}
+    for name, model in (("model_id", DiluvianModel), ("server_id", ComputeServer)):
+        references[name] = get_config_id(job_config, name)
+        if not model.objects.filter(id=references[name]).exists():
+            raise ValueError("No {} with id {}".format(name[:-3], references[name]))
+
+    found = ClassInstance.objects.filter(
+        project_id=project_id, class_column__class_name="skeleton", id__in=skeleton_ids
+    ).values_list("id", flat=True)
+    missing = set(skeleton_ids) - set(found)
+    if len(missing) > 0:
+        raise ValueError(
+            "No skeletons with ids {} in project {}".format(
+                ", ".join(str(s) for s in sorted(missing)), project_id
+            )
+        )
+    return references
+
+
+def get_job_limits(job_config):
+    """
+    Limits of the remote process of a job, from its config or the settings.
+    Limits are interpolated into shell commands, so they have to be positive
+    integers.
+    """
+    limits = {}
+    for name in ("time_limit", "memory_limit"):
+        limit = job_config.get(
+            name, getattr(settings, "AUTOPROOFREADER_JOB_" + name.upper(), None)
+        )
+        if limit is not None:
+            try:
+                valid = not isinstance(limit, bool) and int(limit) == float(limit)
+            except (TypeError, ValueError, OverflowError):
+                valid = False
+            if not valid or int(limit) <= 0:
+                raise ValueError(
+                    "Invalid {} {}, expected a positive integer".format(
+                        name.replace("_", " "), limit
+                    )
+                )
+            limit = int(limit)
+        limits[name] = limit
+    return limits
+
+
+def resample_job_skeleton(directory, job_config):
+    """
+    Resample the skeleton.csv of a job in directory to its resample spacing
+    in nm, from its config or the settings, if it has one. Returns the blob
+    mapping the treenodes of the skeleton to their sample points, or None.
+    """
+    spacing = job_config.get(
+        "resample_spacing", getattr(settings, "AUTOPROOFREADER_RESAMPLE_SPACING", None),
     )
-    out, err = process.communicate(fetch_files)
-    logging.info(out)
+    if spacing is None:
+        return None
+    try:
+        spacing = float(spacing)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid resample spacing {}".format(spacing))
+    return Blob.store(resample_skeleton_csv(directory / "skeleton.csv", spacing))
+
+
+def get_exit_error(context, exit_code):
+    """Describe why the remote process of a job failed, if it did."""
+    if exit_code is None or exit_code == 0:
+        return None
+    if context["time_limit"] and exit_code in (124, 137):
+        return "Exceeded the time limit of {} seconds".format(context["time_limit"])
+    return "sarbor-error-detector exited with status {}".format(exit_code)
+
+
+# Rows of the nodes.obj and rankings.obj outputs of sarbor. b is the branch
+# score. c is the connectivity score
+Node = namedtuple("Node", ["node_id", "parent_id", "x", "y", "z"])
+Ranking = namedtuple(
+    "Ranking", ["node_id", "parent_id", "c", "b", "b_dx", "b_dy", "b_dz"]
+)
+
+
+def load_outputs(result):
+    """
+    The nodes and rankings of a finished job by node id, or None if either
+    of these mandatory outputs is missing.
+    """
+    outputs = Path(result.staging_dir, "outputs")
+    nodes_path = outputs / "nodes.obj"
+    rankings_path = outputs / "rankings.obj"
+    if not (nodes_path.exists() and rankings_path.exists()):
+        return None
+    with nodes_path.open("rb") as f:
+        nodes = {row[0]: Node(*row) for row in pickle.load(f)}
+    with rankings_path.open("rb") as f:
+        rankings = {row[0]: Ranking(*row) for row in pickle.load(f)}
+    return nodes, rankings
+
+
+def merge_scores(nodes, rankings):
+    """Rows of SCORE_COLUMNS combining every node with its ranking."""
+    rows = []
+    for node_id, node in nodes.items():
+        ranking = rankings[node_id]
+        rows.append(
+            (
+                node_id,
+                ranking.parent_id,
+                node.x,
+                node.y,
+                node.z,
+                ranking.b,
+                ranking.b_dx,
+                ranking.b_dy,
+                ranking.b_dz,
+                ranking.c,
+            )
+        )
+    return rows
+
+
+def store_scores(result, score_rows):
+    """
+    Store score rows in the node storage of new results, along with the
+    summary of their scores.
+    """
+    if node_storage_mode() == "arrays":
+        # Nodes ingested while the job was partial are kept as rows
+        ProofreadTreeNodes.objects.filter(result=result).delete()
+        write_node_arrays(result, score_rows)
+        result.node_storage = "arrays"
+    else:
+        ProofreadTreeNodes.objects.filter(result=result).delete()
+        copy_proofread_nodes(result.id, result.user_id, result.project_id, score_rows)
+    store_result_summary(result, score_row_columns(score_rows))
+
 
-    nodes_path = Path(local_temp_dir, "outputs", "nodes.obj")
-    Node = namedtuple("Node", ["node_id", "parent_id", "x", "y", "z"])
-    # b is the branch score. c is the connectivity score
-    Ranking = namedtuple(
-        "Ranking", ["node_id", "parent_id", "c", "b", "b_dx", "b_dy", "b_dz"]
+def ingest_scores(result):
+    """
+    Store the node scores of a finished job. Returns the number of nodes
+    stored, or None if mandatory outputs are missing. Scores stored by an
+    earlier attempt are replaced.
+    """
+    outputs = load_outputs(result)
+    if outputs is None:
+        return None
+    score_rows = merge_scores(*outputs)
+    store_scores(result, score_rows)
+    return len(score_rows)
+
+
+def list_chunks(result):
+    """
+    Chunks of rankings sarbor wrote to outputs/partial of a running job, in
+    the order they were written. Every chunk is a pickled pair of node and
+    ranking rows for the sample points finished since the previous chunk,
+    written as chunk_<n>.obj once complete.
+    """
+    partial = Path(result.staging_dir, "outputs", "partial")
+    if not partial.exists():
+        return []
+    return sorted(
+        partial.glob("chunk_*.obj"), key=lambda path: int(path.stem.split("_")[1])
     )
-    Combined = namedtuple(
-        "Combined",
-        ["node_id", "parent_id", "x", "y", "z", "b", "c", "b_dx", "b_dy", "b_dz"],
+
+
+def ingest_partial(result, n_chunks):
+    """
+    Append the scores of the chunks of a running job after the first
+    n_chunks to its ProofreadTreeNodes, and mark it "partial" with the
+    number of nodes ingested so far. Returns the number of chunks ingested
+    in total. Nodes of an earlier attempt are replaced by the first chunk.
+    """
+    chunks = list_chunks(result)[n_chunks:]
+    if len(chunks) == 0:
+        return n_chunks
+    score_rows = []
+    for path in chunks:
+        with path.open("rb") as f:
+            nodes, rankings = pickle.load(f)
+        score_rows.extend(
+            merge_scores(
+                {row[0]: Node(*row) for row in nodes},
+                {row[0]: Ranking(*row) for row in rankings},
+            )
+        )
+
+    with transaction.atomic():
+        # Cancelled and failed jobs are left alone
+        running = (
+            AutoproofreaderResult.objects.select_for_update()
+            .filter(id=result.id, status__in=RUNNING_STATUSES)
+            .first()
+        )
+        if running is None:
+            return n_chunks
+        if n_chunks == 0:
+            ProofreadTreeNodes.objects.filter(result=running).delete()
+            running.partial_nodes = 0
+        copy_proofread_nodes(
+            running.id, running.user_id, running.project_id, score_rows
+        )
+        running.partial_nodes = (running.partial_nodes or 0) + len(score_rows)
+        running.status = "partial"
+        running.save(update_fields=["status", "partial_nodes"])
+
+    msg_user(
+        running.user_id,
+        "autoproofreader-result-update",
+        {"status": "partial", "partial_nodes": running.partial_nodes},
     )
+    return n_chunks + len(chunks)
 
-    # Nodes are mandatory
-    if nodes_path.exists():
-        nodes = {row[0]: Node(*row) for row in pickle.load(nodes_path.open("rb"))}
-    else:
-        result.status = "failed"
-        result.save()
-        return "failed"
-
-    rankings_path = Path(local_temp_dir, "outputs", "rankings.obj")
-    # Rankings are mandatory
-    if rankings_path.exists():
-        with rankings_path.open("r") as f:
-            rankings = {
-                row[0]: Ranking(*row) for row in pickle.load(rankings_path.open("rb"))
-            }
-            node_data = [
-                Combined(**{**nodes[nid]._asdict(), **rankings[nid]._asdict()})
-                for nid in nodes.keys()
-            ]
-            proofread_nodes = [
-                ProofreadTreeNodes(
-                    node_id=row.node_id,
-                    parent_id=row.parent_id,
-                    x=row.x,
-                    y=row.y,
-                    z=row.z,
-                    connectivity_score=row.c,
-                    branch_score=row.b,
-                    branch_dx=row.b_dx,
-                    branch_dy=row.b_dy,
-                    branch_dz=row.b_dz,
-                    reviewed=False,
-                    result=result,
-                    user_id=user_id,
-                    project_id=project_id,
-                    editor_id=user_id,
-                )
-                for row in node_data
-            ]
-            ProofreadTreeNodes.objects.bulk_create(proofread_nodes)
-    else:
-        result.status = "failed"
-        result.save()
-        return "failed"
 
-    mesh_path = Path(local_temp_dir, "outputs", "mesh.stl")
+def parse_mesh(result):
+    """Vertices and triangles of the mesh of a finished job, None if it has none."""
+    mesh_path = Path(result.staging_dir, "outputs", "mesh.stl")
     # Mesh is optional
-    if mesh_path.exists():
-        with mesh_path.open("r") as f:
-            stl_str = f.read()
+    if not mesh_path.exists():
+        return None
+    with mesh_path.open("r") as f:
+        try:
+            return _stl_ascii_to_indexed_triangles(f.read())
+        except InvalidSTLError as e:
+            raise ValueError("Invalid STL file ({})".format(str(e)))
+
+
+def save_mesh(result, vertices, triangles):
+    mesh = TriangleMeshVolume(
+        result.project_id,
+        result.user_id,
+        {"type": "trimesh", "title": result.name, "mesh": [vertices, triangles]},
+    )
+    mesh_volume = mesh.save()
+    result.volume = Volume.objects.get(id=mesh_volume)
 
-            try:
-                vertices, triangles = _stl_ascii_to_indexed_triangles(stl_str)
-            except InvalidSTLError as e:
-                raise ValueError("Invalid STL file ({})".format(str(e)))
-
-            mesh = TriangleMeshVolume(
-                project_id,
-                user_id,
-                {"type": "trimesh", "title": job_name, "mesh": [vertices, triangles]},
-            )
-            mesh_volume = mesh.save()
-            result.volume = Volume.objects.get(id=mesh_volume)
 
-    segmentation_path = Path(local_temp_dir, "outputs", "segmentations.n5")
-    segmentation_dir = Path(segmentations_dir)
+def ingest_mesh(result):
+    """Store the mesh of a finished job, returns its number of triangles."""
+    mesh = parse_mesh(result)
+    if mesh is None:
+        return 0
+    vertices, triangles = mesh
+    save_mesh(result, vertices, triangles)
+    return len(triangles)
+
+
+def move_segmentation(result):
+    segmentation_path = Path(result.staging_dir, "outputs", "segmentations.n5")
+    segmentation_dir = (
+        Path(settings.MEDIA_ROOT) / "proofreading_segmentations" / str(result.uuid)
+    )
     if segmentation_path.exists():
         segmentation_dir.mkdir(parents=True, exist_ok=True)
-        segmentation_path.rename(segmentation_dir / "segmentations.n5")
-
-    cleanup = (
-        "rm -r {local_temp_dir}\n"
-        + "ssh -i {ssh_key} {ssh_user}@{server}\n"
-        + "rm -r {server_results_dir}/{server_job_dir}"
-    ).format(
-        **{
-            "ssh_key": ssh_key,
-            "ssh_user": ssh_user,
-            "server": server["address"],
-            "server_results_dir": server["results_dir"],
-            "server_job_dir": job_name,
-            "local_temp_dir": local_temp_dir,
-        }
-    )
+        target = segmentation_dir / "segmentations.n5"
+        # Left over from an attempt that failed before recording this stage
+        if target.exists():
+            shutil.rmtree(str(target))
+        segmentation_path.rename(target)
 
-    process = subprocess.Popen(
-        "/bin/bash", stdin=subprocess.PIPE, stdout=subprocess.PIPE, encoding="utf8"
+
+def complete_stage(result, stage):
+    result.completed_stages = result.completed_stages + [stage]
+    result.save()
+
+
+def run_pack_stage(results, contexts, stage, command, metrics, transferred=None):
+    """
+    Run a stage that is shared by all jobs of a pack, for the jobs that
+    have not completed it yet. transferred maps a result to the bytes the
+    stage copied for it.
+    """
+    pending = [
+        (result, context)
+        for result, context in zip(results, contexts)
+        if stage not in result.completed_stages
+    ]
+    if len(pending) == 0:
+        return
+    pending_results = [result for result, _ in pending]
+    with metrics.stage(pending_results, stage) as counts:
+        returncode = run_bash(command([context for _, context in pending]))
+        if returncode != 0:
+            raise TransientJobError(
+                "{} exited with status {}".format(stage.replace("_", "-"), returncode)
+            )
+        if transferred is not None:
+            for result in pending_results:
+                counts[result.id]["bytes_transferred"] = transferred(result)
+    for result, _ in pending:
+        complete_stage(result, stage)
+
+
+class PartialIngester(object):
+    """
+    Ingests the chunks sarbor writes while the jobs of a pack are computing,
+    so reviewers can start on the highest scoring nodes before a job is
+    done. Every interval seconds, chunks written since the last poll are
+    copied with the transport of the server and ingested by ingest_partial.
+    The ingest stage replaces the partial nodes with the complete ones. An
+    interval of None disables it.
+    """
+
+    def __init__(self, transport, results, contexts, interval):
+        self.transport = transport
+        self.results = results
+        self.contexts = contexts
+        self.interval = interval
+        # Chunks ingested so far per result id
+        self.chunks = {result.id: 0 for result in results}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+
+    def __enter__(self):
+        if self.interval is not None:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def run(self):
+        try:
+            while not self._stop.wait(self.interval):
+                self.poll()
+        finally:
+            # Every thread has its own database connection
+            connection.close()
+
+    def poll(self):
+        # Chunks that could not be copied are picked up by the next poll
+        run_bash(self.transport.partial_command(self.contexts, self.chunks))
+        for result in self.results:
+            try:
+                self.chunks[result.id] = ingest_partial(result, self.chunks[result.id])
+            except Exception:
+                # Partial results are a preview, the job goes on without them
+                logging.exception("Could not ingest partial result %s", result.id)
+
+
+def run_jobs(results):
+    """
+    Run jobs on their compute server and ingest their outputs. Several jobs
+    sharing a server, model and segmentation type are run as one pack:
+    their files are copied with one scp and sarbor is run for each of them
+    in one ssh session, so the connection and environment setup is paid
+    once. sarbor takes a single skeleton, so models are loaded for every
+    job unless a warm worker keeps them loaded (see sarbor_worker.py).
+    Outputs are kept apart by the job directories, and the files of jobs
+    that fail are removed once the pack is done. How files are
+    copied and sarbor is run depends on the transport of the server (see
+    transports.py), jobs on local servers skip stage_in and stage_out.
+
+    Jobs go through STAGES in order and every completed stage is recorded
+    on the result, so a retried or redelivered task resumes after the
+    last completed stage. Every stage can be repeated safely. The
+    resources used by every stage run are recorded as JobStageMetric rows
+    (see metrics.py). With AUTOPROOFREADER_PARTIAL_INTERVAL set, rankings
+    are ingested while sarbor is still running (see PartialIngester).
+    """
+    result_ids = [result.id for result in results]
+    for result in results:
+        # Jobs resumed after ingesting a part of their rankings stay partial
+        if result.status != "partial":
+            result.status = "computing"
+        if result.start_time is None:
+            result.start_time = datetime.datetime.now(pytz.utc)
+        result.save()
+        msg_user(
+            result.user_id, "autoproofreader-result-update", {"status": "computing"}
+        )
+
+    contexts = [get_job_context(result) for result in results]
+    transport = get_transport(results[0].server)
+    metrics = JobMetrics(results)
+    if transport.copies_files:
+        run_pack_stage(
+            results,
+            contexts,
+            "stage_in",
+            transport.stage_in_command,
+            metrics,
+            transferred=lambda result: directory_size(result.staging_dir),
+        )
+
+    computing = [
+        (result, context)
+        for result, context in zip(results, contexts)
+        if "compute" not in result.completed_stages
+    ]
+    # Contexts of jobs that failed, their files are removed at the end
+    failed = []
+    if len(computing) > 0:
+        exit_codes = {}
+
+        def record_process(line):
+            parts = line.split()
+            if len(parts) != 4 or parts[0] != PROCESS_MARKER:
+                return
+            result_id, value = int(parts[2]), int(parts[3])
+            if parts[1] == "pid":
+                AutoproofreaderResult.objects.filter(id=result_id).update(
+                    remote_pid=value
+                )
+            elif parts[1] == "exit":
+                exit_codes[result_id] = value
+
+        partial = PartialIngester(
+            transport,
+            [result for result, _ in computing],
+            [context for _, context in computing],
+            getattr(settings, "AUTOPROOFREADER_PARTIAL_INTERVAL", None),
+        )
+        with metrics.stage([result for result, _ in computing], "compute"), partial:
+            run_bash_streaming(
+                transport.compute_command([context for _, context in computing]),
+                record_process,
+            )
+        for result, context in computing:
+            result.refresh_from_db(fields=["status", "partial_nodes"])
+            if result.status == "cancelled":
+                continue
+            if result.id not in exit_codes:
+                # The connection was lost before the job finished
+                raise TransientJobError(
+                    "Lost connection to {}".format(context["server"]["address"])
+                )
+            error = get_exit_error(context, exit_codes[result.id])
+            if error is not None:
+                result.status = "failed"
+                result.errors = error
+                result.save()
+                failed.append(context)
+                continue
+            complete_stage(result, "compute")
+
+    # Cancelled and failed jobs drop out of the pack
+    for result in results:
+        result.refresh_from_db(fields=["status", "partial_nodes"])
+    active = [
+        (result, context)
+        for result, context in zip(results, contexts)
+        if result.status in RUNNING_STATUSES
+    ]
+    results = [result for result, _ in active]
+    contexts = [context for _, context in active]
+
+    if transport.copies_files:
+        run_pack_stage(
+            results,
+            contexts,
+            "stage_out",
+            transport.stage_out_command,
+            metrics,
+            transferred=lambda result: directory_size(result.staging_dir / "outputs"),
+        )
+
+    ingested = []
+    for result, context in zip(results, contexts):
+        outputs = result.staging_dir / "outputs"
+        if "ingest" not in result.completed_stages:
+            with transaction.atomic():
+                with metrics.stage([result], "ingest") as counts:
+                    rows = ingest_scores(result)
+                    counts[result.id]["rows_ingested"] = rows
+                    counts[result.id]["bytes_transferred"] = directory_size(
+                        outputs / "nodes.obj"
+                    ) + directory_size(outputs / "rankings.obj")
+                if rows is None:
+                    result.status = "failed"
+                    result.errors = (
+                        "sarbor-error-detector did not write nodes.obj and rankings.obj"
+                    )
+                    # Partial scores of a failed job are not shown
+                    result.partial_nodes = None
+                    result.save()
+                    failed.append(context)
+                    continue
+                # The complete nodes replaced the partial ones
+                result.partial_nodes = None
+                complete_stage(result, "ingest")
+        if "mesh" not in result.completed_stages:
+            with transaction.atomic():
+                with metrics.stage([result], "mesh") as counts:
+                    counts[result.id]["rows_ingested"] = ingest_mesh(result)
+                    counts[result.id]["bytes_transferred"] = directory_size(
+                        outputs / "mesh.stl"
+                    )
+                complete_stage(result, "mesh")
+        if "segmentation" not in result.completed_stages:
+            with metrics.stage([result], "segmentation"):
+                move_segmentation(result)
+            complete_stage(result, "segmentation")
+        ingested.append((result, context))
+
+    results = [result for result, _ in ingested]
+    contexts = [context for _, context in ingested]
+    run_pack_stage(results, contexts, "cleanup", transport.cleanup_command, metrics)
+    if len(failed) > 0:
+        run_bash(transport.cleanup_command(failed))
+
+    for result in results:
+        user_id = result.user_id
+
+        msg = Message()
+        msg.user = User.objects.get(pk=int(user_id))
+        msg.read = False
+
+        msg.title = "Job {} complete!"
+        msg.text = "IM DOING SOME STUFF, CHECK IT OUT"
+        msg.action = "localhost:8000"
+
+        notify_user(user_id, msg.id, msg.title)
+
+        result.completion_time = datetime.datetime.now(pytz.utc)
+        result.status = "complete"
+        result.save()
+
+        msg_user(user_id, "autoproofreader-result-update", {"status": "completed"})
+
+    statuses = list(
+        AutoproofreaderResult.objects.filter(id__in=result_ids)
+        .order_by("id")
+        .values_list("status", flat=True)
     )
-    out, err = process.communicate(cleanup)
-    logging.info(out)
+    return statuses[0] if len(statuses) == 1 else statuses
 
-    msg = Message()
-    msg.user = User.objects.get(pk=int(user_id))
-    msg.read = False
 
-    msg.title = "Job {} complete!"
-    msg.text = "IM DOING SOME STUFF, CHECK IT OUT"
-    msg.action = "localhost:8000"
+@api_view(["POST"])
+@requires_user_role(UserRole.QueueComputeTask)
+def cancel_result(request, project_id, result_id):
+    """Cancel a queued or running job.
 
-    notify_user(user_id, msg.id, msg.title)
+    Revokes the celery task of the job, kills its process group on the
+    compute server, removes its files and marks the result as cancelled.
+    """
+    result = get_object_or_404(
+        AutoproofreaderResult, id=result_id, user_id=request.user.id, project=project_id
+    )
+    if result.status not in ACTIVE_STATUSES:
+        return HttpResponseBadRequest(
+            "Result {} is {} and can't be cancelled".format(result.id, result.status)
+        )
+    cancel_job(result)
+    return JsonResponse({"success": True, "status": result.status})
 
-    result.completion_time = datetime.datetime.now(pytz.utc)
-    result.status = "complete"
-    result.save()
 
-    msg_user(user_id, "autoproofreader-result-update", {"status": "completed"})
+@api_view(["GET"])
+@requires_user_role(UserRole.Browse)
+def get_job_queue(request, project_id):
+    """List the queued jobs of this project with their queue position.
+
+    Positions are per compute server and count the jobs of all projects
+    ahead in the queue. Start times are estimates based on the run time
+    of recent jobs on the same server.
+    """
+    queued = AutoproofreaderResult.objects.filter(
+        Q(project=project_id)
+        & Q(status="queued")
+        & Q(task_id__isnull=True)
+        & Q(server__isnull=False)
+        & (Q(user=request.user.id) | Q(private=False))
+    )
+    jobs = []
+    for server in ComputeServer.objects.filter(
+        id__in=queued.values("server_id")
+    ).order_by("id"):
+        estimates = get_queue_estimates(server)
+        for result in queued.filter(server=server):
+            position, start = estimates[result.id]
+            jobs.append(
+                {
+                    "id": result.id,
+                    "name": result.name,
+                    "user": result.user_id,
+                    "server": server.id,
+                    "priority": result.priority,
+                    "queue_position": position,
+                    "estimated_start_time": start,
+                }
+            )
 
-    return "complete"
+    return JsonResponse(
+        sorted(jobs, key=lambda job: (job["server"], job["queue_position"])),
+        safe=False,
+        encoder=DjangoJSONEncoder,
+        json_dumps_params={"sort_keys": True, "indent": 4},
+    )
 
 
 @api_view(["GET"])
@@ -544,23 +1476,76 @@ class AutoproofreaderResultAPI(APIView):
 
         Retrieve information on previous jobs. This includes jobs
         that have not yet completed their computations.
+
+        In summary mode only the fields needed to list results are
+        returned, without the skeleton snapshot, data and errors, and
+        the response is an object with the total `count` of matching
+        results and one page of `results`. The omitted fields of a
+        result can be retrieved from autoproofreader-results/<result_id>.
         ---
         parameters:
             - name: result_id
-            description: ID of result to retrieve. If not provided retrieve all results
-            type: integer
-            paramType: path
+              description: ID of result to retrieve. If not provided retrieve all results
+              type: integer
+              paramType: form
+            - name: summary
+              description: Only return display fields, paginated
+              type: boolean
+              paramType: form
+            - name: status
+              description: Comma separated list of statuses to return
+              type: string
+              paramType: form
+            - name: skeleton_id
+              description: Only return results for this skeleton
+              type: integer
+              paramType: form
+            - name: order_by
+              description: |
+                Field to sort by, prefixed with "-" for descending order.
+                Defaults to "id".
+              type: string
+              paramType: form
+            - name: page
+              description: Page to return in summary mode, starting at 1
+              type: integer
+              paramType: form
+            - name: page_size
+              description: Number of results per page in summary mode
+              type: integer
+              paramType: form
         """
         result_id = request.query_params.get(
             "result_id", request.data.get("result_id", None)
         )
+        summary = get_request_bool(request.query_params, "summary", False)
+        status = request.query_params.get("status", None)
+        skeleton_id = request.query_params.get("skeleton_id", None)
+        order_by = request.query_params.get("order_by", "id")
+        try:
+            page = int(request.query_params.get("page", 1))
+            page_size = int(request.query_params.get("page_size", RESULTS_PAGE_SIZE))
+            if result_id is not None:
+                result_id = int(result_id)
+            if skeleton_id is not None:
+                skeleton_id = int(skeleton_id)
+        except (TypeError, ValueError):
+            return HttpResponseBadRequest(
+                "result_id, skeleton_id, page and page_size must be integers"
+            )
+
+        if order_by.lstrip("-") not in SUMMARY_FIELDS:
+            return HttpResponseBadRequest("Can't order by {}".format(order_by))
+        if page < 1 or page_size < 1:
+            return HttpResponseBadRequest("page and page_size must be positive")
+
         if result_id is not None:
             query_set = AutoproofreaderResult.objects.filter(
                 Q(project=project_id)
                 & Q(id=result_id)
                 & (Q(user=request.user.id) | Q(private=False))
             )
-            if len(query_set) == 0:
+            if not query_set.exists():
                 return HttpResponseNotFound(
                     "No results found with id {}".format(result_id)
                 )
@@ -568,14 +1553,53 @@ class AutoproofreaderResultAPI(APIView):
             query_set = AutoproofreaderResult.objects.filter(
                 Q(project=project_id) & (Q(user=request.user.id) | Q(private=False))
             )
-            if len(query_set) == 0 and result_id is not None:
-                return JsonResponse([], safe=False)
-
-        return JsonResponse(
-            AutoproofreaderResultSerializer(query_set, many=True).data,
-            safe=False,
-            json_dumps_params={"sort_keys": True, "indent": 4},
+        if status is not None:
+            query_set = query_set.filter(status__in=status.split(","))
+        if skeleton_id is not None:
+            query_set = query_set.filter(skeleton_id=skeleton_id)
+        query_set = query_set.order_by(order_by)
+
+        # The listing is cached until any of its results changes
+        key = (
+            "result-listing",
+            int(project_id),
+            request.user.id,
+            tuple(sorted(request.query_params.items())),
         )
+        # Only the listed results matter, in summary mode those of the page
+        # and the number of matching results
+        state_rows = query_set.values_list(*LISTING_STATE_FIELDS)
+        if summary:
+            start, end = (page - 1) * page_size, page * page_size
+            count = query_set.count()
+            state = hash((count, tuple(state_rows[start:end])))
+        else:
+            state = hash(tuple(state_rows))
+        content = result_cache.get(key, state)
+        if content is None:
+            if summary:
+                data = {
+                    "count": count,
+                    "results": AutoproofreaderResultSummarySerializer(
+                        query_set.only(*SUMMARY_FIELDS)[start:end], many=True,
+                    ).data,
+                }
+            elif result_id is not None:
+                data = AutoproofreaderResultSerializer(query_set, many=True).data
+            else:
+                data = AutoproofreaderResultListingSerializer(query_set, many=True).data
+            listed = data["results"] if summary else data
+            estimates = get_listing_estimates([r["id"] for r in listed])
+            for r in listed:
+                r["queue_position"], r["estimated_start_time"] = estimates.get(
+                    r["id"], (None, None)
+                )
+            content = json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True, indent=4)
+            # Estimates change with every other job on the server
+            if len(estimates) == 0:
+                result_cache.set(key, content, state)
+
+        return HttpResponse(content, content_type="application/json")
 
     @method_decorator(requires_user_role(UserRole.QueueComputeTask))
     def patch(self, request, project_id):
@@ -633,6 +1657,8 @@ class AutoproofreaderResultAPI(APIView):
             result.permanent = not result.permanent
             result.save()
 
+        result_cache.invalidate("result-listing", int(project_id))
+
         return JsonResponse({"private": result.private, "permanent": result.permanent})
 
     @method_decorator(requires_user_role(UserRole.QueueComputeTask))
@@ -657,5 +1683,43 @@ class AutoproofreaderResultAPI(APIView):
             user_id=request.user.id,
             project=project_id,
         )
+        if result.status in ACTIVE_STATUSES:
+            cancel_job(result)
         result.delete()
         return JsonResponse({"success": True})
+
+
+class AutoproofreaderResultDetailAPI(APIView):
+    @method_decorator(requires_user_role(UserRole.Browse))
+    def get(self, request, project_id, result_id):
+        """Retrieve all fields of a single result.
+
+        Includes the skeleton snapshot, data and errors that are left
+        out of the summary listing.
+        ---
+        parameters:
+            - name: result_id
+              description: ID of result to retrieve.
+              type: integer
+              paramType: path
+              required: true
+        """
+        query_set = AutoproofreaderResult.objects.filter(
+            Q(project=project_id)
+            & Q(id=result_id)
+            & (Q(user=request.user.id) | Q(private=False))
+        )
+        if len(query_set) != 1:
+            return HttpResponseNotFound("No results found with id {}".format(result_id))
+        result = query_set[0]
+
+        data = AutoproofreaderResultSerializer(result).data
+        data["queue_position"], data["estimated_start_time"] = get_listing_estimates(
+            [result.id]
+        ).get(result.id, (None, None))
+
+        return JsonResponse(
+            data,
+            encoder=DjangoJSONEncoder,
+            json_dumps_params={"sort_keys": True, "indent": 4},
+        )
@@ -0,0 +1,224 @@
+import shutil
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import Count
+from django.http import JsonResponse, HttpResponseBadRequest
+from django.utils.decorators import method_decorator
+
+from catmaid.control.authentication import requires_user_role
+from catmaid.control.common import get_request_list
+from catmaid.models import ClassInstanceClassInstance, UserRole
+from rest_framework.views import APIView
+
+from autoproofreader.models import (
+    AutoproofreaderBatch,
+    AutoproofreaderBatchSerializer,
+    AutoproofreaderResult,
+    ConfigFile,
+    DiluvianModel,
+)
+from autoproofreader.control.autoproofreader import (
+    get_job_limits,
+    get_job_references,
+    get_priority,
+    request_dispatch,
+    stage_uploads,
+    write_model_config,
+)
+
+# Statuses of jobs that will not change anymore
+FINISHED_STATUSES = ("complete", "failed", "cancelled")
+
+
+def get_annotated_skeletons(project_id, annotations):
+    """Ids of the skeletons modeling neurons annotated with any of annotations."""
+    neurons = ClassInstanceClassInstance.objects.filter(
+        project_id=project_id,
+        relation__relation_name="annotated_with",
+        class_instance_b__name__in=annotations,
+    ).values("class_instance_a")
+    return ClassInstanceClassInstance.objects.filter(
+        project_id=project_id,
+        relation__relation_name="model_of",
+        class_instance_b__in=neurons,
+    ).values_list("class_instance_a", flat=True)
+
+
+def get_batch_progress(batches):
+    """Serialize batches along with the number of their jobs per status."""
+    counts = defaultdict(dict)
+    status_counts = (
+        AutoproofreaderResult.objects.filter(batch__in=batches)
+        .values_list("batch_id", "status")
+        .annotate(n=Count("id"))
+    )
+    for batch_id, status, n in status_counts:
+        counts[batch_id][status] = n
+
+    progress = []
+    for batch in batches:
+        data = AutoproofreaderBatchSerializer(batch).data
+        total = sum(counts[batch.id].values())
+        finished = sum(counts[batch.id].get(s, 0) for s in FINISHED_STATUSES)
+        data["total"] = total
+        data["status_counts"] = counts[batch.id]
+        data["progress"] = finished / total if total > 0 else 1.0
+        progress.append(data)
+    return progress
+
+
+class AutoproofreaderBatchAPI(APIView):
+    @method_decorator(requires_user_role(UserRole.QueueComputeTask))
+    def put(self, request, project_id):
+        """Create a batch of autoproofreading jobs sharing one configuration.
+
+        Takes the same files as a single job, except for skeleton.csv. The
+        skeletons are snapshotted server side when their job is started.
+        Jobs are started in order, at most max_concurrent_jobs at a time.
+        ---
+        parameters:
+          - name: skeleton_ids
+            description: Skeletons to proofread.
+            type: array
+            items:
+              type: integer
+            required: false
+            paramType: form
+          - name: annotations
+            description: Proofread all skeletons annotated with any of these.
+            type: array
+            items:
+              type: string
+            required: false
+            paramType: form
+          - name: max_concurrent_jobs
+            description: Number of jobs of this batch that may run at once.
+            type: integer
+            required: false
+            paramType: form
+          - name: job_config.json
+            description: Config file shared by all jobs of this batch
+            required: true
+            type: file
+            paramType: form
+          - name: sarbor_config.toml
+            description: File detailing sarbor execution configuration
+            required: true
+            type: file
+            paramType: form
+          - name: all_settings.toml
+            description: File containing a full set of settings for this batch
+            required: true
+            type: file
+            paramType: form
+        """
+        try:
+            skeleton_ids = set(
+                get_request_list(request.data, "skeleton_ids", [], map_fn=int)
+            )
+            max_concurrent_jobs = int(
+                request.data.get(
+                    "max_concurrent_jobs",
+                    getattr(settings, "AUTOPROOFREADER_BATCH_CONCURRENCY", 1),
+                )
+            )
+        except ValueError:
+            return HttpResponseBadRequest(
+                "skeleton_ids and max_concurrent_jobs must be integers"
+            )
+        annotations = get_request_list(request.data, "annotations", [])
+        if len(annotations) > 0:
+            skeleton_ids.update(get_annotated_skeletons(project_id, annotations))
+        if len(skeleton_ids) == 0:
+            return HttpResponseBadRequest("No skeletons to proofread")
+
+        try:
+            staging_dir, job_config = stage_uploads(request.FILES.values())
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+        segmentation_type = job_config.get("segmentation_type", None)
+        if segmentation_type is None:
+            shutil.rmtree(str(staging_dir), ignore_errors=True)
+            return HttpResponseBadRequest(
+                "Segmentation type not available: {}".format(job_config)
+            )
+        # Batches run behind interactive jobs unless asked otherwise
+        try:
+            references = get_job_references(job_config, project_id, skeleton_ids)
+            priority = get_priority(job_config, "low")
+            limits = get_job_limits(job_config)
+        except ValueError as e:
+            shutil.rmtree(str(staging_dir), ignore_errors=True)
+            return HttpResponseBadRequest(str(e))
+
+        # The settings are stored once and referenced by every job
+        settings_config = ConfigFile.for_content(
+            request.user.id,
+            project_id,
+            (staging_dir / "all_settings.toml").read_text(),
+        )
+        batch = AutoproofreaderBatch(
+            user_id=request.user.id,
+            project_id=project_id,
+            name=job_config.get("job_name", ""),
+            config=settings_config,
+            max_concurrent_jobs=max(max_concurrent_jobs, 1),
+        )
+        batch.save()
+        if len(batch.name) == 0:
+            batch.name = "batch_{}".format(batch.id)
+            batch.save()
+        staging_dir.rename(batch.staging_dir)
+
+        if segmentation_type == "diluvian":
+            model = DiluvianModel.objects.get(id=references["model_id"])
+            write_model_config(model, batch.staging_dir)
+
+        AutoproofreaderResult.objects.bulk_create(
+            [
+                AutoproofreaderResult(
+                    user_id=request.user.id,
+                    project_id=project_id,
+                    config_id=settings_config.id,
+                    skeleton_id=skeleton_id,
+                    segmentation_type=segmentation_type,
+                    priority=priority,
+                    batch=batch,
+                    name="batch_{}_{}".format(batch.id, skeleton_id),
+                    status="queued",
+                    private=True,
+                    **references,
+                    **limits
+                )
+                for skeleton_id in sorted(skeleton_ids)
+            ]
+        )
+
+        request_dispatch(references["server_id"])
+
+        return JsonResponse(get_batch_progress([batch])[0])
+
+    @method_decorator(requires_user_role(UserRole.Browse))
+    def get(self, request, project_id):
+        """Retrieve batches of this project along with the progress of their jobs.
+        ---
+        parameters:
+          - name: batch_id
+            description: Only retrieve this batch.
+            type: integer
+            required: false
+            paramType: form
+        """
+        batch_id = request.query_params.get(
+            "batch_id", request.data.get("batch_id", None)
+        )
+        batches = AutoproofreaderBatch.objects.filter(project_id=project_id)
+        if batch_id is not None:
+            batches = batches.filter(id=batch_id)
+
+        return JsonResponse(
+            get_batch_progress(batches.order_by("id")),
+            safe=False,
+            json_dumps_params={"sort_keys": True, "indent": 4},
+        )
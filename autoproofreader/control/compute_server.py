@@ -1,7 +1,6 @@
-from django.http import JsonResponse, HttpResponseNotFound
+from django.http import HttpResponseBadRequest, JsonResponse, HttpResponseNotFound
 from django.db.models import Q
 from django.utils.decorators import method_decorator
-from django.conf import settings
 
 from catmaid.control.authentication import requires_user_role
 from catmaid.models import UserRole
@@ -10,6 +9,7 @@ from rest_framework.views import APIView
 import subprocess
 
 from autoproofreader.models import ComputeServer, ComputeServerSerializer
+from autoproofreader.transports import TRANSPORTS, get_transport
 
 
 class ComputeServerAPI(APIView):
@@ -45,6 +45,18 @@ class ComputeServerAPI(APIView):
               description: Projects that have access to this server. All if empty
               type: array
               paramType: form
+            - name: max_concurrent_jobs
+              description: Number of jobs that may run on this server at once.
+              type: integer
+              paramType: form
+            - name: transport
+              description: How jobs are run, "ssh" (default), "local" or "slurm".
+              type: string
+              paramType: form
+            - name: worker_socket
+              description: Socket of a warm sarbor worker on the server, if any.
+              type: path
+              paramType: form
         """
         address = request.POST.get("address", request.data.get("address", None))
         if "name" in request.POST or "name" in request.data:
@@ -66,6 +78,27 @@ class ComputeServerAPI(APIView):
         project_whitelist = request.POST.get(
             "project_whitelist", request.data.get("project_whitelist", None)
         )
+        max_concurrent_jobs = request.POST.get(
+            "max_concurrent_jobs", request.data.get("max_concurrent_jobs", 1)
+        )
+        transport = request.POST.get("transport", request.data.get("transport", "ssh"))
+        worker_socket = request.POST.get(
+            "worker_socket", request.data.get("worker_socket", None)
+        )
+        if transport not in TRANSPORTS:
+            return HttpResponseBadRequest(
+                "Unknown transport {}, expected one of {}".format(
+                    transport, ", ".join(sorted(TRANSPORTS))
+                )
+            )
+        try:
+            max_concurrent_jobs = int(max_concurrent_jobs)
+        except (TypeError, ValueError):
+            max_concurrent_jobs = 0
+        if max_concurrent_jobs < 1:
+            return HttpResponseBadRequest(
+                "max_concurrent_jobs must be a positive integer"
+            )
 
         server = ComputeServer(
             name=name,
@@ -76,6 +109,9 @@ class ComputeServerAPI(APIView):
             ssh_key=ssh_key,
             ssh_user=ssh_user,
             project_whitelist=project_whitelist,
+            max_concurrent_jobs=max_concurrent_jobs,
+            transport=transport,
+            worker_socket=worker_socket,
         )
         server.save()
 
@@ -185,13 +221,13 @@ class GPUUtilAPI(APIView):
             ("gpu_serial", str),
         ]
 
-        server = ComputeServerAPI.get_servers(server_id)[0]
+        server = ComputeServer.objects.get(id=server_id)
 
-        bash_script = (
-            "ssh -i {} {}\n".format(settings.SSH_KEY_PATH, server["address"])
-            + "nvidia-smi "
+        bash_script = get_transport(server).gpu_command(
+            server,
+            "nvidia-smi "
             + "--query-gpu={} ".format(",".join([x[0] for x in fields]))
-            + "--format=csv,noheader,nounits"
+            + "--format=csv,noheader,nounits",
         )
 
         process = subprocess.Popen(
@@ -215,6 +251,7 @@ class GPUUtilAPI(APIView):
 
         out = filter(lambda x: all(list(map(is_valid, x, [f[1] for f in fields]))), out)
         out = {
-            x[0]: {fields[i + 1]: x[i + 1] for i in range(len(fields) - 1)} for x in out
+            x[0]: {fields[i + 1][0]: x[i + 1] for i in range(len(fields) - 1)}
+            for x in out
         }
         return out
@@ -62,10 +62,7 @@ class DiluvianModelAPI(APIView):
             return JsonResponse({"success": False, "results": request.POST})
 
         if config is not None:
-            model_config = ConfigFile(
-                user_id=request.user.id, project_id=project_id, config=config
-            )
-            model_config.save()
+            model_config = ConfigFile.for_content(request.user.id, project_id, config)
             config_id = model_config.id
         else:
             warnings.append(
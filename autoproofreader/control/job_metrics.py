@@ -0,0 +1,73 @@
+from django.http import JsonResponse, HttpResponseBadRequest
+
+from catmaid.control.authentication import requires_user_role
+from catmaid.control.common import get_request_list
+from catmaid.models import UserRole
+from rest_framework.decorators import api_view
+
+from autoproofreader.metrics import (
+    DEFAULT_PERCENTILES,
+    METRIC_GROUPS,
+    get_metric_percentiles,
+)
+from autoproofreader.models import JobStageMetric
+
+
+@api_view(["GET"])
+@requires_user_role(UserRole.Browse)
+def get_job_metrics(request, project_id):
+    """Percentiles of the resources used by each stage of this project's jobs.
+
+    For every group and stage, the number of recorded stage runs and the
+    percentiles of their wall time in seconds, bytes transferred, rows
+    ingested and peak worker memory in bytes are returned. Skeleton sizes
+    are grouped by the lower bound of their power of ten node count range.
+    ---
+    parameters:
+      - name: group_by
+        description: One of server, model or skeleton_size. Defaults to server.
+        type: string
+        required: false
+        paramType: form
+      - name: stage
+        description: Only summarize this stage.
+        type: string
+        required: false
+        paramType: form
+      - name: percentiles
+        description: Percentiles to compute. Defaults to 50, 90 and 99.
+        type: array
+        items:
+          type: number
+        required: false
+        paramType: form
+    """
+    group_by = request.query_params.get(
+        "group_by", request.data.get("group_by", "server")
+    )
+    if group_by not in METRIC_GROUPS:
+        return HttpResponseBadRequest(
+            "Unknown group_by {}, expected one of {}".format(
+                group_by, ", ".join(METRIC_GROUPS)
+            )
+        )
+    try:
+        percentiles = get_request_list(
+            request.query_params, "percentiles", DEFAULT_PERCENTILES, map_fn=float
+        )
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    if not all(0 <= p <= 100 for p in percentiles):
+        return HttpResponseBadRequest("Percentiles have to be between 0 and 100")
+    percentiles = [int(p) if p == int(p) else p for p in percentiles]
+
+    metrics = JobStageMetric.objects.filter(result__project_id=project_id)
+    stage = request.query_params.get("stage", request.data.get("stage", None))
+    if stage is not None:
+        metrics = metrics.filter(stage=stage)
+
+    return JsonResponse(
+        get_metric_percentiles(metrics, group_by, percentiles),
+        safe=False,
+        json_dumps_params={"sort_keys": True, "indent": 4},
+    )
@@ -1,12 +1,393 @@
-from django.http import JsonResponse, HttpResponseNotFound
+import atexit
+import csv
+import datetime
+import io
+import json
+
+import numpy as np
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import (
+    BooleanField,
+    Count,
+    F,
+    IntegerField,
+    Max,
+    OuterRef,
+    Q,
+    Subquery,
+    Value,
+)
+from django.db.models.functions import Coalesce
+from django.http import (
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseNotFound,
+    JsonResponse,
+)
+from rest_framework.decorators import api_view
+from django.utils import timezone
 from django.utils.decorators import method_decorator
 from django.shortcuts import get_object_or_404
+import pytz
 
+from catmaid.consumers import msg_user
 from catmaid.control.authentication import requires_user_role
 from catmaid.models import UserRole
-from autoproofreader.models import ProofreadTreeNodes, ProofreadTreeNodesSerializer
+from autoproofreader.models import (
+    AutoproofreaderResult,
+    ProofreadTreeNodes,
+    ProofreadTreeNodesSerializer,
+    ProofreadTreeNodeReview,
+    ResultSubscription,
+    ResultSummary,
+    ResultSummarySerializer,
+)
+from autoproofreader.broadcast import ReviewBroadcaster
+from autoproofreader.cache import result_cache
+from autoproofreader.node_arrays import (
+    COLUMNS,
+    NO_PARENT,
+    delete_node_arrays,
+    encode_node_columns,
+    has_node_arrays,
+    load_node_arrays,
+)
+from autoproofreader.summaries import summarize_nodes
+from rest_framework import serializers
 from rest_framework.views import APIView
 
+# Order of the values in each row passed to copy_proofread_nodes
+SCORE_COLUMNS = (
+    "node_id",
+    "parent_id",
+    "x",
+    "y",
+    "z",
+    "branch_score",
+    "branch_dx",
+    "branch_dy",
+    "branch_dz",
+    "connectivity_score",
+)
+
+
+def copy_proofread_nodes(result_id, user_id, project_id, rows):
+    """
+    Bulk load the scores of a result with a single COPY. Each row holds
+    the values of SCORE_COLUMNS in order, None is stored as NULL.
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in rows:
+        writer.writerow((result_id, user_id, project_id) + tuple(row))
+    buf.seek(0)
+
+    columns = ("result_id", "user_id", "project_id") + SCORE_COLUMNS
+    with connection.cursor() as cursor:
+        cursor.copy_expert(
+            "COPY {} ({}) FROM STDIN WITH (FORMAT csv)".format(
+                ProofreadTreeNodes._meta.db_table, ", ".join(columns)
+            ),
+            buf,
+        )
+
+
+def score_row_columns(rows):
+    """Columns of score rows in the order of SCORE_COLUMNS, None becomes NaN."""
+    return {
+        name: np.array(
+            [np.nan if row[i] is None else row[i] for row in rows], dtype=np.float64
+        )
+        for i, name in enumerate(SCORE_COLUMNS)
+    }
+
+
+def with_review_state(nodes):
+    """
+    Annotate proofread nodes with the `reviewed` flag and `editor` of their
+    review. Nodes that were never reviewed are unreviewed and edited by
+    their creator.
+    """
+    reviews = ProofreadTreeNodeReview.objects.filter(
+        result_id=OuterRef("result_id"), node_id=OuterRef("node_id")
+    )
+    return nodes.annotate(
+        reviewed=Coalesce(
+            Subquery(reviews.values("reviewed")[:1], output_field=BooleanField()),
+            Value(False),
+        ),
+        editor=Coalesce(
+            Subquery(reviews.values("editor_id")[:1], output_field=IntegerField()),
+            F("user_id"),
+        ),
+    )
+
+
+# Formats timestamps like the model serializers
+_timestamp = serializers.DateTimeField(
+    default_timezone=pytz.timezone("UTC")
+).to_representation
+
+
+def decode_result_nodes(result):
+    """
+    Decode the nodes of a result, without their review state, into a dict
+    of column name to array. Columns that are the same for every node of
+    the result hold a single value. Array stored nodes have no primary
+    key, they are identified by their result and node_id.
+    """
+    if result.node_storage == "arrays":
+        columns = load_node_arrays(result)
+        if columns is None:
+            columns = {name: np.empty(0, dtype) for name, dtype in COLUMNS.items()}
+        timestamp = _timestamp(result.completion_time or result.creation_time)
+        columns.update(
+            {
+                "id": None,
+                "user": result.user_id,
+                "project": result.project_id,
+                "creation_time": timestamp,
+                "edition_time": timestamp,
+            }
+        )
+    else:
+        fields = ("id", "user_id", "project_id", "creation_time", "edition_time")
+        rows = (
+            ProofreadTreeNodes.objects.filter(result_id=result.id)
+            .order_by("id")
+            .values_list(*(fields + SCORE_COLUMNS))
+        )
+        n_fields = len(fields)
+        values = list(zip(*rows)) or [()] * (n_fields + len(SCORE_COLUMNS))
+        columns = {
+            "id": np.asarray(values[0], dtype=np.int64),
+            "user": np.asarray(values[1], dtype=np.int64),
+            "project": np.asarray(values[2], dtype=np.int64),
+            "creation_time": np.asarray([_timestamp(t) for t in values[3]], dtype=str),
+            "edition_time": np.asarray([_timestamp(t) for t in values[4]], dtype=str),
+        }
+        for name, column in zip(SCORE_COLUMNS, values[n_fields:]):
+            if name == "parent_id":
+                column = [NO_PARENT if v is None else v for v in column]
+            elif name == "connectivity_score":
+                column = [np.nan if v is None else v for v in column]
+            # keep the full precision of the database
+            dtype = np.float64 if COLUMNS[name] == np.float32 else COLUMNS[name]
+            columns[name] = np.asarray(column, dtype=dtype)
+    columns["result"] = result.id
+    return columns
+
+
+def encode_result_nodes(result, columns):
+    """
+    Combine decoded nodes with their current review state and encode them
+    as the JSON list ProofreadTreeNodesSerializer would give.
+    """
+    node_ids = columns["node_id"]
+    reviewed = np.zeros(len(node_ids), dtype=bool)
+    editors = np.empty(len(node_ids), dtype=np.int64)
+    editors[:] = columns["user"]
+    reviews = list(
+        ProofreadTreeNodeReview.objects.filter(result_id=result.id).values_list(
+            "node_id", "reviewed", "editor_id"
+        )
+    )
+    if len(reviews) > 0 and len(node_ids) > 0:
+        review_nodes, review_states, review_editors = (
+            np.asarray(values) for values in zip(*reviews)
+        )
+        order = np.argsort(node_ids, kind="stable")
+        found = np.minimum(
+            np.searchsorted(node_ids[order], review_nodes), len(node_ids) - 1
+        )
+        known = node_ids[order][found] == review_nodes
+        rows = order[found[known]]
+        reviewed[rows] = review_states[known]
+        editors[rows] = review_editors[known]
+
+    return encode_node_columns(dict(columns, reviewed=reviewed, editor=editors))
+
+
+def join_json_lists(texts):
+    """Join encoded JSON lists, written with indent=4, into one list."""
+    items = [text[2:-2] for text in texts if text != "[]"]
+    return "[\n" + ",\n".join(items) + "\n]" if len(items) > 0 else "[]"
+
+
+def result_node_columns(result):
+    """
+    The decoded nodes of a result, kept in the result cache once the
+    result is complete.
+    """
+    cacheable = result.status == "complete"
+    arrays_key = ("node-arrays", result.id)
+    node_state = (result.node_storage, result.edition_time)
+    columns = result_cache.get(arrays_key, node_state) if cacheable else None
+    if columns is None:
+        columns = decode_result_nodes(result)
+        if cacheable:
+            result_cache.set(arrays_key, columns, node_state)
+    return columns
+
+
+def result_nodes_response(result):
+    """
+    The encoded JSON list of all nodes of a result. Once a result is complete
+    its scores never change, so the decoded nodes and the encoded response
+    are kept in the result cache until the nodes or the review state of the
+    result change.
+    """
+    cacheable = result.status == "complete"
+    response_key = ("node-response", result.id)
+    reviews = ProofreadTreeNodeReview.objects.filter(result_id=result.id).aggregate(
+        Count("id"), Max("edition_time")
+    )
+    response_state = (
+        reviews["id__count"],
+        reviews["edition_time__max"],
+        result.node_storage,
+        result.edition_time,
+    )
+
+    content = result_cache.get(response_key, response_state) if cacheable else None
+    if content is not None:
+        return content
+
+    content = encode_result_nodes(result, result_node_columns(result))
+    if cacheable:
+        result_cache.set(response_key, content, response_state)
+    return content
+
+
+def summarize_result(result, columns):
+    """An unsaved summary of the decoded nodes and the reviews of a result."""
+    return ResultSummary(
+        result=result,
+        node_count=len(columns["node_id"]),
+        reviewed_count=ProofreadTreeNodeReview.objects.filter(
+            result_id=result.id, reviewed=True
+        ).count(),
+        scores=summarize_nodes(columns),
+    )
+
+
+def store_result_summary(result, columns):
+    """Store the summary of the decoded nodes of a result, replacing any earlier one."""
+    summary = summarize_result(result, columns)
+    ResultSummary.objects.update_or_create(
+        result_id=result.id,
+        defaults={
+            "node_count": summary.node_count,
+            "reviewed_count": summary.reviewed_count,
+            "scores": summary.scores,
+        },
+    )
+    return summary
+
+
+@api_view(["GET"])
+@requires_user_role(UserRole.Browse)
+def get_result_summary(request, project_id, result_id):
+    """Node counts and score statistics of a result.
+
+    Returns the number of nodes and reviewed nodes of the result and, for
+    its branch and connectivity scores, their count, minimum, maximum,
+    mean, 5th to 95th percentiles and a histogram of 20 equally wide bins
+    between minimum and maximum. Nodes without a score are not counted.
+    Summaries of complete results are stored with their scores, those of
+    running jobs are computed from the nodes ingested so far.
+    """
+    result = AutoproofreaderResult.objects.filter(
+        Q(project=project_id)
+        & Q(id=result_id)
+        & (Q(user=request.user.id) | Q(private=False))
+    ).first()
+    if result is None:
+        return HttpResponseNotFound("No results found with id {}".format(result_id))
+
+    complete = result.status == "complete"
+    summary = (
+        ResultSummary.objects.filter(result_id=result.id).first() if complete else None
+    )
+    if summary is None:
+        columns = result_node_columns(result)
+        if complete:
+            # Results stored before summaries existed
+            summary = store_result_summary(result, columns)
+        else:
+            summary = summarize_result(result, columns)
+
+    return JsonResponse(
+        ResultSummarySerializer(summary).data,
+        json_dumps_params={"sort_keys": True, "indent": 4},
+    )
+
+
+def review_subscription_ttl():
+    """Seconds a subscription to the reviews of a result lasts."""
+    return getattr(settings, "AUTOPROOFREADER_REVIEW_SUBSCRIPTION_TTL", 12 * 3600)
+
+
+def subscribe_to_reviews(result, user_id):
+    """
+    Send the review changes of a result to a user viewing it, until the
+    subscription expires after AUTOPROOFREADER_REVIEW_SUBSCRIPTION_TTL
+    seconds without viewing the result again. Subscriptions are only
+    renewed once half of that passed, so viewing a result doesn't write
+    a row every time.
+    """
+    if result.private and result.user_id != user_id:
+        return
+    now = timezone.now()
+    renewal = now - datetime.timedelta(seconds=review_subscription_ttl() / 2)
+    if ResultSubscription.objects.filter(
+        result_id=result.id, user_id=user_id, edition_time__gte=renewal
+    ).exists():
+        return
+    ResultSubscription.objects.update_or_create(
+        result_id=result.id, user_id=user_id, defaults={"edition_time": now}
+    )
+
+
+def send_review_changes(result_id, changes):
+    """Send a batch of review changes to every subscriber of a result."""
+    expiry = timezone.now() - datetime.timedelta(seconds=review_subscription_ttl())
+    try:
+        subscriptions = ResultSubscription.objects.filter(result_id=result_id)
+        subscriptions.filter(edition_time__lt=expiry).delete()
+        user_ids = list(subscriptions.values_list("user_id", flat=True))
+    finally:
+        # Batches are sent from their own thread
+        connection.close()
+    payload = {
+        "result_id": result_id,
+        "reviews": [
+            {"node_id": node_id, "reviewed": reviewed, "editor": editor_id}
+            for node_id, reviewed, editor_id in changes
+        ],
+    }
+    for user_id in user_ids:
+        msg_user(user_id, "autoproofreader-review-update", payload)
+
+
+review_broadcaster = ReviewBroadcaster(send_review_changes)
+# The timer thread dies with the worker, pending changes are sent on exit
+atexit.register(review_broadcaster.flush)
+
+
+def broadcast_review(result_id, node_id, reviewed, editor_id):
+    """
+    Send a review change to the subscribers of its result, batched with
+    the changes of the next AUTOPROOFREADER_REVIEW_BROADCAST_DELAY seconds.
+    """
+    delay = getattr(settings, "AUTOPROOFREADER_REVIEW_BROADCAST_DELAY", 0.5)
+    if delay is None:
+        return
+    review_broadcaster.add(result_id, node_id, reviewed, editor_id, delay)
+
 
 class ProofreadTreeNodeAPI(APIView):
     @method_decorator(requires_user_role(UserRole.Browse))
@@ -30,18 +411,25 @@ class ProofreadTreeNodeAPI(APIView):
             "result_id", request.data.get("result_id", None)
         )
         if result_id is not None:
-            nodes = ProofreadTreeNodesSerializer(
-                ProofreadTreeNodes.objects.filter(result_id=result_id), many=True
-            ).data
+            result = AutoproofreaderResult.objects.filter(id=result_id).first()
+            if result is None:
+                return JsonResponse([], safe=False)
+            subscribe_to_reviews(result, request.user.id)
+            return HttpResponse(
+                result_nodes_response(result), content_type="application/json"
+            )
 
         else:
             nodes = ProofreadTreeNodesSerializer(
-                ProofreadTreeNodes.objects.all(), many=True
+                with_review_state(ProofreadTreeNodes.objects.all()), many=True
             ).data
+            texts = [json.dumps(nodes, cls=DjangoJSONEncoder, sort_keys=True, indent=4)]
+            for result in AutoproofreaderResult.objects.filter(
+                project=project_id, node_storage="arrays"
+            ):
+                texts.append(encode_result_nodes(result, decode_result_nodes(result)))
 
-        return JsonResponse(
-            nodes, safe=False, json_dumps_params={"sort_keys": True, "indent": 4}
-        )
+        return HttpResponse(join_json_lists(texts), content_type="application/json")
 
     @method_decorator(requires_user_role(UserRole.QueueComputeTask))
     def delete(self, request, project_id):
@@ -65,18 +453,34 @@ class ProofreadTreeNodeAPI(APIView):
         )
 
         nodes = ProofreadTreeNodes.objects.filter(result_id=result_id)
-        if len(nodes) < 1:
+        result = AutoproofreaderResult.objects.filter(
+            id=result_id, node_storage="arrays"
+        ).first()
+        arrays = result is not None and has_node_arrays(result)
+        if len(nodes) < 1 and not arrays:
             return HttpResponseNotFound(
                 "No nodes found for result {}".format(result_id)
             )
         nodes.delete()
+        if arrays:
+            delete_node_arrays(result)
+        ProofreadTreeNodeReview.objects.filter(result_id=result_id).delete()
+        ResultSummary.objects.filter(result_id=result_id).delete()
+
+        # Touch the result so that other processes notice the change
+        AutoproofreaderResult.objects.filter(id=result_id).update(
+            edition_time=timezone.now()
+        )
+        result_cache.invalidate("node-arrays", int(result_id))
+        result_cache.invalidate("node-response", int(result_id))
 
         return JsonResponse({"success": True})
 
     @method_decorator(requires_user_role(UserRole.QueueComputeTask))
     def patch(self, request, project_id):
         """
-        Toggle proofread tree node reviewed tag.
+        Toggle proofread tree node reviewed tag. The change is sent to
+        everyone viewing the result.
         ---
         parameters:
           - name: project_id
@@ -85,18 +489,97 @@ class ProofreadTreeNodeAPI(APIView):
             paramType: path
             required: true
           - name: node_pk
-            description: The node for which to toggle reviewed tag.
+            description: |
+              The node for which to toggle reviewed tag. Not available
+              for results stored as arrays, use result_id and node_id.
             type: int
             paramType: form
-            required: true
+            required: false
+          - name: result_id
+            description: The result of the node, if node_pk is not given.
+            type: int
+            paramType: form
+            required: false
+          - name: node_id
+            description: The node_id of the node, if node_pk is not given.
+            type: int
+            paramType: form
+            required: false
         """
         node_pk = request.query_params.get("node_pk", request.data.get("node_pk", None))
+        result_id = request.query_params.get(
+            "result_id", request.data.get("result_id", None)
+        )
+        node_id = request.query_params.get("node_id", request.data.get("node_id", None))
+        try:
+            if node_pk is not None:
+                node_pk = int(node_pk)
+            else:
+                result_id, node_id = int(result_id), int(node_id)
+        except (TypeError, ValueError):
+            return HttpResponseBadRequest(
+                "Either node_pk or result_id and node_id have to be given as integers"
+            )
         if request.query_params.get("reviewed", request.data.get("reviewed", False)):
-            # toggle privacy setting if result belongs to this user.
-            result = get_object_or_404(
-                ProofreadTreeNodes, id=node_pk, user=request.user.id, project=project_id
+            # toggle reviewed flag if node belongs to this user.
+            if node_pk is not None:
+                node = get_object_or_404(
+                    ProofreadTreeNodes,
+                    id=node_pk,
+                    user=request.user.id,
+                    project=project_id,
+                )
+                result_id, node_id = node.result_id, node.node_id
+            else:
+                result = get_object_or_404(
+                    AutoproofreaderResult,
+                    id=result_id,
+                    user=request.user.id,
+                    project=project_id,
+                )
+                if result.node_storage == "arrays":
+                    arrays = load_node_arrays(result)
+                    exists = arrays is not None and bool(
+                        (arrays["node_id"] == node_id).any()
+                    )
+                else:
+                    exists = ProofreadTreeNodes.objects.filter(
+                        result_id=result.id, node_id=node_id
+                    ).exists()
+                if not exists:
+                    return HttpResponseNotFound(
+                        "No node {} found for result {}".format(node_id, result_id)
+                    )
+
+            # Toggles of a result are applied one after the other: the summary
+            # and the review are locked until the new count is stored, so
+            # concurrent toggles can neither be lost nor skew the count
+            with transaction.atomic():
+                summaries = list(
+                    ResultSummary.objects.select_for_update().filter(
+                        result_id=result_id
+                    )
+                )
+                review, _ = ProofreadTreeNodeReview.objects.get_or_create(
+                    result_id=result_id,
+                    node_id=node_id,
+                    defaults={"editor_id": request.user.id},
+                )
+                review = ProofreadTreeNodeReview.objects.select_for_update().get(
+                    id=review.id
+                )
+                review.reviewed = not review.reviewed
+                review.editor_id = request.user.id
+                review.edition_time = timezone.now()
+                review.save()
+                for summary in summaries:
+                    summary.reviewed_count = ProofreadTreeNodeReview.objects.filter(
+                        result_id=result_id, reviewed=True
+                    ).count()
+                    summary.save(update_fields=["reviewed_count"])
+            result_cache.invalidate("node-response", int(result_id))
+            broadcast_review(
+                int(result_id), int(node_id), review.reviewed, request.user.id
             )
-            result.reviewed = not result.reviewed
-            result.save()
 
-        return JsonResponse({"reviewed": result.reviewed})
+        return JsonResponse({"reviewed": review.reviewed})
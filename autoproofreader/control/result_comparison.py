@@ -0,0 +1,118 @@
+from django.db.models import Q
+from django.http import JsonResponse, HttpResponseBadRequest, HttpResponseNotFound
+
+from catmaid.control.authentication import requires_user_role
+from catmaid.models import UserRole
+from rest_framework.decorators import api_view
+
+from autoproofreader.comparison import (
+    COMPARED_SCORES,
+    DEFAULT_MAX_DISTANCE,
+    DEFAULT_TOP_K,
+    MATCH_MODES,
+    MAX_DISTANCE,
+    compare_nodes,
+)
+from autoproofreader.control.proofread_tree_nodes import result_node_columns
+from autoproofreader.models import AutoproofreaderResult
+
+
+@api_view(["GET"])
+@requires_user_role(UserRole.Browse)
+def compare_results(request, project_id):
+    """Compare the rankings of two results.
+
+    The nodes of both results are joined by node id if both results have
+    the same nodes and by nearest position otherwise. For each score the
+    number of compared nodes, the mean, mean absolute and largest absolute
+    change from result a to result b and the Spearman rank correlation are
+    returned, along with the joined nodes whose score changed the most.
+    ---
+    parameters:
+      - name: result_a
+        description: ID of the first result.
+        type: integer
+        required: true
+        paramType: form
+      - name: result_b
+        description: ID of the second result.
+        type: integer
+        required: true
+        paramType: form
+      - name: match
+        description: auto, node_id or position. Defaults to auto.
+        type: string
+        required: false
+        paramType: form
+      - name: max_distance
+        description: Largest distance in nm between nodes joined by position, at most 10000.
+        type: number
+        required: false
+        paramType: form
+      - name: k
+        description: Number of disagreements to return. Defaults to 20.
+        type: integer
+        required: false
+        paramType: form
+      - name: score
+        description: Score whose disagreements are returned. Defaults to branch_score.
+        type: string
+        required: false
+        paramType: form
+    """
+
+    def param(name, default=None):
+        return request.query_params.get(name, request.data.get(name, default))
+
+    match = param("match", "auto")
+    if match not in MATCH_MODES:
+        return HttpResponseBadRequest(
+            "Unknown match {}, expected one of {}".format(match, ", ".join(MATCH_MODES))
+        )
+    score = param("score", "branch_score")
+    if score not in COMPARED_SCORES:
+        return HttpResponseBadRequest(
+            "Unknown score {}, expected one of {}".format(
+                score, ", ".join(COMPARED_SCORES)
+            )
+        )
+    try:
+        result_ids = [int(param("result_a")), int(param("result_b"))]
+        max_distance = float(param("max_distance", DEFAULT_MAX_DISTANCE))
+        top_k = int(param("k", DEFAULT_TOP_K))
+    except (TypeError, ValueError):
+        return HttpResponseBadRequest(
+            "result_a and result_b have to be result ids, "
+            "max_distance a number and k an integer"
+        )
+    if not 0 < max_distance <= MAX_DISTANCE or top_k < 0:
+        return HttpResponseBadRequest(
+            "max_distance has to be positive and at most {}, "
+            "k must not be negative".format(MAX_DISTANCE)
+        )
+
+    results = []
+    for result_id in result_ids:
+        query_set = AutoproofreaderResult.objects.filter(
+            Q(project=project_id)
+            & Q(id=result_id)
+            & (Q(user=request.user.id) | Q(private=False))
+        )
+        if len(query_set) != 1:
+            return HttpResponseNotFound("No results found with id {}".format(result_id))
+        results.append(query_set[0])
+
+    try:
+        comparison = compare_nodes(
+            result_node_columns(results[0]),
+            result_node_columns(results[1]),
+            match=match,
+            max_distance=max_distance,
+            top_k=top_k,
+            score=score,
+        )
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    comparison["result_a"], comparison["result_b"] = result_ids
+    comparison["score"] = score
+    return JsonResponse(comparison, json_dumps_params={"sort_keys": True, "indent": 4})
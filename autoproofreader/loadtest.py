@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+"""A stand-in compute server and latency statistics for load tests.
+
+The stand-in replaces ssh, scp, nvidia-smi, sarbor-error-detector and the
+SLURM commands sbatch, squeue, sacct and scancel with scripts in one
+directory, which is put in front of PATH of the web and celery workers
+under test. ssh runs the remote commands locally in a directory that plays
+the file system of the compute server, scp copies files to and from that
+directory and sarbor writes synthetic outputs (see benchmarks.py) for the
+skeleton of a job, its rankings in chunks (see list_chunks in
+control/autoproofreader.py) spread over a configurable delay. ssh and scp
+sleep for a configurable delay first, so the time jobs take can be chosen
+freely.
+"""
+from collections import OrderedDict, defaultdict
+import os
+from pathlib import Path
+import stat
+import sys
+import threading
+
+import numpy as np
+
+import autoproofreader
+
+# Script shared by the stand-in commands. REMOTE is the directory playing the
+# compute server, remote paths are relative to it.
+FAKE_COMMON = '''#!{python}
+import glob
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, {package_path!r})
+REMOTE = {remote!r}
+DELAYS = {delays!r}
+
+
+def parse_args(args, flags_with_values=("-i", "-o", "-P", "-p", "-l")):
+    """Split arguments into options and the remaining operands."""
+    operands = []
+    i = 0
+    while i < len(args):
+        if args[i] in flags_with_values and (args[i] != "-p" or PROGRAM == "ssh"):
+            i += 2
+        elif args[i].startswith("-"):
+            i += 1
+        else:
+            operands.append(args[i])
+            i += 1
+    return operands
+
+
+def remote_path(path):
+    """Local path of a path given as user@host:path."""
+    if ":" not in path:
+        return path
+    path = path.split(":", 1)[1]
+    if path.startswith("~/"):
+        path = path[2:]
+    return os.path.join(REMOTE, path)
+'''
+
+FAKE_SSH = """
+PROGRAM = "ssh"
+time.sleep(DELAYS["ssh"])
+operands = parse_args(sys.argv[1:])
+os.makedirs(REMOTE, exist_ok=True)
+env = dict(os.environ, HOME=REMOTE)
+# Without a command, the remote commands are read from stdin
+command = ["bash", "-c", " ".join(operands[1:])] if len(operands) > 1 else ["bash"]
+sys.exit(subprocess.call(command, cwd=REMOTE, env=env))
+"""
+
+FAKE_SCP = """
+PROGRAM = "scp"
+time.sleep(DELAYS["scp"])
+operands = parse_args(sys.argv[1:])
+target = remote_path(operands[-1])
+sources = []
+for source in operands[:-1]:
+    matches = sorted(glob.glob(remote_path(source)))
+    if len(matches) == 0:
+        sys.stderr.write("scp: {}: No such file or directory\\n".format(source))
+        sys.exit(1)
+    sources.extend(matches)
+os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+# Several sources are copied into the target directory
+if len(sources) > 1:
+    os.makedirs(target, exist_ok=True)
+for source in sources:
+    destination = target
+    if os.path.isdir(target):
+        destination = os.path.join(target, os.path.basename(source.rstrip("/")))
+    if os.path.isdir(source):
+        # Outputs copied by an earlier attempt are replaced
+        shutil.rmtree(destination, ignore_errors=True)
+        shutil.copytree(source, destination)
+    else:
+        shutil.copy2(source, destination)
+"""
+
+FAKE_SARBOR = """
+PROGRAM = "sarbor-error-detector"
+import pickle
+import numpy as np
+from pathlib import Path
+from autoproofreader.benchmarks import Skeleton, write_fake_outputs
+
+args = dict(zip(sys.argv[1::2], sys.argv[2::2]))
+skeleton_path = os.path.expanduser(args["--skeleton-csv"])
+rows = [line.split(",") for line in open(skeleton_path) if len(line.strip()) > 0]
+index = {int(row[0]): i for i, row in enumerate(rows)}
+parents = [
+    -1 if len(row[1].strip()) == 0 or int(row[1]) == int(row[0]) else index[int(row[1])]
+    for row in rows
+]
+skeleton = Skeleton(
+    np.array([int(row[0]) for row in rows], dtype=np.int64),
+    np.array(parents, dtype=np.int64),
+    np.array([[float(v) for v in row[2:5]] for row in rows]),
+)
+job_dir = Path(os.path.expanduser(args["--output-file"])).parent
+if not job_dir.is_absolute():
+    job_dir = Path(REMOTE) / job_dir
+shutil.rmtree(str(job_dir / "outputs"), ignore_errors=True)
+write_fake_outputs(skeleton, job_dir)
+
+# Rankings come out in chunks spread over the compute delay
+with open(str(job_dir / "outputs" / "nodes.obj"), "rb") as f:
+    nodes = pickle.load(f)
+with open(str(job_dir / "outputs" / "rankings.obj"), "rb") as f:
+    rankings = pickle.load(f)
+partial = job_dir / "outputs" / "partial"
+partial.mkdir()
+n_chunks = 4
+size = -(-len(nodes) // n_chunks)
+for i in range(n_chunks):
+    time.sleep(DELAYS["compute"] / n_chunks)
+    chunk = slice(i * size, (i + 1) * size)
+    path = partial / "chunk_{}.obj".format(i)
+    with open(str(path) + ".tmp", "wb") as f:
+        pickle.dump((nodes[chunk], rankings[chunk]), f)
+    os.rename(str(path) + ".tmp", str(path))
+"""
+
+FAKE_NVIDIA_SMI = """
+PROGRAM = "nvidia-smi"
+for index in range(2):
+    print(
+        "{}, GPU-fake-{}, 35.0, 16280, 4096, 12184, 450.80, Fake GPU, {}".format(
+            index, index, index
+        )
+    )
+"""
+
+# The stand-in SLURM cluster runs batch jobs right away as background
+# processes. The state of every job is kept in REMOTE/.slurm: <id>.pid while
+# it runs, <id>.exit once it finished and <id>.cancelled if it was cancelled.
+FAKE_SLURM = """
+SLURM_DIR = os.path.join(REMOTE, ".slurm")
+os.makedirs(SLURM_DIR, exist_ok=True)
+
+
+def job_path(job_id, suffix):
+    return os.path.join(SLURM_DIR, "{}.{}".format(job_id, suffix))
+
+
+def job_state(job_id):
+    if os.path.exists(job_path(job_id, "cancelled")):
+        return "CANCELLED"
+    if not os.path.exists(job_path(job_id, "exit")):
+        return "RUNNING" if os.path.exists(job_path(job_id, "pid")) else None
+    with open(job_path(job_id, "exit")) as f:
+        return "COMPLETED" if f.read().strip() == "0" else "FAILED"
+
+
+def option(name):
+    for arg in sys.argv[1:]:
+        if arg.startswith(name + "="):
+            return arg.split("=", 1)[1]
+    if name in sys.argv[1:-1]:
+        return sys.argv[sys.argv.index(name) + 1]
+    return None
+"""
+
+FAKE_SBATCH = """
+PROGRAM = "sbatch"
+job_id = len([f for f in os.listdir(SLURM_DIR) if f.endswith(".pid")]) + 1
+while True:
+    try:
+        fd = os.open(job_path(job_id, "pid"), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        break
+    except FileExistsError:
+        job_id += 1
+output = option("--output") or "slurm-{}.out".format(job_id)
+os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+process = subprocess.Popen(
+    ["bash", "-c", 'bash -c "$1"; echo $? > "$2"', "sbatch", option("--wrap"),
+     job_path(job_id, "exit")],
+    stdout=open(output, "w"),
+    stderr=subprocess.STDOUT,
+    start_new_session=True,
+)
+os.write(fd, str(process.pid).encode())
+os.close(fd)
+print(job_id)
+"""
+
+FAKE_SQUEUE = """
+PROGRAM = "squeue"
+# Fails as often as the number in squeue_errors says
+errors_path = os.path.join(SLURM_DIR, "squeue_errors")
+if os.path.exists(errors_path):
+    with open(errors_path) as f:
+        errors = int(f.read() or 0)
+    if errors > 0:
+        with open(errors_path, "w") as f:
+            f.write(str(errors - 1))
+        sys.exit("squeue: error: Unable to contact slurm controller")
+state = job_state(option("-j"))
+if state == "RUNNING":
+    print(state)
+"""
+
+FAKE_SACCT = """
+PROGRAM = "sacct"
+job_id = option("-j")
+state = job_state(job_id)
+if state is not None:
+    code = 0
+    if os.path.exists(job_path(job_id, "exit")):
+        with open(job_path(job_id, "exit")) as f:
+            code = int(f.read().strip())
+    print("{}|{}:0".format(state, code))
+"""
+
+FAKE_SCANCEL = """
+PROGRAM = "scancel"
+import signal
+
+job_id = sys.argv[-1]
+if job_state(job_id) == "RUNNING":
+    with open(job_path(job_id, "pid")) as f:
+        os.killpg(int(f.read()), signal.SIGTERM)
+    open(job_path(job_id, "cancelled"), "w").close()
+"""
+
+
+def write_fake_compute_server(
+    directory, ssh_delay=0.0, scp_delay=0.0, compute_delay=1.0
+):
+    """
+    Write the stand-in commands to directory/bin and create the directory
+    playing the compute server at directory/remote. Returns the bin
+    directory, which has to come first in PATH. A compute server using the
+    stand-in needs an environment_source_path of "env.sh".
+    """
+    directory = Path(directory)
+    bin_dir = directory / "bin"
+    remote = directory / "remote"
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    remote.mkdir(parents=True, exist_ok=True)
+    (remote / "env.sh").write_text("")
+
+    common = FAKE_COMMON.format(
+        python=sys.executable,
+        package_path=str(Path(autoproofreader.__file__).parent.parent),
+        remote=str(remote),
+        delays={"ssh": ssh_delay, "scp": scp_delay, "compute": compute_delay},
+    )
+    scripts = {
+        "ssh": FAKE_SSH,
+        "scp": FAKE_SCP,
+        "sarbor-error-detector": FAKE_SARBOR,
+        "nvidia-smi": FAKE_NVIDIA_SMI,
+        "sbatch": FAKE_SLURM + FAKE_SBATCH,
+        "squeue": FAKE_SLURM + FAKE_SQUEUE,
+        "sacct": FAKE_SLURM + FAKE_SACCT,
+        "scancel": FAKE_SLURM + FAKE_SCANCEL,
+    }
+    for name, script in scripts.items():
+        path = bin_dir / name
+        path.write_text(common + script)
+        path.chmod(path.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return bin_dir
+
+
+def use_fake_compute_server(bin_dir):
+    """Put the stand-in commands in front of PATH of this process."""
+    os.environ["PATH"] = "{}{}{}".format(bin_dir, os.pathsep, os.environ["PATH"])
+
+
+class LoadStats(object):
+    """Thread safe latencies, statuses and query counts per endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies = defaultdict(list)
+        self._queries = defaultdict(list)
+        self._errors = defaultdict(int)
+
+    def record(self, endpoint, latency, status_code, n_queries):
+        with self._lock:
+            self._latencies[endpoint].append(latency)
+            self._queries[endpoint].append(n_queries)
+            if status_code >= 400:
+                self._errors[endpoint] += 1
+
+    def summary(self, elapsed):
+        """Per endpoint request counts, throughput and latency percentiles in ms."""
+        with self._lock:
+            endpoints = sorted(self._latencies)
+            summary = OrderedDict()
+            for endpoint in endpoints:
+                latencies = np.array(self._latencies[endpoint]) * 1000
+                p50, p95, p99 = np.percentile(latencies, (50, 95, 99)).tolist()
+                summary[endpoint] = OrderedDict(
+                    [
+                        ("requests", len(latencies)),
+                        ("errors", self._errors[endpoint]),
+                        ("throughput", len(latencies) / elapsed),
+                        ("p50_ms", p50),
+                        ("p95_ms", p95),
+                        ("p99_ms", p99),
+                        ("mean_queries", float(np.mean(self._queries[endpoint]))),
+                        ("max_queries", int(np.max(self._queries[endpoint]))),
+                    ]
+                )
+            return summary
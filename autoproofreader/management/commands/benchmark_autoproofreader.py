@@ -0,0 +1,275 @@
+import datetime
+import json
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+
+from catmaid.models import ClassInstance
+
+from autoproofreader.benchmarks import (
+    generate_skeleton,
+    write_fake_outputs,
+    write_skeleton_csv,
+)
+from autoproofreader.control.autoproofreader import (
+    load_outputs,
+    merge_scores,
+    move_segmentation,
+    parse_mesh,
+    save_mesh,
+    store_scores,
+)
+from autoproofreader.control.proofread_tree_nodes import (
+    decode_result_nodes,
+    encode_result_nodes,
+)
+from autoproofreader.models import (
+    AutoproofreaderResult,
+    ConfigFile,
+    DiluvianModel,
+)
+
+# Stages timed for every skeleton, in the order they run in
+BENCHMARK_STAGES = (
+    "parse",
+    "merge",
+    "ingest",
+    "mesh_parse",
+    "mesh",
+    "move",
+    "cleanup",
+    "retrieve",
+    "serialize",
+)
+
+
+class Rollback(Exception):
+    """Raised to undo everything a benchmark stored in the database."""
+
+
+class Command(BaseCommand):
+    help = (
+        "Times the post-compute stages of autoproofreading jobs and node "
+        + "retrieval on synthetic skeletons and sarbor outputs. Nothing is "
+        + "kept in the database, results are written as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--project-id", type=int, required=True)
+        parser.add_argument("--user-id", type=int, required=True)
+        parser.add_argument(
+            "--skeleton-id",
+            type=int,
+            default=None,
+            help="Skeleton the results are attached to, any of the project by default",
+        )
+        parser.add_argument(
+            "--sizes",
+            type=int,
+            nargs="+",
+            default=[1000, 10000, 100000],
+            help="Number of nodes of the generated skeletons",
+        )
+        parser.add_argument(
+            "--storage",
+            nargs="+",
+            default=["rows", "arrays"],
+            choices=["rows", "arrays"],
+        )
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--work-dir",
+            default=None,
+            help="Directory used as MEDIA_ROOT, a temporary directory by default",
+        )
+        parser.add_argument("--output", default=None, help="Write results to this file")
+        parser.add_argument(
+            "--compare", default=None, help="Results of an earlier run to compare to"
+        )
+
+    def handle(self, *args, **options):
+        skeleton_id = options["skeleton_id"]
+        if skeleton_id is None:
+            skeleton = ClassInstance.objects.filter(
+                project_id=options["project_id"], class_column__class_name="skeleton"
+            ).first()
+            if skeleton is None:
+                raise CommandError("Project has no skeleton to attach results to")
+            skeleton_id = skeleton.id
+
+        work_dir = options["work_dir"] or tempfile.mkdtemp()
+        runs = []
+        try:
+            with override_settings(MEDIA_ROOT=work_dir):
+                for n_nodes in options["sizes"]:
+                    for storage in options["storage"]:
+                        self.stdout.write(
+                            "Benchmarking {} nodes stored as {}...".format(
+                                n_nodes, storage
+                            )
+                        )
+                        times = self.benchmark(
+                            options, skeleton_id, n_nodes, storage, Path(work_dir)
+                        )
+                        for stage in BENCHMARK_STAGES:
+                            runs.append(
+                                OrderedDict(
+                                    [
+                                        ("nodes", n_nodes),
+                                        ("storage", storage),
+                                        ("stage", stage),
+                                        ("median", statistics.median(times[stage])),
+                                        ("min", min(times[stage])),
+                                        ("times", times[stage]),
+                                    ]
+                                )
+                            )
+        finally:
+            if options["work_dir"] is None:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+        report = OrderedDict(
+            [
+                ("created", datetime.datetime.utcnow().isoformat() + "Z"),
+                ("version", get_version()),
+                ("python", platform.python_version()),
+                ("repeat", options["repeat"]),
+                ("seed", options["seed"]),
+                ("runs", runs),
+            ]
+        )
+        self.print_report(report, options["compare"])
+        if options["output"] is not None:
+            with open(options["output"], "w") as f:
+                json.dump(report, f, indent=4)
+            self.stdout.write(
+                self.style.SUCCESS("Wrote results to {}".format(options["output"]))
+            )
+
+    def benchmark(self, options, skeleton_id, n_nodes, storage, work_dir):
+        """Time every stage repeat times for one skeleton size and node storage."""
+        skeleton = generate_skeleton(n_nodes, seed=options["seed"])
+        times = {stage: [] for stage in BENCHMARK_STAGES}
+        with override_settings(AUTOPROOFREADER_NODE_STORAGE=storage):
+            for _ in range(options["repeat"]):
+                try:
+                    with transaction.atomic():
+                        result = self.create_result(options, skeleton_id)
+                        result.staging_dir.mkdir()
+                        write_skeleton_csv(
+                            skeleton, result.staging_dir / "skeleton.csv"
+                        )
+                        write_fake_outputs(skeleton, result.staging_dir)
+                        for stage, elapsed in self.run_stages(result):
+                            times[stage].append(elapsed)
+                        raise Rollback()
+                except Rollback:
+                    pass
+                shutil.rmtree(
+                    str(work_dir / "proofreading_segmentations"), ignore_errors=True
+                )
+                shutil.rmtree(
+                    str(work_dir / "proofreading_node_arrays"), ignore_errors=True
+                )
+        return times
+
+    def create_result(self, options, skeleton_id):
+        user_id, project_id = options["user_id"], options["project_id"]
+        config = ConfigFile.for_content(user_id, project_id, "")
+        model = DiluvianModel.objects.create(
+            user_id=user_id,
+            project_id=project_id,
+            name="benchmark",
+            model_source_path="",
+            config=config,
+        )
+        return AutoproofreaderResult.objects.create(
+            user_id=user_id,
+            project_id=project_id,
+            name="benchmark_{}".format(uuid.uuid4().hex),
+            status="complete",
+            config=config,
+            skeleton_id=skeleton_id,
+            model=model,
+            errors="",
+        )
+
+    def run_stages(self, result):
+        """Run the stages on a staged result, yields every stage and its time."""
+        start = time.perf_counter()
+        nodes, rankings = load_outputs(result)
+        yield "parse", time.perf_counter() - start
+
+        start = time.perf_counter()
+        score_rows = merge_scores(nodes, rankings)
+        yield "merge", time.perf_counter() - start
+
+        start = time.perf_counter()
+        store_scores(result, score_rows)
+        result.save()
+        yield "ingest", time.perf_counter() - start
+
+        start = time.perf_counter()
+        vertices, triangles = parse_mesh(result)
+        yield "mesh_parse", time.perf_counter() - start
+
+        start = time.perf_counter()
+        save_mesh(result, vertices, triangles)
+        result.save()
+        yield "mesh", time.perf_counter() - start
+
+        start = time.perf_counter()
+        move_segmentation(result)
+        yield "move", time.perf_counter() - start
+
+        start = time.perf_counter()
+        shutil.rmtree(str(result.staging_dir))
+        yield "cleanup", time.perf_counter() - start
+
+        start = time.perf_counter()
+        columns = decode_result_nodes(result)
+        yield "retrieve", time.perf_counter() - start
+
+        start = time.perf_counter()
+        encode_result_nodes(result, columns)
+        yield "serialize", time.perf_counter() - start
+
+    def print_report(self, report, compare):
+        previous = {}
+        if compare is not None:
+            with open(compare) as f:
+                for run in json.load(f)["runs"]:
+                    previous[(run["nodes"], run["storage"], run["stage"])] = run[
+                        "median"
+                    ]
+
+        for run in report["runs"]:
+            line = "{:>8} nodes {:>6} {:<10} {:10.4f} s".format(
+                run["nodes"], run["storage"], run["stage"], run["median"]
+            )
+            before = previous.get((run["nodes"], run["storage"], run["stage"]), None)
+            if before:
+                change = (run["median"] - before) / before
+                line += " ({:+.0%})".format(change)
+                if change > 0.1:
+                    line = self.style.WARNING(line)
+            self.stdout.write(line)
+
+
+def get_version():
+    try:
+        import pkg_resources
+
+        return pkg_resources.get_distribution("CATMAID-autoproofreader").version
+    except Exception:
+        return None
@@ -0,0 +1,401 @@
+import datetime
+import json
+import random
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.backends.base.creation import TEST_DATABASE_PREFIX
+from django.test import Client
+from django.test.client import MULTIPART_CONTENT, encode_multipart, BOUNDARY
+from django.test.utils import CaptureQueriesContext, override_settings
+from guardian.shortcuts import assign_perm
+
+from catmaid.models import ClassInstance, Project
+
+from autoproofreader.benchmarks import (
+    generate_skeleton,
+    write_fake_outputs,
+    write_skeleton_csv,
+)
+from autoproofreader.control.autoproofreader import ingest_scores
+from autoproofreader.loadtest import (
+    LoadStats,
+    use_fake_compute_server,
+    write_fake_compute_server,
+)
+from autoproofreader.models import (
+    AutoproofreaderResult,
+    ComputeServer,
+    ConfigFile,
+    DiluvianModel,
+)
+
+# Relative frequency of the requests simulated users make
+DEFAULT_MIX = "nodes=10,result=4,results=4,gpu-util=1,submit=1"
+
+
+class Command(BaseCommand):
+    help = (
+        "Drives the autoproofreader API with concurrent simulated users "
+        + "against a stand-in compute server and reports latency percentiles, "
+        + "throughput and database queries per endpoint. Everything created "
+        + "is removed afterwards. Celery workers running the submitted jobs "
+        + "need the printed directory first in their PATH, or use --eager."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--project-id", type=int, required=True)
+        parser.add_argument(
+            "--skeleton-id",
+            type=int,
+            default=None,
+            help="Skeleton results and jobs are attached to, any of the project by default",
+        )
+        parser.add_argument("--users", type=int, default=10)
+        parser.add_argument(
+            "--duration", type=float, default=60, help="Seconds to run for"
+        )
+        parser.add_argument(
+            "--think-time",
+            type=float,
+            default=0.0,
+            help="Mean pause of a user between requests in seconds",
+        )
+        parser.add_argument(
+            "--mix",
+            default=DEFAULT_MIX,
+            help="Weights of the endpoints, default: {}".format(DEFAULT_MIX),
+        )
+        parser.add_argument(
+            "--results", type=int, default=5, help="Number of completed results"
+        )
+        parser.add_argument(
+            "--nodes", type=int, default=10000, help="Nodes of every completed result"
+        )
+        parser.add_argument(
+            "--job-nodes", type=int, default=1000, help="Nodes of submitted skeletons"
+        )
+        parser.add_argument("--ssh-delay", type=float, default=0.2)
+        parser.add_argument("--scp-delay", type=float, default=0.5)
+        parser.add_argument("--compute-delay", type=float, default=5.0)
+        parser.add_argument(
+            "--server-slots",
+            type=int,
+            default=2,
+            help="Concurrent jobs of the stand-in compute server",
+        )
+        parser.add_argument(
+            "--eager",
+            action="store_true",
+            help="Run submitted jobs in the submitting request instead of celery",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--work-dir",
+            default=None,
+            help="Directory for the stand-in compute server, temporary by default",
+        )
+        parser.add_argument("--output", default=None, help="Write results to this file")
+        parser.add_argument(
+            "--allow-database",
+            default=None,
+            help="Name of a database that isn't a test database to run against anyway",
+        )
+
+    def handle(self, *args, **options):
+        # The run creates and deletes users, results and compute servers
+        database = connection.settings_dict["NAME"]
+        if not (
+            database.startswith(TEST_DATABASE_PREFIX)
+            or options["allow_database"] == database
+        ):
+            raise CommandError(
+                "Refusing to write to database {}, which is not a test database. "
+                "Pass --allow-database={} to run against it anyway.".format(
+                    database, database
+                )
+            )
+        mix = parse_mix(options["mix"])
+        project = Project.objects.get(id=options["project_id"])
+        skeleton_id = options["skeleton_id"]
+        if skeleton_id is None:
+            skeleton = ClassInstance.objects.filter(
+                project=project, class_column__class_name="skeleton"
+            ).first()
+            if skeleton is None:
+                raise CommandError("Project has no skeleton to attach results to")
+            skeleton_id = skeleton.id
+
+        work_dir = options["work_dir"] or tempfile.mkdtemp()
+        bin_dir = write_fake_compute_server(
+            work_dir,
+            ssh_delay=options["ssh_delay"],
+            scp_delay=options["scp_delay"],
+            compute_delay=options["compute_delay"],
+        )
+        use_fake_compute_server(bin_dir)
+        self.stdout.write("Stand-in compute server commands: {}".format(bin_dir))
+
+        if options["eager"]:
+            from celery import current_app
+
+            current_app.conf.task_always_eager = True
+
+        run = LoadTest(project, skeleton_id, options)
+        try:
+            run.set_up()
+            self.stdout.write(
+                "Running {} users for {} s...".format(
+                    options["users"], options["duration"]
+                )
+            )
+            with override_settings(
+                ALLOWED_HOSTS=list(settings.ALLOWED_HOSTS) + ["testserver"]
+            ):
+                summary = run.run(mix)
+        finally:
+            run.tear_down()
+            if options["work_dir"] is None:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+        report = OrderedDict(
+            [
+                ("created", datetime.datetime.utcnow().isoformat() + "Z"),
+                ("users", options["users"]),
+                ("duration", options["duration"]),
+                ("mix", mix),
+                (
+                    "delays",
+                    {
+                        k: options[k]
+                        for k in ("ssh_delay", "scp_delay", "compute_delay")
+                    },
+                ),
+                ("endpoints", summary),
+            ]
+        )
+        self.print_report(summary)
+        if options["output"] is not None:
+            with open(options["output"], "w") as f:
+                json.dump(report, f, indent=4)
+            self.stdout.write(
+                self.style.SUCCESS("Wrote results to {}".format(options["output"]))
+            )
+
+    def print_report(self, summary):
+        self.stdout.write(
+            "{:<10} {:>8} {:>6} {:>8} {:>9} {:>9} {:>9} {:>8}".format(
+                "endpoint",
+                "requests",
+                "errors",
+                "req/s",
+                "p50 ms",
+                "p95 ms",
+                "p99 ms",
+                "queries",
+            )
+        )
+        for endpoint, stats in summary.items():
+            line = "{:<10} {:>8} {:>6} {:>8.2f} {:>9.1f} {:>9.1f} {:>9.1f} {:>8.1f}".format(
+                endpoint,
+                stats["requests"],
+                stats["errors"],
+                stats["throughput"],
+                stats["p50_ms"],
+                stats["p95_ms"],
+                stats["p99_ms"],
+                stats["mean_queries"],
+            )
+            if stats["errors"] > 0:
+                line = self.style.WARNING(line)
+            self.stdout.write(line)
+
+
+def parse_mix(mix):
+    """Weights of endpoints from a list like nodes=10,submit=1."""
+    weights = OrderedDict()
+    for entry in mix.split(","):
+        endpoint, _, weight = entry.partition("=")
+        if endpoint not in LoadTest.ENDPOINTS:
+            raise CommandError(
+                "Unknown endpoint {}, choose from {}".format(
+                    endpoint, ", ".join(LoadTest.ENDPOINTS)
+                )
+            )
+        try:
+            weights[endpoint] = float(weight)
+        except ValueError:
+            raise CommandError("Invalid weight of {}: {}".format(endpoint, weight))
+    return weights
+
+
+class LoadTest(object):
+    """The users, server, model and results of one load test run."""
+
+    ENDPOINTS = ("nodes", "result", "results", "gpu-util", "submit")
+
+    def __init__(self, project, skeleton_id, options):
+        self.project = project
+        self.skeleton_id = skeleton_id
+        self.options = options
+        self.tag = "loadtest_{}".format(uuid.uuid4().hex[:8])
+        self.stats = LoadStats()
+        self.user = None
+        self.server = None
+        self.model = None
+        self.result_ids = []
+
+    def url(self, path):
+        return "/ext/autoproofreader/{}/{}".format(self.project.id, path)
+
+    def set_up(self):
+        self.user = User.objects.create_user(self.tag, password=uuid.uuid4().hex)
+        for permission in ("can_browse", "can_queue_compute_task"):
+            assign_perm(permission, self.user, self.project)
+        self.server = ComputeServer.objects.create(
+            name=self.tag,
+            address="loadtest.invalid",
+            diluvian_path="",
+            results_directory="results",
+            environment_source_path="env.sh",
+            ssh_user="guest",
+            ssh_key=self.tag,
+            max_concurrent_jobs=self.options["server_slots"],
+        )
+        config = ConfigFile.for_content(self.user.id, self.project.id, "")
+        self.model = DiluvianModel.objects.create(
+            user=self.user,
+            project=self.project,
+            name=self.tag,
+            model_source_path="",
+            config=config,
+        )
+
+        skeleton = generate_skeleton(self.options["nodes"], seed=self.options["seed"])
+        for i in range(self.options["results"]):
+            result = AutoproofreaderResult.objects.create(
+                user=self.user,
+                project=self.project,
+                name="{}_{}".format(self.tag, i),
+                status="complete",
+                config=config,
+                skeleton_id=self.skeleton_id,
+                model=self.model,
+                server=self.server,
+                private=False,
+                errors="",
+            )
+            try:
+                write_fake_outputs(skeleton, result.staging_dir, seed=i)
+                ingest_scores(result)
+                result.save()
+            finally:
+                shutil.rmtree(str(result.staging_dir), ignore_errors=True)
+            self.result_ids.append(result.id)
+
+        job_skeleton = generate_skeleton(
+            self.options["job_nodes"], seed=self.options["seed"]
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory, "skeleton.csv")
+            write_skeleton_csv(job_skeleton, path)
+            self.job_skeleton_csv = path.read_bytes()
+
+    def tear_down(self):
+        """Remove everything created by the run, including submitted jobs."""
+        if self.server is not None:
+            results = AutoproofreaderResult.objects.filter(server=self.server)
+            for result in results:
+                shutil.rmtree(str(result.staging_dir), ignore_errors=True)
+            results.delete()
+            self.server.delete()
+        if self.model is not None:
+            self.model.delete()
+        if self.user is not None:
+            # Config files created for the run go with their user
+            self.user.delete()
+
+    def run(self, mix):
+        """Run all users for the duration, returns the summary per endpoint."""
+        end = time.monotonic() + self.options["duration"]
+        start = time.monotonic()
+        threads = [
+            threading.Thread(target=self.simulate_user, args=(i, mix, end))
+            for i in range(self.options["users"])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.stats.summary(time.monotonic() - start)
+
+    def simulate_user(self, index, mix, end):
+        """Make requests picked by their weights until the end of the run."""
+        rng = random.Random(self.options["seed"] + index)
+        client = Client()
+        client.force_login(self.user)
+        endpoints, weights = list(mix.keys()), list(mix.values())
+        try:
+            while time.monotonic() < end:
+                endpoint = rng.choices(endpoints, weights)[0]
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    response = self.request(client, endpoint, rng)
+                    latency = time.perf_counter() - start
+                self.stats.record(endpoint, latency, response.status_code, len(queries))
+                if self.options["think_time"] > 0:
+                    time.sleep(rng.expovariate(1 / self.options["think_time"]))
+        finally:
+            # Every thread has its own database connection
+            connection.close()
+
+    def request(self, client, endpoint, rng):
+        if endpoint == "nodes":
+            return client.get(
+                self.url("proofread-tree-nodes"),
+                {"result_id": rng.choice(self.result_ids)},
+            )
+        if endpoint == "result":
+            return client.get(
+                self.url("autoproofreader-results"),
+                {"result_id": rng.choice(self.result_ids)},
+            )
+        if endpoint == "results":
+            return client.get(self.url("autoproofreader-results"), {"summary": "true"})
+        if endpoint == "gpu-util":
+            return client.get(self.url("gpu-util"), {"server_id": self.server.id})
+        return self.submit(client)
+
+    def submit(self, client):
+        job_config = {
+            "skeleton_id": self.skeleton_id,
+            "model_id": self.model.id,
+            "server_id": self.server.id,
+            "segmentation_type": "cached_lsd",
+            "job_name": "{}_job_{}".format(self.tag, uuid.uuid4().hex[:8]),
+        }
+        files = {
+            name: SimpleUploadedFile(name, content)
+            for name, content in (
+                ("job_config.json", json.dumps(job_config).encode()),
+                ("sarbor_config.toml", b""),
+                ("all_settings.toml", b""),
+                ("cached_lsd_config.toml", b""),
+                ("skeleton.csv", self.job_skeleton_csv),
+            )
+        }
+        return client.put(
+            self.url("autoproofreader"),
+            encode_multipart(BOUNDARY, files),
+            content_type=MULTIPART_CONTENT,
+        )
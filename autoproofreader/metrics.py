@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""Resource usage of the stages of autoproofreader jobs.
+
+Every stage a job runs records its wall time, the bytes it copied or
+read, the rows it ingested and the peak resident memory of the worker in
+a JobStageMetric row. Where the kernel allows it (/proc/self/clear_refs
+on Linux), the memory peak is reset at the start of every stage, otherwise
+it is the peak since the worker started. Recorded metrics are summarized
+as percentiles per compute server, model or skeleton size.
+"""
+from collections import defaultdict, OrderedDict
+from contextlib import contextmanager
+import math
+import resource
+import time
+
+import numpy as np
+
+from autoproofreader.models import JobStageMetric
+from autoproofreader.profiling import profiled_stage
+
+# Metrics that percentiles are computed for
+METRIC_FIELDS = ("wall_time", "bytes_transferred", "rows_ingested", "peak_rss")
+
+# Ways metrics can be grouped, mapped to the field they are grouped by
+METRIC_GROUPS = OrderedDict(
+    [
+        ("server", "result__server_id"),
+        ("model", "result__model_id"),
+        ("skeleton_size", "skeleton_nodes"),
+    ]
+)
+
+DEFAULT_PERCENTILES = (50, 90, 99)
+
+
+def reset_peak_rss():
+    """Start a new memory peak for this process, if the kernel allows it."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def get_peak_rss():
+    """Peak resident memory of this process in bytes."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is given in kilobytes
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def directory_size(path):
+    """Total size in bytes of the files below path, 0 if it doesn't exist."""
+    if not path.exists():
+        return 0
+    if path.is_file():
+        return path.stat().st_size
+    return sum(f.stat().st_size for f in path.glob("**/*") if f.is_file())
+
+
+def count_skeleton_nodes(result):
+    """Number of nodes of the staged skeleton of a job, if it is staged."""
+    skeleton_path = result.staging_dir / "skeleton.csv"
+    if not skeleton_path.exists():
+        return None
+    with skeleton_path.open() as f:
+        return sum(1 for line in f if len(line.strip()) > 0)
+
+
+def skeleton_size_bucket(skeleton_nodes):
+    """Lower bound of the power of ten range a skeleton size falls into."""
+    if skeleton_nodes is None:
+        return None
+    if skeleton_nodes < 1:
+        return 0
+    return 10 ** int(math.log10(skeleton_nodes))
+
+
+class JobMetrics(object):
+    """Records the stages run by one task for its jobs."""
+
+    def __init__(self, results):
+        self.skeleton_nodes = {
+            result.id: count_skeleton_nodes(result) for result in results
+        }
+
+    @contextmanager
+    def stage(self, results, stage):
+        """
+        Measure a stage run at once for results. Yields a dict the stage
+        can fill with the bytes_transferred and rows_ingested of each
+        result id. Nothing is recorded if the stage raises. The stage is
+        profiled if AUTOPROOFREADER_PROFILE_JOBS is set.
+        """
+        counts = defaultdict(dict)
+        reset_peak_rss()
+        start = time.monotonic()
+        with profiled_stage(results, stage):
+            yield counts
+        wall_time = time.monotonic() - start
+        peak_rss = get_peak_rss()
+        JobStageMetric.objects.bulk_create(
+            [
+                JobStageMetric(
+                    result_id=result.id,
+                    stage=stage,
+                    pack_size=len(results),
+                    skeleton_nodes=self.skeleton_nodes.get(result.id, None),
+                    wall_time=wall_time,
+                    peak_rss=peak_rss,
+                    **counts[result.id]
+                )
+                for result in results
+            ]
+        )
+
+
+def get_metric_percentiles(metrics, group_by, percentiles=DEFAULT_PERCENTILES):
+    """
+    Percentiles of each metric per group and stage of a JobStageMetric
+    queryset. Skeleton sizes are grouped by power of ten ranges. Values
+    that were not recorded are left out, metrics without any value have
+    no percentiles.
+    """
+    values = defaultdict(lambda: defaultdict(list))
+    counts = defaultdict(int)
+    for row in metrics.values_list(METRIC_GROUPS[group_by], "stage", *METRIC_FIELDS):
+        group = row[0]
+        if group_by == "skeleton_size":
+            group = skeleton_size_bucket(group)
+        key = (group, row[1])
+        counts[key] += 1
+        for field, value in zip(METRIC_FIELDS, row[2:]):
+            if value is not None:
+                values[key][field].append(value)
+
+    summary = []
+    for group, stage in sorted(counts, key=lambda k: (k[0] is None, k[0] or 0, k[1])):
+        entry = {"group": group, "stage": stage, "count": counts[(group, stage)]}
+        for field in METRIC_FIELDS:
+            field_values = values[(group, stage)][field]
+            if len(field_values) == 0:
+                entry[field] = None
+                continue
+            entry[field] = OrderedDict(
+                (str(p), v)
+                for p, v in zip(
+                    percentiles,
+                    np.percentile(np.array(field_values), percentiles).tolist(),
+                )
+            )
+        summary.append(entry)
+    return summary
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+forward_split_reviews = """
+    CREATE TABLE autoproofreader_proofreadtreenodereview (
+        id serial NOT NULL PRIMARY KEY,
+        result_id integer NOT NULL
+            REFERENCES autoproofreader_autoproofreaderresult (id)
+            DEFERRABLE INITIALLY DEFERRED,
+        node_id integer NOT NULL,
+        reviewed boolean DEFAULT false NOT NULL,
+        editor_id integer NOT NULL
+            REFERENCES auth_user (id)
+            DEFERRABLE INITIALLY DEFERRED,
+        edition_time timestamp with time zone DEFAULT now() NOT NULL,
+        txid bigint DEFAULT txid_current() NOT NULL,
+        UNIQUE (result_id, node_id)
+    );
+
+    -- Keep existing review state
+    INSERT INTO autoproofreader_proofreadtreenodereview
+        (result_id, node_id, reviewed, editor_id, edition_time)
+    SELECT result_id, node_id, reviewed, editor_id, edition_time
+    FROM autoproofreader_proofreadtreenodes
+    WHERE reviewed
+    ON CONFLICT DO NOTHING;
+
+    -- Scores are machine generated and never edited, stop tracking them
+    SELECT disable_history_tracking_for_table('autoproofreader_proofreadtreenodes'::regclass,
+        get_history_table_name('autoproofreader_proofreadtreenodes'::regclass));
+    SELECT drop_history_table('autoproofreader_proofreadtreenodes'::regclass);
+
+    ALTER TABLE autoproofreader_proofreadtreenodes
+        DROP COLUMN reviewed,
+        DROP COLUMN editor_id,
+        DROP COLUMN txid;
+
+    CREATE INDEX autoproofreader_proofreadtreenodes_result_id
+        ON autoproofreader_proofreadtreenodes (result_id);
+
+    -- Create history tables
+    SELECT create_history_table('autoproofreader_proofreadtreenodereview'::regclass, 'edition_time', 'txid');
+"""
+
+backward_split_reviews = """
+    SELECT disable_history_tracking_for_table('autoproofreader_proofreadtreenodereview'::regclass,
+        get_history_table_name('autoproofreader_proofreadtreenodereview'::regclass));
+    SELECT drop_history_table('autoproofreader_proofreadtreenodereview'::regclass);
+
+    DROP INDEX autoproofreader_proofreadtreenodes_result_id;
+
+    ALTER TABLE autoproofreader_proofreadtreenodes
+        ADD COLUMN reviewed boolean DEFAULT false,
+        ADD COLUMN txid serial,
+        ADD COLUMN editor_id integer;
+
+    UPDATE autoproofreader_proofreadtreenodes SET editor_id = user_id;
+
+    UPDATE autoproofreader_proofreadtreenodes n
+    SET reviewed = r.reviewed, editor_id = r.editor_id
+    FROM autoproofreader_proofreadtreenodereview r
+    WHERE r.result_id = n.result_id AND r.node_id = n.node_id;
+
+    ALTER TABLE autoproofreader_proofreadtreenodes
+        ALTER COLUMN editor_id SET NOT NULL;
+
+    DROP TABLE autoproofreader_proofreadtreenodereview CASCADE;
+
+    SELECT create_history_table('autoproofreader_proofreadtreenodes'::regclass, 'edition_time', 'txid');
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("autoproofreader", "0002_add_proofread_tree_nodes_table")]
+
+    operations = [
+        migrations.RunSQL(
+            forward_split_reviews,
+            backward_split_reviews,
+            [
+                migrations.RemoveField(model_name="proofreadtreenodes", name="reviewed"),
+                migrations.RemoveField(model_name="proofreadtreenodes", name="editor"),
+                migrations.CreateModel(
+                    name="ProofreadTreeNodeReview",
+                    fields=[
+                        (
+                            "id",
+                            models.AutoField(
+                                auto_created=True,
+                                primary_key=True,
+                                serialize=False,
+                                verbose_name="ID",
+                            ),
+                        ),
+                        ("node_id", models.IntegerField()),
+                        ("reviewed", models.BooleanField(default=False)),
+                        (
+                            "edition_time",
+                            models.DateTimeField(default=django.utils.timezone.now),
+                        ),
+                        (
+                            "result",
+                            models.ForeignKey(
+                                on_delete=django.db.models.deletion.CASCADE,
+                                to="autoproofreader.AutoproofreaderResult",
+                            ),
+                        ),
+                        (
+                            "editor",
+                            models.ForeignKey(
+                                on_delete=django.db.models.deletion.CASCADE,
+                                to=settings.AUTH_USER_MODEL,
+                                related_name="proofread_node_editor",
+                            ),
+                        ),
+                    ],
+                    options={"unique_together": {("result", "node_id")}},
+                ),
+            ],
+        )
+    ]
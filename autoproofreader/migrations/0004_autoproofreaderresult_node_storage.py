@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("autoproofreader", "0003_split_proofread_node_reviews")]
+
+    operations = [
+        migrations.AddField(
+            model_name="autoproofreaderresult",
+            name="node_storage",
+            field=models.TextField(default="rows"),
+        )
+    ]
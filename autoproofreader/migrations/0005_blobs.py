@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from autoproofreader.blobs import compress, content_hash, decompress
+
+
+def store_blob(Blob, text):
+    content = text.encode("utf-8")
+    digest = content_hash(content)
+    blob = Blob.objects.filter(hash=digest).first()
+    if blob is None:
+        compression, data = compress(content)
+        blob = Blob.objects.create(
+            hash=digest, compression=compression, data=data, size=len(content)
+        )
+    blob.ref_count += 1
+    blob.save()
+    return blob
+
+
+def move_content_to_blobs(apps, schema_editor):
+    Blob = apps.get_model("autoproofreader", "Blob")
+    ConfigFile = apps.get_model("autoproofreader", "ConfigFile")
+    AutoproofreaderResult = apps.get_model("autoproofreader", "AutoproofreaderResult")
+
+    for config_file in ConfigFile.objects.filter(blob__isnull=True).iterator():
+        config_file.blob = store_blob(Blob, config_file.config)
+        config_file.config = ""
+        config_file.save()
+
+    for result in AutoproofreaderResult.objects.filter(
+        skeleton_blob__isnull=True
+    ).iterator():
+        result.skeleton_blob = store_blob(Blob, result.skeleton_csv)
+        result.skeleton_csv = ""
+        result.save()
+
+
+def move_content_from_blobs(apps, schema_editor):
+    ConfigFile = apps.get_model("autoproofreader", "ConfigFile")
+    AutoproofreaderResult = apps.get_model("autoproofreader", "AutoproofreaderResult")
+
+    for config_file in ConfigFile.objects.filter(blob__isnull=False).iterator():
+        blob = config_file.blob
+        config_file.config = decompress(blob.compression, blob.data).decode("utf-8")
+        config_file.save()
+
+    for result in AutoproofreaderResult.objects.filter(
+        skeleton_blob__isnull=False
+    ).iterator():
+        blob = result.skeleton_blob
+        result.skeleton_csv = decompress(blob.compression, blob.data).decode("utf-8")
+        result.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("autoproofreader", "0004_autoproofreaderresult_node_storage")]
+
+    operations = [
+        migrations.CreateModel(
+            name="Blob",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("hash", models.CharField(max_length=64, unique=True)),
+                ("compression", models.TextField()),
+                ("data", models.BinaryField()),
+                ("size", models.BigIntegerField()),
+                ("ref_count", models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name="configfile",
+            name="config",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.AddField(
+            model_name="configfile",
+            name="blob",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                to="autoproofreader.Blob",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="autoproofreaderresult",
+            name="skeleton_csv",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.AddField(
+            model_name="autoproofreaderresult",
+            name="skeleton_blob",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="autoproofreader.Blob",
+            ),
+        ),
+        migrations.RunPython(move_content_to_blobs, move_content_from_blobs),
+    ]
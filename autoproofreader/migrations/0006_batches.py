@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("autoproofreader", "0005_blobs")]
+
+    operations = [
+        migrations.CreateModel(
+            name="AutoproofreaderBatch",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "creation_time",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                (
+                    "edition_time",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                ("name", models.TextField()),
+                ("max_concurrent_jobs", models.IntegerField(default=1)),
+                (
+                    "config",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="autoproofreader.ConfigFile",
+                    ),
+                ),
+                (
+                    "project",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="catmaid.Project",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={"abstract": False},
+        ),
+        migrations.AddField(
+            model_name="autoproofreaderresult",
+            name="batch",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                to="autoproofreader.AutoproofreaderBatch",
+            ),
+        ),
+        migrations.AddField(
+            model_name="autoproofreaderresult",
+            name="server",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                to="autoproofreader.ComputeServer",
+            ),
+        ),
+        migrations.AddField(
+            model_name="autoproofreaderresult",
+            name="segmentation_type",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.AddField(
+            model_name="autoproofreaderresult",
+            name="task_id",
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("autoproofreader", "0006_batches")]
+
+    operations = [
+        migrations.AddField(
+            model_name="autoproofreaderresult",
+            name="remote_pid",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="autoproofreaderresult",
+            name="time_limit",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="autoproofreaderresult",
+            name="memory_limit",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("autoproofreader", "0007_job_limits")]
+
+    operations = [
+        migrations.AddField(
+            model_name="computeserver",
+            name="max_concurrent_jobs",
+            field=models.IntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name="autoproofreaderresult",
+            name="priority",
+            field=models.IntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name="autoproofreaderresult",
+            name="start_time",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("autoproofreader", "0008_job_priorities")]
+
+    operations = [
+        migrations.AddField(
+            model_name="autoproofreaderresult",
+            name="completed_stages",
+            field=django.contrib.postgres.fields.ArrayField(
+                base_field=models.TextField(), blank=True, default=list, size=None
+            ),
+        )
+    ]
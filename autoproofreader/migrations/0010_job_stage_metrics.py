@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("autoproofreader", "0009_completed_stages")]
+
+    operations = [
+        migrations.CreateModel(
+            name="JobStageMetric",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("stage", models.TextField()),
+                (
+                    "creation_time",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                ("pack_size", models.IntegerField(default=1)),
+                ("skeleton_nodes", models.IntegerField(blank=True, null=True)),
+                ("wall_time", models.FloatField()),
+                ("bytes_transferred", models.BigIntegerField(blank=True, null=True)),
+                ("rows_ingested", models.IntegerField(blank=True, null=True)),
+                ("peak_rss", models.BigIntegerField(blank=True, null=True)),
+                (
+                    "result",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="stage_metrics",
+                        to="autoproofreader.AutoproofreaderResult",
+                    ),
+                ),
+            ],
+        )
+    ]
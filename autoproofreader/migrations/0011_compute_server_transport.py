@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("autoproofreader", "0010_job_stage_metrics")]
+
+    operations = [
+        migrations.AddField(
+            model_name="computeserver",
+            name="transport",
+            field=models.TextField(default="ssh"),
+        )
+    ]
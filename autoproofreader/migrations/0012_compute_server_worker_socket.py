@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("autoproofreader", "0011_compute_server_transport")]
+
+    operations = [
+        migrations.AddField(
+            model_name="computeserver",
+            name="worker_socket",
+            field=models.TextField(blank=True, null=True),
+        )
+    ]
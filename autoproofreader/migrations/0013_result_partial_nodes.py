@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("autoproofreader", "0012_compute_server_worker_socket")]
+
+    operations = [
+        migrations.AddField(
+            model_name="autoproofreaderresult",
+            name="partial_nodes",
+            field=models.IntegerField(blank=True, null=True),
+        )
+    ]
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("autoproofreader", "0013_result_partial_nodes")]
+
+    operations = [
+        migrations.AddField(
+            model_name="autoproofreaderresult",
+            name="sample_mapping_blob",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="autoproofreader.Blob",
+            ),
+        )
+    ]
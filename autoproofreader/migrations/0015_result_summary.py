@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("autoproofreader", "0014_result_sample_mapping")]
+
+    operations = [
+        migrations.CreateModel(
+            name="ResultSummary",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("node_count", models.IntegerField()),
+                ("reviewed_count", models.IntegerField(default=0)),
+                (
+                    "scores",
+                    django.contrib.postgres.fields.jsonb.JSONField(default=dict),
+                ),
+                (
+                    "result",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="summary",
+                        to="autoproofreader.AutoproofreaderResult",
+                    ),
+                ),
+            ],
+        )
+    ]
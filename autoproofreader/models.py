@@ -1,14 +1,30 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from django.contrib.postgres.fields import ArrayField
-from django.db import models
+from django.conf import settings
+from django.contrib.postgres.fields import ArrayField, JSONField
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
 import uuid
+from pathlib import Path
 from rest_framework import serializers
 import pytz
 
 from catmaid.models import User, Volume, UserFocusedModel, ClassInstance
 
+from autoproofreader.blobs import (
+    compress,
+    compress_file,
+    content_hash,
+    decompress,
+    hash_file,
+)
+from autoproofreader.cache import invalidate_result
+from autoproofreader.node_arrays import delete_node_arrays
+
 
 class ComputeServer(models.Model):
     name = models.TextField()
@@ -22,6 +38,12 @@ class ComputeServer(models.Model):
 
     ssh_user = models.TextField(default="guest")
     ssh_key = models.TextField(default=name)
+    # Number of tasks dispatched to this server at the same time
+    max_concurrent_jobs = models.IntegerField(default=1)
+    # How jobs are run on this server, see transports.py
+    transport = models.TextField(default="ssh")
+    # Socket of a warm sarbor worker on the server, see sarbor_worker.py
+    worker_socket = models.TextField(null=True, blank=True)
 
     def __str__(self):
         return self.name
@@ -33,21 +55,136 @@ class ComputeServerSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
+class Blob(models.Model):
+    """
+    Content addressed, compressed storage for skeleton snapshots and config
+    files. Identical content is stored once and the row is deleted once
+    nothing references it anymore.
+    """
+
+    # sha256 of the uncompressed content
+    hash = models.CharField(max_length=64, unique=True)
+    compression = models.TextField()
+    data = models.BinaryField()
+    # size of the uncompressed content in bytes
+    size = models.BigIntegerField()
+    ref_count = models.IntegerField(default=0)
+
+    @classmethod
+    def store(cls, content):
+        """
+        Get the blob holding content, creating it if necessary, and add a
+        reference to it. Content can be text or bytes.
+        """
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        return cls._store(
+            content_hash(content), len(content), lambda: compress(content)
+        )
+
+    @classmethod
+    def store_file(cls, path):
+        """Like store, but reads the content from a file in chunks."""
+        digest, size = hash_file(path)
+        return cls._store(digest, size, lambda: compress_file(path))
+
+    @classmethod
+    def _store(cls, digest, size, compressed):
+        # The row is locked until the reference is added, so a concurrent
+        # release can't delete it in between
+        compression = data = None
+        while True:
+            with transaction.atomic():
+                blob = cls.objects.select_for_update().filter(hash=digest).first()
+                if blob is None:
+                    if data is None:
+                        compression, data = compressed()
+                    blob, _ = cls.objects.get_or_create(
+                        hash=digest,
+                        defaults={
+                            "compression": compression,
+                            "data": data,
+                            "size": size,
+                        },
+                    )
+                    # Created concurrently and released since, start over
+                    if not cls.objects.select_for_update().filter(id=blob.id).exists():
+                        continue
+                cls.objects.filter(id=blob.id).update(ref_count=F("ref_count") + 1)
+                return blob
+
+    @classmethod
+    def release(cls, blob_id):
+        """Remove a reference to a blob, deleting it if it was the last one."""
+        with transaction.atomic():
+            blob = cls.objects.select_for_update().filter(id=blob_id).first()
+            if blob is None:
+                return
+            if blob.ref_count <= 1:
+                cls.objects.filter(id=blob_id).delete()
+            else:
+                cls.objects.filter(id=blob_id).update(ref_count=F("ref_count") - 1)
+
+    @property
+    def content(self):
+        return decompress(self.compression, self.data)
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+
 class ConfigFile(UserFocusedModel):
     """
     The configurations necessary to run autoproofreader.
     """
 
-    config = models.TextField()
+    # Configs are stored in blob. The config field only holds configs
+    # that were stored before blobs were introduced.
+    config = models.TextField(blank=True, default="")
+    blob = models.ForeignKey(Blob, on_delete=models.SET_NULL, null=True, blank=True)
+
+    @classmethod
+    def for_content(cls, user_id, project_id, content):
+        """
+        Get a config file of this user and project with the given content,
+        creating it if no identical config exists yet. Config files aren't
+        shared between users, deleting a user deletes the results and
+        batches referencing their config files, but the content of
+        identical config files is stored once in a shared blob.
+        """
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        existing = cls.objects.filter(
+            user_id=user_id, project_id=project_id, blob__hash=content_hash(content)
+        ).first()
+        if existing is not None:
+            return existing
+        config_file = cls(
+            user_id=user_id, project_id=project_id, blob=Blob.store(content)
+        )
+        config_file.save()
+        return config_file
+
+    @property
+    def content(self):
+        return self.blob.text if self.blob_id is not None else self.config
+
+
+@receiver(post_delete, sender=ConfigFile)
+def release_config_blob(sender, instance, **kwargs):
+    if instance.blob_id is not None:
+        Blob.release(instance.blob_id)
 
 
 class ConfigFileSerializer(serializers.ModelSerializer):
     creation_time = serializers.DateTimeField(default_timezone=pytz.timezone("UTC"))
     edition_time = serializers.DateTimeField(default_timezone=pytz.timezone("UTC"))
+    config = serializers.CharField(source="content", read_only=True)
 
     class Meta:
         model = ConfigFile
-        fields = "__all__"
+        exclude = ("blob",)
 
 
 class DiluvianModel(UserFocusedModel):
@@ -74,6 +211,31 @@ class DiluvianModelSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
+class AutoproofreaderBatch(UserFocusedModel):
+    """
+    A set of autoproofreader jobs submitted together with one shared
+    configuration. At most max_concurrent_jobs of them run at a time.
+    """
+
+    name = models.TextField()
+    config = models.ForeignKey(ConfigFile, on_delete=models.CASCADE)
+    max_concurrent_jobs = models.IntegerField(default=1)
+
+    @property
+    def staging_dir(self):
+        """Directory in MEDIA_ROOT holding the files shared by all jobs."""
+        return Path(settings.MEDIA_ROOT, "batch_{}".format(self.id))
+
+
+class AutoproofreaderBatchSerializer(serializers.ModelSerializer):
+    creation_time = serializers.DateTimeField(default_timezone=pytz.timezone("UTC"))
+    edition_time = serializers.DateTimeField(default_timezone=pytz.timezone("UTC"))
+
+    class Meta:
+        model = AutoproofreaderBatch
+        fields = "__all__"
+
+
 class AutoproofreaderResult(UserFocusedModel):
     """
     A model to represent the results of a autoproofreader task.
@@ -85,7 +247,18 @@ class AutoproofreaderResult(UserFocusedModel):
     # Full configuration for this job for reproducibility
     config = models.ForeignKey(ConfigFile, on_delete=models.CASCADE)
     skeleton = models.ForeignKey(ClassInstance, on_delete=models.CASCADE)
-    skeleton_csv = models.TextField()
+    # Snapshot of the skeleton at submission. Snapshots are stored in
+    # skeleton_blob, skeleton_csv only holds snapshots from before blobs.
+    skeleton_csv = models.TextField(blank=True, default="")
+    skeleton_blob = models.ForeignKey(
+        Blob, on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+    # csv rows of (treenode_id, sample_id) mapping every node of the snapshot
+    # to the sample point it was resampled to before upload, if it was (see
+    # resampling.py). Sample points keep the id of one of their treenodes.
+    sample_mapping_blob = models.ForeignKey(
+        Blob, on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
     # necessary only if diluvian is used for obtaining segmentations
     # This should be replaced with a more general option for any segmentation source
     model = models.ForeignKey(DiluvianModel, on_delete=models.CASCADE)
@@ -106,22 +279,189 @@ class AutoproofreaderResult(UserFocusedModel):
     errors = models.TextField()
     # storage of rankings is moving to its own table
     data = models.TextField(null=True, blank=True)  # will contain results or errors
+    # Where the proofread nodes of this result are stored. Either "rows" in the
+    # ProofreadTreeNodes table or "arrays" in packed files (see node_arrays.py)
+    node_storage = models.TextField(default="rows")
+    # Number of nodes ingested from the chunks sarbor wrote so far while the
+    # job is "partial", their scores are in ProofreadTreeNodes
+    partial_nodes = models.IntegerField(null=True, blank=True)
+
+    # Everything needed to run the job, so it can be dispatched later
+    batch = models.ForeignKey(
+        AutoproofreaderBatch, on_delete=models.SET_NULL, null=True, blank=True
+    )
+    server = models.ForeignKey(
+        ComputeServer, on_delete=models.SET_NULL, null=True, blank=True
+    )
+    segmentation_type = models.TextField(blank=True, default="")
+    # Celery task running this job, set once the job is dispatched
+    task_id = models.TextField(null=True, blank=True)
+    # Process group of the job on the compute server, set once it started
+    remote_pid = models.IntegerField(null=True, blank=True)
+    # Jobs with a higher priority are dispatched first (see PRIORITIES)
+    priority = models.IntegerField(default=1)
+    start_time = models.DateTimeField(null=True, blank=True)
+    # Stages of the job that have completed, see STAGES in control/autoproofreader.py
+    completed_stages = ArrayField(models.TextField(), default=list, blank=True)
+    # Optional limits of the remote process, in seconds and bytes
+    time_limit = models.IntegerField(null=True, blank=True)
+    memory_limit = models.BigIntegerField(null=True, blank=True)
+
+    @property
+    def staging_dir(self):
+        """Directory in MEDIA_ROOT holding the files of this job."""
+        return Path(settings.MEDIA_ROOT, self.name)
+
+    @property
+    def skeleton_snapshot(self):
+        if self.skeleton_blob_id is not None:
+            return self.skeleton_blob.text
+        return self.skeleton_csv
+
+    @property
+    def sample_mapping(self):
+        if self.sample_mapping_blob_id is not None:
+            return self.sample_mapping_blob.text
+        return None
+
+
+@receiver(post_delete, sender=AutoproofreaderResult)
+def delete_result_node_arrays(sender, instance, **kwargs):
+    if instance.node_storage == "arrays":
+        delete_node_arrays(instance)
+
+
+@receiver(post_delete, sender=AutoproofreaderResult)
+def invalidate_cached_result(sender, instance, **kwargs):
+    invalidate_result(instance)
+
+
+@receiver(post_delete, sender=AutoproofreaderResult)
+def release_skeleton_blob(sender, instance, **kwargs):
+    if instance.skeleton_blob_id is not None:
+        Blob.release(instance.skeleton_blob_id)
+    if instance.sample_mapping_blob_id is not None:
+        Blob.release(instance.sample_mapping_blob_id)
+
+
+class AutoproofreaderResultListingSerializer(serializers.ModelSerializer):
+    """
+    Serializes results in listings, leaving out the skeleton snapshot that
+    would be loaded from a separate blob for every result.
+    """
 
+    completion_time = serializers.DateTimeField(default_timezone=pytz.timezone("UTC"))
+    creation_time = serializers.DateTimeField(default_timezone=pytz.timezone("UTC"))
+    edition_time = serializers.DateTimeField(default_timezone=pytz.timezone("UTC"))
+
+    class Meta:
+        model = AutoproofreaderResult
+        exclude = (
+            "uuid",
+            "skeleton_csv",
+            "skeleton_blob",
+            "sample_mapping_blob",
+            "remote_pid",
+        )
+
+
+class AutoproofreaderResultSerializer(AutoproofreaderResultListingSerializer):
+    skeleton_csv = serializers.CharField(source="skeleton_snapshot", read_only=True)
+    # csv rows of (treenode_id, sample_id) if the skeleton was resampled
+    sample_mapping_csv = serializers.CharField(
+        source="sample_mapping", read_only=True, allow_null=True
+    )
+
+    class Meta(AutoproofreaderResultListingSerializer.Meta):
+        # skeleton_csv is declared above, sent from the snapshot
+        exclude = ("uuid", "skeleton_blob", "sample_mapping_blob", "remote_pid")
+
+
+class AutoproofreaderResultSummarySerializer(serializers.ModelSerializer):
+    """
+    Serializes only the fields needed to list results, leaving out the
+    skeleton snapshot, data and errors.
+    """
 
-class AutoproofreaderResultSerializer(serializers.ModelSerializer):
     completion_time = serializers.DateTimeField(default_timezone=pytz.timezone("UTC"))
     creation_time = serializers.DateTimeField(default_timezone=pytz.timezone("UTC"))
     edition_time = serializers.DateTimeField(default_timezone=pytz.timezone("UTC"))
 
     class Meta:
         model = AutoproofreaderResult
-        exclude = ("uuid",)
+        fields = (
+            "id",
+            "name",
+            "status",
+            "skeleton",
+            "model",
+            "config",
+            "volume",
+            "user",
+            "project",
+            "creation_time",
+            "edition_time",
+            "completion_time",
+            "private",
+            "permanent",
+            "node_storage",
+            "partial_nodes",
+            "batch",
+        )
+
+
+class ResultSummary(models.Model):
+    """
+    Node counts and score statistics of a result, computed when its scores
+    are stored so overviews don't have to load every node (see summaries.py).
+    The reviewed count is updated whenever a node of the result is reviewed.
+    """
+
+    result = models.OneToOneField(
+        AutoproofreaderResult, on_delete=models.CASCADE, related_name="summary"
+    )
+    node_count = models.IntegerField()
+    reviewed_count = models.IntegerField(default=0)
+    # Summary of every score, see summarize_scores
+    scores = JSONField(default=dict)
+
+
+class ResultSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ResultSummary
+        fields = ("result", "node_count", "reviewed_count", "scores")
+
+
+class JobStageMetric(models.Model):
+    """
+    Resources used by one stage of an autoproofreader job (see STAGES in
+    control/autoproofreader.py). Stages shared by the jobs of a pack are
+    recorded once per job with the wall time of the whole pack.
+    """
+
+    result = models.ForeignKey(
+        AutoproofreaderResult, on_delete=models.CASCADE, related_name="stage_metrics"
+    )
+    stage = models.TextField()
+    creation_time = models.DateTimeField(default=timezone.now)
+    # Number of jobs the stage was run for at once
+    pack_size = models.IntegerField(default=1)
+    # Number of nodes of the skeleton, if known
+    skeleton_nodes = models.IntegerField(null=True, blank=True)
+    # Wall time in seconds
+    wall_time = models.FloatField()
+    # Bytes copied to or from the compute server, or read from outputs
+    bytes_transferred = models.BigIntegerField(null=True, blank=True)
+    rows_ingested = models.IntegerField(null=True, blank=True)
+    # Peak resident memory of the worker during the stage in bytes
+    peak_rss = models.BigIntegerField(null=True, blank=True)
 
 
 class ProofreadTreeNodes(UserFocusedModel):
     """
     Stores all proofread nodes allong with their scores for connectivity and missing branches.
-    Also keeps track of which nodes have been visited
+    These rows are machine generated and never edited, so the table is not history
+    tracked and is filled with COPY. Review state lives in ProofreadTreeNodeReview.
     """
 
     node_id = models.IntegerField()
@@ -134,22 +474,55 @@ class ProofreadTreeNodes(UserFocusedModel):
     branch_dy = models.FloatField()
     branch_dz = models.FloatField()
     connectivity_score = models.FloatField(null=True)
-    reviewed = models.BooleanField(default=False)
     result = models.ForeignKey(AutoproofreaderResult, on_delete=models.CASCADE)
-    editor = models.ForeignKey(
-        User, on_delete=models.CASCADE, related_name="proofread_node_editor"
-    )
 
 
 class ProofreadTreeNodesSerializer(serializers.ModelSerializer):
     creation_time = serializers.DateTimeField(default_timezone=pytz.timezone("UTC"))
     edition_time = serializers.DateTimeField(default_timezone=pytz.timezone("UTC"))
+    # Annotated from ProofreadTreeNodeReview
+    reviewed = serializers.BooleanField(read_only=True)
+    editor = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = ProofreadTreeNodes
         fields = "__all__"
 
 
+class ProofreadTreeNodeReview(models.Model):
+    """
+    Keeps track of which proofread nodes have been visited. A row only exists
+    once a node has been reviewed. Unlike the scores, this table is history
+    tracked.
+    """
+
+    result = models.ForeignKey(AutoproofreaderResult, on_delete=models.CASCADE)
+    node_id = models.IntegerField()
+    reviewed = models.BooleanField(default=False)
+    editor = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="proofread_node_editor"
+    )
+    edition_time = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = (("result", "node_id"),)
+
+
+class ResultSubscription(models.Model):
+    """
+    A user viewing a result, who is sent its review changes as they happen
+    (see broadcast.py). Renewed whenever the user loads the nodes of the
+    result and expired after AUTOPROOFREADER_REVIEW_SUBSCRIPTION_TTL.
+    """
+
+    result = models.ForeignKey(AutoproofreaderResult, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    edition_time = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = (("result", "user"),)
+
+
 class ImageVolumeConfig(UserFocusedModel):
     """
     A model to hold volume configs. Volume configurations are stored as toml files
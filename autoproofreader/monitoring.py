@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+"""Operational metrics in the Prometheus text exposition format.
+
+API latencies are observed in the process serving the request, so every
+web worker reports its own histograms. Jobs run in celery workers, so
+everything about them is read from the database instead: job and queue
+counts on every scrape, job latency histograms and stage totals at most
+every AUTOPROOFREADER_MONITORING_TTL seconds. Disk usage and GPU
+utilization need a directory walk and an ssh connection per server, they
+are refreshed in a background thread at most every
+AUTOPROOFREADER_MONITORING_SLOW_TTL seconds and scrapes get the last
+values meanwhile.
+"""
+from bisect import bisect_left
+from collections import OrderedDict
+import datetime
+import functools
+import logging
+from pathlib import Path
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Q, Sum
+
+from autoproofreader.control.compute_server import GPUUtilAPI
+from autoproofreader.metrics import directory_size
+from autoproofreader.models import AutoproofreaderResult, ComputeServer, JobStageMetric
+from autoproofreader.profiling import profiled_view
+
+# Upper bounds of the API latency buckets in seconds
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Upper bounds of the job latency buckets in seconds
+JOB_BUCKETS = (60, 300, 900, 1800, 3600, 7200, 14400, 43200, 86400)
+
+
+def format_labels(labels):
+    if len(labels) == 0:
+        return ""
+    return "{{{}}}".format(
+        ",".join(
+            '{}="{}"'.format(
+                name,
+                str(value)
+                .replace("\\", "\\\\")
+                .replace('"', '\\"')
+                .replace("\n", "\\n"),
+            )
+            for name, value in labels.items()
+        )
+    )
+
+
+def format_metric(name, kind, description, samples):
+    """
+    Text of one metric. samples are (suffix, labels, value) tuples, the
+    suffix is appended to the name, e.g. "_bucket" for histograms.
+    """
+    lines = [
+        "# HELP {} {}".format(name, description),
+        "# TYPE {} {}".format(name, kind),
+    ]
+    for suffix, labels, value in samples:
+        lines.append("{}{}{} {}".format(name, suffix, format_labels(labels), value))
+    return "\n".join(lines)
+
+
+def histogram_samples(labels, bounds, bucket_counts, total, count):
+    """
+    Samples of one labeled histogram given the number of observations in
+    each bucket. bucket_counts are not cumulative, the last one counts the
+    observations above the largest bound.
+    """
+    samples = []
+    cumulative = 0
+    for bound, n in zip(bounds + ("+Inf",), bucket_counts):
+        cumulative += n
+        samples.append(("_bucket", OrderedDict(labels, le=bound), cumulative))
+    samples.append(("_sum", labels, total))
+    samples.append(("_count", labels, count))
+    return samples
+
+
+class Histogram(object):
+    """
+    A thread safe histogram of observations per set of label values. Only
+    a bucket count, a sum and a count are kept per set.
+    """
+
+    def __init__(self, name, description, label_names, bounds):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.bounds = bounds
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        bucket = bisect_left(self.bounds, value)
+        with self._lock:
+            values = self._values.get(label_values, None)
+            if values is None:
+                values = self._values[label_values] = [
+                    [0] * (len(self.bounds) + 1),
+                    0.0,
+                    0,
+                ]
+            values[0][bucket] += 1
+            values[1] += value
+            values[2] += 1
+
+    def render(self):
+        with self._lock:
+            values = sorted(
+                (labels, (list(buckets), total, count))
+                for labels, (buckets, total, count) in self._values.items()
+            )
+        samples = []
+        for label_values, (buckets, total, count) in values:
+            labels = OrderedDict(zip(self.label_names, label_values))
+            samples.extend(
+                histogram_samples(labels, self.bounds, buckets, total, count)
+            )
+        return format_metric(self.name, "histogram", self.description, samples)
+
+
+request_latency = Histogram(
+    "autoproofreader_request_duration_seconds",
+    "Time spent serving API requests by this worker.",
+    ("endpoint", "method", "status"),
+    REQUEST_BUCKETS,
+)
+
+
+def timed_view(view):
+    """Wrap a view to observe its latency in request_latency."""
+    endpoint = getattr(view, "__name__", "unknown")
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        start = time.monotonic()
+        response = view(request, *args, **kwargs)
+        request_latency.observe(
+            (endpoint, request.method, str(response.status_code)),
+            time.monotonic() - start,
+        )
+        return response
+
+    return wrapper
+
+
+def instrument_urlpatterns(urlpatterns):
+    """Observe the latency of the views of all patterns and allow profiling them."""
+    for pattern in urlpatterns:
+        pattern.callback = timed_view(profiled_view(pattern.callback))
+    return urlpatterns
+
+
+class TimedCache(object):
+    """Computes a value at most once every ttl seconds."""
+
+    def __init__(self, compute, ttl_setting, default_ttl):
+        self.compute = compute
+        self.ttl_setting = ttl_setting
+        self.default_ttl = default_ttl
+        self._value = None
+        self._expires = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._value is None or now >= self._expires:
+                self._value = self.compute()
+                self._expires = now + getattr(
+                    settings, self.ttl_setting, self.default_ttl
+                )
+            return self._value
+
+
+class BackgroundCache(TimedCache):
+    """
+    Recomputes a value at most once every ttl seconds in a background
+    thread, so callers never wait for it. Until the first value is
+    computed, empty is returned.
+    """
+
+    def __init__(self, compute, ttl_setting, default_ttl, empty=None):
+        super(BackgroundCache, self).__init__(compute, ttl_setting, default_ttl)
+        self.empty = empty
+        self._refreshing = False
+
+    def get(self):
+        with self._lock:
+            if not self._refreshing and time.monotonic() >= self._expires:
+                self._refreshing = True
+                threading.Thread(target=self.refresh, daemon=True).start()
+            return self.empty if self._value is None else self._value
+
+    def refresh(self):
+        value = None
+        try:
+            value = self.compute()
+        except Exception:
+            logging.exception("Could not compute {}".format(self.compute.__name__))
+        finally:
+            # The thread's own database connection isn't closed by django
+            connection.close()
+        with self._lock:
+            if value is not None:
+                self._value = value
+            self._expires = time.monotonic() + getattr(
+                settings, self.ttl_setting, self.default_ttl
+            )
+            self._refreshing = False
+
+
+def collect_jobs():
+    """Number of jobs per status and undispatched jobs per server."""
+    statuses = (
+        AutoproofreaderResult.objects.values_list("status")
+        .annotate(n=Count("id"))
+        .order_by("status")
+    )
+    queued = (
+        AutoproofreaderResult.objects.filter(
+            status="queued", task_id__isnull=True, server__isnull=False
+        )
+        .values_list("server__name")
+        .annotate(n=Count("id"))
+    )
+    depths = dict(queued)
+    return [
+        format_metric(
+            "autoproofreader_jobs",
+            "gauge",
+            "Number of autoproofreader jobs per status.",
+            [("", {"status": status}, n) for status, n in statuses],
+        ),
+        format_metric(
+            "autoproofreader_queue_depth",
+            "gauge",
+            "Number of jobs waiting to be dispatched per compute server.",
+            [
+                ("", {"server": name}, depths.get(name, 0))
+                for name in ComputeServer.objects.order_by("name").values_list(
+                    "name", flat=True
+                )
+            ],
+        ),
+    ]
+
+
+def duration_histogram(results, start_field, end_field):
+    """
+    Bucket counts, sum and count of the time between two fields of
+    results, computed in a single query.
+    """
+    results = results.filter(
+        **{start_field + "__isnull": False, end_field + "__isnull": False}
+    ).annotate(
+        duration=ExpressionWrapper(
+            F(end_field) - F(start_field), output_field=DurationField()
+        )
+    )
+    aggregates = {
+        "le_{}".format(i): Count(
+            "id", filter=Q(duration__lte=datetime.timedelta(seconds=bound))
+        )
+        for i, bound in enumerate(JOB_BUCKETS)
+    }
+    values = results.aggregate(total=Sum("duration"), count=Count("id"), **aggregates)
+    cumulative = [values["le_{}".format(i)] for i in range(len(JOB_BUCKETS))]
+    cumulative.append(values["count"])
+    buckets = [cumulative[0]] + [b - a for a, b in zip(cumulative[:-1], cumulative[1:])]
+    total = values["total"] or datetime.timedelta()
+    return buckets, total.total_seconds(), values["count"]
+
+
+def collect_job_latencies():
+    """Latency histograms of complete jobs and totals of every job stage."""
+    complete = AutoproofreaderResult.objects.filter(status="complete")
+    wait = duration_histogram(complete, "creation_time", "start_time")
+    run = duration_histogram(complete, "start_time", "completion_time")
+
+    stages = (
+        JobStageMetric.objects.values_list("stage")
+        .annotate(
+            runs=Count("id"),
+            seconds=Sum("wall_time"),
+            bytes=Sum("bytes_transferred"),
+            rows=Sum("rows_ingested"),
+        )
+        .order_by("stage")
+    )
+    stage_samples = OrderedDict(
+        [("runs", []), ("seconds", []), ("bytes", []), ("rows", [])]
+    )
+    for stage, runs, seconds, n_bytes, rows in stages:
+        labels = {"stage": stage}
+        stage_samples["runs"].append(("", labels, runs))
+        stage_samples["seconds"].append(("", labels, seconds or 0))
+        stage_samples["bytes"].append(("", labels, n_bytes or 0))
+        stage_samples["rows"].append(("", labels, rows or 0))
+
+    return [
+        format_metric(
+            "autoproofreader_job_wait_seconds",
+            "histogram",
+            "Time complete jobs spent queued before they started.",
+            histogram_samples({}, JOB_BUCKETS, *wait),
+        ),
+        format_metric(
+            "autoproofreader_job_duration_seconds",
+            "histogram",
+            "Time complete jobs took from their start to their completion.",
+            histogram_samples({}, JOB_BUCKETS, *run),
+        ),
+        format_metric(
+            "autoproofreader_stage_runs_total",
+            "counter",
+            "Number of recorded runs per job stage.",
+            stage_samples["runs"],
+        ),
+        format_metric(
+            "autoproofreader_stage_seconds_total",
+            "counter",
+            "Wall time spent per job stage.",
+            stage_samples["seconds"],
+        ),
+        format_metric(
+            "autoproofreader_stage_bytes_total",
+            "counter",
+            "Bytes copied or read per job stage.",
+            stage_samples["bytes"],
+        ),
+        format_metric(
+            "autoproofreader_stage_rows_total",
+            "counter",
+            "Rows ingested per job stage.",
+            stage_samples["rows"],
+        ),
+    ]
+
+
+def collect_gpus():
+    """Utilization and memory of the GPUs of every compute server."""
+    utilization, memory_used, memory_total = [], [], []
+    for server in ComputeServer.objects.order_by("name"):
+        try:
+            gpus = GPUUtilAPI._query_server(server.id)
+        except Exception as e:
+            logging.warning("Could not query GPUs of {}: {}".format(server.name, e))
+            continue
+        for index, gpu in sorted(gpus.items()):
+            labels = OrderedDict([("server", server.name), ("gpu", index)])
+            utilization.append(("", labels, float(gpu["utilization.gpu"])))
+            # nvidia-smi reports memory in MiB
+            memory_used.append(("", labels, int(gpu["memory.used"]) * 1024 ** 2))
+            memory_total.append(("", labels, int(gpu["memory.total"]) * 1024 ** 2))
+    return [
+        format_metric(
+            "autoproofreader_gpu_utilization_percent",
+            "gauge",
+            "GPU utilization reported by nvidia-smi.",
+            utilization,
+        ),
+        format_metric(
+            "autoproofreader_gpu_memory_used_bytes",
+            "gauge",
+            "GPU memory in use.",
+            memory_used,
+        ),
+        format_metric(
+            "autoproofreader_gpu_memory_total_bytes",
+            "gauge",
+            "Total GPU memory.",
+            memory_total,
+        ),
+    ]
+
+
+def collect_disk_usage():
+    """Disk usage of the stored segmentations."""
+    segmentations = Path(settings.MEDIA_ROOT) / "proofreading_segmentations"
+    metrics = [
+        format_metric(
+            "autoproofreader_segmentation_disk_bytes",
+            "gauge",
+            "Size of the segmentations stored in proofreading_segmentations.",
+            [("", {}, directory_size(segmentations))],
+        )
+    ]
+    if getattr(settings, "AUTOPROOFREADER_MONITORING_GPUS", True):
+        metrics.extend(collect_gpus())
+    return metrics
+
+
+job_latencies = TimedCache(collect_job_latencies, "AUTOPROOFREADER_MONITORING_TTL", 60)
+disk_usage = BackgroundCache(
+    collect_disk_usage, "AUTOPROOFREADER_MONITORING_SLOW_TTL", 300, empty=[]
+)
+
+
+def render_metrics():
+    """All metrics in the text exposition format."""
+    metrics = collect_jobs() + job_latencies.get() + disk_usage.get()
+    metrics.append(request_latency.render())
+    return "\n".join(metrics) + "\n"
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""Compact storage of the proofread nodes of a result.
+
+Instead of one database row per node, the scores of a result can be
+stored once as a set of packed .npy files (one file per column) under
+MEDIA_ROOT. The files are written once when the result is ingested and
+are memory mapped when read, so serving a result never loads more than
+the pages that are actually touched.
+"""
+from collections import OrderedDict
+from pathlib import Path
+import json
+import shutil
+
+import numpy as np
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+# The directory below MEDIA_ROOT in which node arrays are stored, one sub
+# directory per result uuid
+NODE_ARRAYS_SUBDIRECTORY = "proofreading_node_arrays"
+
+# Column name and packed type, in the order rows are passed to write_node_arrays
+COLUMNS = OrderedDict(
+    [
+        ("node_id", np.int64),
+        ("parent_id", np.int64),
+        ("x", np.float32),
+        ("y", np.float32),
+        ("z", np.float32),
+        ("branch_score", np.float32),
+        ("branch_dx", np.float32),
+        ("branch_dy", np.float32),
+        ("branch_dz", np.float32),
+        ("connectivity_score", np.float32),
+    ]
+)
+
+# parent_id of root nodes, connectivity_score of nodes without one is stored as nan
+NO_PARENT = -1
+
+
+def node_storage_mode():
+    """Storage mode for newly ingested results, either "rows" or "arrays"."""
+    return getattr(settings, "AUTOPROOFREADER_NODE_STORAGE", "rows")
+
+
+def node_arrays_dir(result):
+    return Path(settings.MEDIA_ROOT, NODE_ARRAYS_SUBDIRECTORY, str(result.uuid))
+
+
+def write_node_arrays(result, rows):
+    """
+    Pack rows of (node_id, parent_id, x, y, z, branch_score, branch_dx,
+    branch_dy, branch_dz, connectivity_score) into one .npy file per column.
+    The files are written to a temporary directory first, so readers never
+    see a partially written result.
+    """
+    rows = list(rows)
+    columns = list(zip(*rows)) if len(rows) > 0 else [()] * len(COLUMNS)
+
+    target = node_arrays_dir(result)
+    staging = target.with_name(target.name + ".tmp")
+    if staging.exists():
+        shutil.rmtree(str(staging))
+    staging.mkdir(parents=True)
+
+    for (name, dtype), values in zip(COLUMNS.items(), columns):
+        if name == "parent_id":
+            values = [NO_PARENT if v is None else v for v in values]
+        elif name == "connectivity_score":
+            values = [np.nan if v is None else v for v in values]
+        np.save(str(staging / (name + ".npy")), np.asarray(values, dtype=dtype))
+
+    if target.exists():
+        shutil.rmtree(str(target))
+    staging.rename(target)
+    return len(rows)
+
+
+def has_node_arrays(result):
+    return node_arrays_dir(result).exists()
+
+
+def load_node_arrays(result, mmap_mode="r"):
+    """
+    Map the node arrays of a result into memory. Returns a dict of column
+    name to array, or None if the result has no stored arrays.
+    """
+    directory = node_arrays_dir(result)
+    if not directory.exists():
+        return None
+    return {
+        name: np.load(str(directory / (name + ".npy")), mmap_mode=mmap_mode)
+        for name in COLUMNS
+    }
+
+
+def delete_node_arrays(result):
+    shutil.rmtree(str(node_arrays_dir(result)), ignore_errors=True)
+
+
+def json_column(name, values):
+    """
+    The JSON text of every value of a column, formatted column by column
+    without creating a python object per value. Root parents and nan
+    scores become null.
+    """
+    kind = values.dtype.kind
+    if kind == "b":
+        return np.where(values, "true", "false")
+    if kind in "iu":
+        text = values.astype("U21")
+        if name == "parent_id":
+            text[values == NO_PARENT] = "null"
+        return text
+    if kind == "f":
+        # float32 values are written at the precision of python floats
+        values = values.astype(np.float64)
+        text = values.astype("U32")
+        text[np.isnan(values)] = "null"
+        text[values == np.inf] = "Infinity"
+        text[values == -np.inf] = "-Infinity"
+        return text
+    return np.asarray([json.dumps(v, cls=DjangoJSONEncoder) for v in values.tolist()])
+
+
+def encode_node_columns(columns):
+    """
+    Encode node columns, a dict of name to either an array with one value
+    per node or a single value shared by all nodes, as the JSON list of
+    node objects json.dumps(..., sort_keys=True, indent=4) would write.
+    The list is written straight from the arrays, one row template for all
+    nodes, instead of creating a dict per node first.
+    """
+    per_node = {
+        name: values
+        for name, values in columns.items()
+        if isinstance(values, np.ndarray)
+    }
+    n_nodes = len(next(iter(per_node.values()))) if len(per_node) > 0 else 0
+    if n_nodes == 0:
+        return "[]"
+
+    fields, texts = [], []
+    for name in sorted(columns):
+        if name in per_node:
+            fields.append("{}")
+            texts.append(json_column(name, per_node[name]).tolist())
+        else:
+            shared = json.dumps(columns[name], cls=DjangoJSONEncoder)
+            fields.append(shared.replace("{", "{{").replace("}", "}}"))
+        fields[-1] = '        "{}": {}'.format(name, fields[-1])
+    template = "    {{\n" + ",\n".join(fields) + "\n    }}"
+    return "[\n" + ",\n".join(template.format(*row) for row in zip(*texts)) + "\n]"
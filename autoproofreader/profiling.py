@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""Opt-in sampling profiler for views and job stages.
+
+While profiling, a background thread samples the stack of the profiled
+thread every AUTOPROOFREADER_PROFILE_INTERVAL seconds. Samples are
+counted per distinct stack and stored in the collapsed stack format
+(one "frame;frame;frame count" line per stack) read by flamegraph.pl and
+speedscope. Only the newest AUTOPROOFREADER_PROFILE_MAX_FILES profiles
+are kept in MEDIA_ROOT/autoproofreader_profiles.
+
+Views are profiled if the request carries an X-Autoproofreader-Profile
+header and comes from a superuser, or if the view is listed in
+AUTOPROOFREADER_PROFILE_VIEWS. Job stages are profiled if
+AUTOPROOFREADER_PROFILE_JOBS is set. Otherwise the only cost is checking
+these settings.
+"""
+from collections import Counter
+from contextlib import contextmanager
+import datetime
+import functools
+from pathlib import Path
+import re
+import sys
+import threading
+import time
+import uuid
+
+from django.conf import settings
+
+# The directory below MEDIA_ROOT in which profiles are stored
+PROFILES_SUBDIRECTORY = "autoproofreader_profiles"
+
+# Header requesting a profile of a view
+PROFILE_HEADER = "HTTP_X_AUTOPROOFREADER_PROFILE"
+
+
+def profiles_dir():
+    return Path(settings.MEDIA_ROOT, PROFILES_SUBDIRECTORY)
+
+
+class SamplingProfiler(object):
+    """Samples the stack of one thread from a background thread."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.duration = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._start = time.monotonic()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.monotonic() - self._start
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id, None)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    "{} ({}:{})".format(code.co_name, code.co_filename, frame.f_lineno)
+                )
+                frame = frame.f_back
+            if len(stack) > 0:
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def collapsed(self):
+        """The profile in the collapsed stack format, most frequent first."""
+        lines = [
+            "# {} samples every {} s over {:.3f} s".format(
+                self.samples, self.interval, self.duration
+            )
+        ]
+        lines.extend("{} {}".format(stack, n) for stack, n in self.stacks.most_common())
+        return "\n".join(lines) + "\n"
+
+
+def profile_name(kind, label):
+    """File name of a new profile, e.g. request-ComputeServerAPI-<time>-<id>."""
+    label = re.sub(r"[^A-Za-z0-9_]+", "_", str(label))
+    return "{}-{}-{}-{}.txt".format(
+        kind,
+        label,
+        datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S"),
+        uuid.uuid4().hex[:8],
+    )
+
+
+def store_profile(names, text):
+    """Write a profile under every name and drop all but the newest profiles."""
+    directory = profiles_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    for name in names:
+        (directory / name).write_text(text)
+
+    max_files = getattr(settings, "AUTOPROOFREADER_PROFILE_MAX_FILES", 100)
+    profiles = []
+    for path in directory.iterdir():
+        try:
+            profiles.append((path.stat().st_mtime, path))
+        except FileNotFoundError:
+            # Removed by another worker
+            continue
+    profiles.sort(reverse=True)
+    for _, path in profiles[max_files:]:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+@contextmanager
+def profiling(enabled, names):
+    """Profile the current thread while in this context, if enabled."""
+    if not enabled:
+        yield
+        return
+    profiler = SamplingProfiler(
+        threading.get_ident(),
+        getattr(settings, "AUTOPROOFREADER_PROFILE_INTERVAL", 0.005),
+    )
+    profiler.start()
+    try:
+        yield
+    finally:
+        profiler.stop()
+        store_profile(names, profiler.collapsed())
+
+
+def list_profiles():
+    """Name, size and time of the stored profiles, newest first."""
+    directory = profiles_dir()
+    if not directory.exists():
+        return []
+    profiles = []
+    for path in directory.iterdir():
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        profiles.append(
+            {
+                "name": path.name,
+                "size": stat.st_size,
+                "time": datetime.datetime.utcfromtimestamp(stat.st_mtime),
+            }
+        )
+    return sorted(profiles, key=lambda p: p["time"], reverse=True)
+
+
+def profile_path(name):
+    """Path of a stored profile, None if there is no profile of this name."""
+    path = profiles_dir() / name
+    if path.name != name or not path.is_file():
+        return None
+    return path
+
+
+def profile_requested(request, endpoint):
+    if endpoint in getattr(settings, "AUTOPROOFREADER_PROFILE_VIEWS", ()):
+        return True
+    return PROFILE_HEADER in request.META and request.user.is_superuser
+
+
+def profiled_view(view):
+    """Wrap a view to profile the requests that ask for it."""
+    endpoint = getattr(view, "__name__", "unknown")
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        enabled = profile_requested(request, endpoint)
+        name = profile_name("request", endpoint) if enabled else None
+        with profiling(enabled, [name]):
+            response = view(request, *args, **kwargs)
+        if enabled:
+            response["X-Autoproofreader-Profile"] = name
+        return response
+
+    return wrapper
+
+
+def profiled_stage(results, stage):
+    """Profile a job stage run for results, if job profiling is enabled."""
+    enabled = getattr(settings, "AUTOPROOFREADER_PROFILE_JOBS", False)
+    names = []
+    if enabled:
+        names = [
+            profile_name("result", "{}_{}".format(result.id, stage))
+            for result in results
+        ]
+    return profiling(enabled, names)
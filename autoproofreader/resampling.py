@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""Resampling of skeletons before they are sent to a compute server.
+
+sarbor resamples every skeleton to its sample spacing anyway, so sending
+every traced node only costs transfer, compute and ingested rows. A
+skeleton is resampled by cutting every segment between branch points,
+leaves and the root into pieces of the sample spacing along the skeleton.
+Each piece becomes one sample point at the mean position of its nodes,
+which smooths out tracing jitter. Sample points keep the id of the first
+treenode of their piece, so rankings refer to real treenodes, and every
+treenode is mapped to the sample point that replaced it. Branch points,
+leaves and roots are kept as they are.
+
+All traversals of the tree are vectorized with pointer jumping, which
+takes a logarithmic number of array operations in the depth of the tree.
+"""
+import numpy as np
+
+
+def read_skeleton_csv(path):
+    """
+    Node ids, parent indices (-1 for roots) and positions of a skeleton.csv
+    with rows of (node_id, parent_id, x, y, z). The parent id of a root
+    may be empty or the id of the node itself.
+    """
+    with path.open() as f:
+        rows = [line.split(",") for line in f if len(line.strip()) > 0]
+    node_ids = np.array([int(row[0]) for row in rows], dtype=np.int64)
+    parent_ids = np.array(
+        [int(row[1]) if len(row[1].strip()) > 0 else int(row[0]) for row in rows],
+        dtype=np.int64,
+    )
+    positions = np.array([[float(v) for v in row[2:5]] for row in rows]).reshape(-1, 3)
+
+    order = np.argsort(node_ids, kind="stable")
+    sorted_ids = node_ids[order]
+    if np.any(sorted_ids[1:] == sorted_ids[:-1]):
+        raise ValueError("skeleton.csv contains duplicate node ids")
+    found = np.searchsorted(sorted_ids, parent_ids).clip(0, max(len(rows) - 1, 0))
+    known = sorted_ids[found] == parent_ids
+    if not np.all(known):
+        i = np.flatnonzero(~known)[0]
+        raise ValueError(
+            "skeleton.csv node {} has an unknown parent {}".format(
+                node_ids[i], parent_ids[i]
+            )
+        )
+    parents = order[found]
+    parents[parent_ids == node_ids] = -1
+    return node_ids, parents, positions
+
+
+def write_skeleton_csv(path, node_ids, parents, positions):
+    """Write a skeleton.csv in the format of exported skeletons."""
+    parent_ids = np.where(parents < 0, node_ids, node_ids[parents])
+    with path.open("w") as f:
+        for node_id, parent_id, (x, y, z) in zip(
+            node_ids.tolist(), parent_ids.tolist(), positions.tolist()
+        ):
+            f.write("{},{},{},{},{}\n".format(node_id, parent_id, x, y, z))
+
+
+def _jump(pointers):
+    """
+    Follow pointers until they reach a node pointing to itself, which
+    every chain has to end in. Raises ValueError for cycles.
+    """
+    for _ in range(int(np.log2(max(len(pointers), 1))) + 2):
+        jumped = pointers[pointers]
+        if np.array_equal(jumped, pointers):
+            return pointers
+        pointers = jumped
+    raise ValueError("skeleton.csv contains a cycle")
+
+
+def path_lengths(parents, positions):
+    """Distance of every node from its root along the skeleton."""
+    has_parent = parents >= 0
+    lengths = np.zeros(len(parents))
+    lengths[has_parent] = np.linalg.norm(
+        positions[has_parent] - positions[parents[has_parent]], axis=1
+    )
+    # After k rounds, every node has added up the 2 ** k edges above it
+    up = parents.copy()
+    for _ in range(int(np.log2(max(len(parents), 1))) + 2):
+        active = np.flatnonzero(up >= 0)
+        if len(active) == 0:
+            return lengths
+        lengths[active] += lengths[up[active]]
+        up[active] = up[up[active]]
+    raise ValueError("skeleton.csv contains a cycle")
+
+
+def resample(parents, positions, spacing):
+    """
+    Resample a skeleton to sample points about spacing apart. Sample points
+    are identified by the index of the first node of their piece. Returns
+    the sample point of every node and the sample points along with the
+    sample point of their parent (-1 for roots) and their position.
+    """
+    n_nodes = len(parents)
+    has_parent = parents >= 0
+    n_children = np.bincount(parents[has_parent], minlength=n_nodes)
+    key = (~has_parent) | (n_children != 1)
+    lengths = path_lengths(parents, positions)
+
+    # First node of the segment of every node below the key node it hangs from
+    index = np.arange(n_nodes)
+    starts = np.where(key | key[parents.clip(0)] | ~has_parent, index, parents)
+    starts = _jump(starts)
+
+    # Pieces of a segment are numbered by their distance to its key node,
+    # key nodes are pieces of their own
+    anchor_lengths = lengths[parents[starts].clip(0)]
+    pieces = np.floor((lengths - anchor_lengths) / spacing).astype(np.int64)
+    pieces[key] = -1
+    _, piece = np.unique(
+        np.stack([starts, pieces], axis=1), axis=0, return_inverse=True
+    )
+    piece = piece.reshape(-1)
+
+    # Pieces are paths, so their node closest to the root comes first
+    order = np.lexsort((lengths, piece))
+    first = np.ones(n_nodes, dtype=bool)
+    first[1:] = piece[order][1:] != piece[order][:-1]
+    samples = order[first]
+    mapping = samples[piece]
+
+    counts = np.bincount(piece)
+    sample_positions = (
+        np.stack(
+            [np.bincount(piece, weights=positions[:, axis]) for axis in range(3)],
+            axis=1,
+        )
+        / counts[:, np.newaxis]
+    )
+    sample_parents = np.where(
+        parents[samples] < 0, -1, mapping[parents[samples].clip(0)]
+    )
+    return mapping, samples, sample_parents, sample_positions
+
+
+def resample_skeleton_csv(path, spacing):
+    """
+    Resample the skeleton in a skeleton.csv in place. Returns csv rows of
+    (treenode_id, sample_id) mapping every node of the original skeleton
+    to the sample point that replaced it.
+    """
+    if spacing <= 0:
+        raise ValueError("The resample spacing has to be positive")
+    node_ids, parents, positions = read_skeleton_csv(path)
+    mapping, samples, sample_parents, sample_positions = resample(
+        parents, positions, spacing
+    )
+
+    # Sample points are written by node id like exported skeletons
+    order = np.argsort(node_ids[samples])
+    reindex = np.empty(len(node_ids), dtype=np.int64)
+    reindex[samples[order]] = np.arange(len(samples))
+    write_skeleton_csv(
+        path,
+        node_ids[samples[order]],
+        np.where(sample_parents[order] < 0, -1, reindex[sample_parents[order]]),
+        sample_positions[order],
+    )
+    return "".join(
+        "{},{}\n".format(node_id, sample_id)
+        for node_id, sample_id in zip(node_ids.tolist(), node_ids[mapping].tolist())
+    )
@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Warm worker running sarbor-error-detector jobs on a compute server.
+
+Starting sarbor for every job means importing TensorFlow, diluvian and
+sarbor and loading the model weights before any work is done. This script
+runs on the compute server, in the environment sarbor is installed in, and
+uses only the standard library, so it can be copied there on its own:
+
+    sarbor-worker --socket ~/.sarbor-worker.sock serve
+
+starts a daemon that imports the heavy modules once and then forks a child
+for every job, which runs the console entry point of sarbor in-process
+with the job's arguments. Models can be kept loaded as well: with
+--model-loader module:function, the daemon loads the model file of every
+job (--model-weights-file) with that function, keeps the --max-models most
+recently used ones and replaces the function with one returning the loaded
+model, which the forked children inherit. The function is replaced before
+the --preload modules are imported and in every module that imported it
+anyway, so both `module.function(path)` and `from module import function`
+calls get the loaded model. The loader has to take the model path as its
+first argument and return objects that survive a fork, i.e. it must not
+initialize the GPU in the daemon.
+
+    sarbor-worker --socket ~/.sarbor-worker.sock run sarbor-error-detector ...
+
+submits a job to the daemon. It passes on its stdout, stderr, working
+directory, environment and virtual memory limit, waits for the job and
+exits with its exit status. Signals it receives are forwarded to the job,
+so it can be stopped like a sarbor process. If no daemon is running, the
+command is run directly instead.
+"""
+import argparse
+from collections import OrderedDict
+import array
+import importlib
+import json
+import logging
+import os
+import resource
+import signal
+import socket
+import sys
+import threading
+import traceback
+
+DEFAULT_PRELOAD = ("tensorflow", "diluvian", "sarbor")
+
+DEFAULT_COMMANDS = ("sarbor-error-detector",)
+
+
+def find_entry_point(name):
+    """The function behind a console script, e.g. sarbor-error-detector."""
+    try:
+        import pkg_resources
+
+        for entry_point in pkg_resources.iter_entry_points("console_scripts", name):
+            return entry_point.load()
+    except ImportError:
+        from importlib.metadata import entry_points
+
+        for entry_point in entry_points().get("console_scripts", []):
+            if entry_point.name == name:
+                return entry_point.load()
+    raise LookupError("No console script named {}".format(name))
+
+
+def import_function(path):
+    """Import a function given as module:function."""
+    module_name, _, function_name = path.partition(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def option_value(argv, name):
+    """Value of an option like --model-weights-file in a command line."""
+    for i, arg in enumerate(argv[:-1]):
+        if arg == name:
+            return argv[i + 1]
+    return None
+
+
+class ModelCache(object):
+    """
+    The most recently used models, loaded with a loader function that is
+    replaced by one returning the loaded models.
+    """
+
+    def __init__(self, loader_path, max_models):
+        module_name, _, function_name = loader_path.partition(":")
+        self.module = importlib.import_module(module_name)
+        self.function_name = function_name
+        self.loader = getattr(self.module, function_name)
+        self.max_models = max_models
+        self.models = OrderedDict()
+
+        def resident_loader(path, *args, **kwargs):
+            model = self.models.get(self.key(path), None)
+            if model is not None:
+                return model
+            return self.loader(path, *args, **kwargs)
+
+        self.resident_loader = resident_loader
+        setattr(self.module, function_name, resident_loader)
+
+    def rebind(self):
+        """Replace the loader in modules that imported it before it was replaced."""
+        for module in list(sys.modules.values()):
+            namespace = getattr(module, "__dict__", {})
+            for name, value in list(namespace.items()):
+                if value is self.loader:
+                    setattr(module, name, self.resident_loader)
+
+    def key(self, path):
+        return os.path.abspath(os.path.expanduser(str(path)))
+
+    def load(self, path):
+        key = self.key(path)
+        if key in self.models:
+            self.models.move_to_end(key)
+            return
+        logging.info("Loading model %s", key)
+        self.models[key] = self.loader(key)
+        while len(self.models) > self.max_models:
+            evicted, _ = self.models.popitem(last=False)
+            logging.info("Evicted model %s", evicted)
+
+
+class Worker(object):
+    """Forks a child running the requested command for every job."""
+
+    def __init__(self, commands, models=None):
+        self.commands = commands
+        self.models = models
+
+    def serve(self, socket_path):
+        socket_path = os.path.expanduser(socket_path)
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(socket_path)
+        os.chmod(socket_path, 0o600)
+        server.listen(16)
+        # Exit statuses are collected by the threads waiting for the jobs
+        logging.info("Listening on %s", socket_path)
+        while True:
+            connection, _ = server.accept()
+            try:
+                self.start_job(connection)
+            except Exception as e:
+                logging.exception("Could not start job")
+                self.send(connection, {"error": repr(e), "exit": 1})
+                connection.close()
+
+    def send(self, connection, message):
+        try:
+            connection.sendall((json.dumps(message) + "\n").encode())
+        except OSError:
+            pass
+
+    def receive(self, connection):
+        """The request of a job and the stdout and stderr of its client."""
+        fds = array.array("i")
+        data = b""
+        while not data.endswith(b"\n"):
+            chunk, ancdata, _, _ = connection.recvmsg(
+                65536, socket.CMSG_LEN(2 * fds.itemsize)
+            )
+            if len(chunk) == 0:
+                raise ValueError("Connection closed before the request was complete")
+            data += chunk
+            for level, kind, fd_data in ancdata:
+                if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                    usable = len(fd_data) - len(fd_data) % fds.itemsize
+                    fds.frombytes(fd_data[:usable])
+        return json.loads(data.decode()), list(fds)
+
+    def start_job(self, connection):
+        request, fds = self.receive(connection)
+        try:
+            argv = request["argv"]
+            command = self.commands[os.path.basename(argv[0])]
+            model_path = option_value(argv, "--model-weights-file")
+            if self.models is not None and model_path is not None:
+                # Relative paths are relative to the job's working directory
+                self.models.load(
+                    os.path.join(request["cwd"], os.path.expanduser(model_path))
+                )
+
+            pid = os.fork()
+            if pid == 0:
+                connection.close()
+                self.run_job(command, request, fds)
+        finally:
+            for fd in fds:
+                os.close(fd)
+        self.send(connection, {"pid": pid})
+        threading.Thread(
+            target=self.wait_for_job, args=(connection, pid), daemon=True
+        ).start()
+
+    def run_job(self, command, request, fds):
+        """Run a job in the forked child, never returns."""
+        code = 1
+        try:
+            os.setsid()
+            for fd, target in zip(fds, (1, 2)):
+                os.dup2(fd, target)
+            os.chdir(request["cwd"])
+            os.environ.clear()
+            os.environ.update(request["env"])
+            if request.get("memory_limit", None) is not None:
+                limit = request["memory_limit"]
+                resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            sys.argv = request["argv"]
+            try:
+                result = command()
+                code = result if isinstance(result, int) else 0
+            except SystemExit as e:
+                if e.code is None:
+                    code = 0
+                elif isinstance(e.code, int):
+                    code = e.code
+                else:
+                    sys.stderr.write("{}\n".format(e.code))
+                    code = 1
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            for stream in (sys.stdout, sys.stderr):
+                try:
+                    stream.flush()
+                except (OSError, ValueError):
+                    # Closed by the command
+                    pass
+            os._exit(code)
+
+    def wait_for_job(self, connection, pid):
+        _, status = os.waitpid(pid, 0)
+        if os.WIFSIGNALED(status):
+            code = 128 + os.WTERMSIG(status)
+        else:
+            code = os.WEXITSTATUS(status)
+        self.send(connection, {"exit": code})
+        connection.close()
+
+
+def serve(args):
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s sarbor-worker %(message)s"
+    )
+    models = None
+    if args.model_loader is not None:
+        models = ModelCache(args.model_loader, args.max_models)
+    for module in args.preload:
+        try:
+            importlib.import_module(module)
+        except ImportError as e:
+            logging.warning("Could not preload %s: %s", module, e)
+
+    commands = {}
+    for command in args.command:
+        name, _, path = command.partition("=")
+        commands[name] = import_function(path) if path else find_entry_point(name)
+
+    if models is not None:
+        models.rebind()
+    Worker(commands, models).serve(args.socket)
+
+
+def run(args):
+    """Run a command through the daemon, or directly if it isn't running."""
+    argv = args.argv
+    if len(argv) > 0 and argv[0] == "--":
+        argv = argv[1:]
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(os.path.expanduser(args.socket))
+    except OSError:
+        os.execvp(argv[0], argv)
+
+    memory_limit, _ = resource.getrlimit(resource.RLIMIT_AS)
+    request = {
+        "argv": argv,
+        "cwd": os.getcwd(),
+        "env": dict(os.environ),
+        "memory_limit": None
+        if memory_limit == resource.RLIM_INFINITY
+        else memory_limit,
+    }
+    sys.stdout.flush()
+    connection.sendmsg(
+        [(json.dumps(request) + "\n").encode()],
+        [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", [1, 2]))],
+    )
+
+    replies = connection.makefile("r")
+    reply = json.loads(replies.readline())
+    if "pid" not in reply:
+        sys.stderr.write("sarbor-worker: {}\n".format(reply.get("error", "")))
+        return reply["exit"]
+    pid = reply["pid"]
+
+    def forward(signum, frame):
+        try:
+            os.killpg(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(signum, forward)
+
+    line = replies.readline()
+    if len(line) == 0:
+        # The daemon went away, the job went with it
+        return 1
+    return json.loads(line)["exit"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--socket", default="~/.sarbor-worker.sock")
+    subparsers = parser.add_subparsers(dest="action")
+
+    serve_parser = subparsers.add_parser("serve", help="Start the worker daemon")
+    serve_parser.add_argument(
+        "--preload",
+        nargs="*",
+        default=list(DEFAULT_PRELOAD),
+        help="Modules imported once at startup",
+    )
+    serve_parser.add_argument(
+        "--command",
+        action="append",
+        default=[],
+        help="Command jobs may run, as a console script name or name=module:function",
+    )
+    serve_parser.add_argument(
+        "--model-loader",
+        default=None,
+        help="Function loading a model from its path, as module:function",
+    )
+    serve_parser.add_argument("--max-models", type=int, default=2)
+
+    run_parser = subparsers.add_parser("run", help="Run a job through the daemon")
+    run_parser.add_argument("argv", nargs=argparse.REMAINDER)
+
+    args = parser.parse_args()
+    if args.action == "serve":
+        if len(args.command) == 0:
+            args.command = list(DEFAULT_COMMANDS)
+        serve(args)
+    elif args.action == "run":
+        sys.exit(run(args))
+    else:
+        parser.print_help()
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
@@ -185,11 +185,21 @@
   ) {
     let self = this;
     if (!(self.arborParserMap && self.arborParserMap[result_id])) {
-      return CATMAID.fetch(
-        "ext/autoproofreader/" + project.id + "/proofread-tree-nodes",
-        "GET",
-        { result_id: result_id }
-      ).then(nodes => {
+      return Promise.all([
+        CATMAID.fetch(
+          "ext/autoproofreader/" + project.id + "/proofread-tree-nodes",
+          "GET",
+          { result_id: result_id }
+        ),
+        CATMAID.fetch(
+          "ext/autoproofreader/" +
+            project.id +
+            "/autoproofreader-results/" +
+            result_id +
+            "/summary",
+          "GET"
+        )
+      ]).then(([nodes, summary]) => {
         let ap = new CATMAID.ArborParser();
         let compact_tree_nodes = nodes.map(x => [
           x.node_id.toString(),
@@ -204,9 +214,10 @@
           acc[next.node_id] = next;
           return acc;
         }, {});
-        self.max_connectivity_score = nodes.reduce((acc, next) => {
-          return Math.max(acc, next.connectivity_score);
-        }, 0);
+        self.max_connectivity_score = Math.max(
+          summary.scores.connectivity_score.max || 0,
+          0
+        );
         self.arborParserMap = {};
         self.arborParserMap[result_id] = ap;
         return ap;
@@ -473,12 +473,15 @@
             setTimeout(function() {
               // then undo it and wait for async behavior to finish
               let toggle_prop = $(self).attr("data-action");
-              let params = {
-                node_pk: rankingTableContainer
-                  .DataTable()
-                  .row(self.closest("tr"))
-                  .data().pk
-              };
+              let row_data = rankingTableContainer
+                .DataTable()
+                .row(self.closest("tr"))
+                .data();
+              // nodes of results stored as arrays have no primary key
+              let params =
+                row_data.pk === null
+                  ? { result_id: row_data.result, node_id: row_data.node_id }
+                  : { node_pk: row_data.pk };
               params[toggle_prop] = true;
               CATMAID.fetch(
                 `ext/autoproofreader/${project.id}/proofread-tree-nodes`,
@@ -609,13 +612,11 @@
   AutoproofreaderWidget.prototype.gatherBasicFiles = function() {
     let self = this;
     let setting_values = self.getSettingValues();
-    return self.getSkeleton().then(function(skeleton_csv) {
-      return {
-        skeleton__csv: skeleton_csv,
-        sarbor_config__toml: toml.dump(setting_values.sarbor),
-        job_config__json: JSON.stringify(setting_values.run),
-        all_settings__toml: toml.dump(setting_values)
-      };
+    // The skeleton itself is exported server side from skeleton_id
+    return Promise.resolve({
+      sarbor_config__toml: toml.dump(setting_values.sarbor),
+      job_config__json: JSON.stringify(setting_values.run),
+      all_settings__toml: toml.dump(setting_values)
     });
   };
 
@@ -662,7 +663,6 @@
       container.append(file.name, file);
     };
     var post_data = new FormData();
-    let test_keys = ["skeleton.csv", "sarbor_config.toml", "job_config.json"];
     for (let file_descriptor in files) {
       let [a, b] = file_descriptor.split("__");
       add_file(post_data, files[file_descriptor], `${a}.${b}`);
@@ -1032,55 +1032,6 @@
     };
   };
 
-  /*
-    --------------------------------------------------------------------------------
-    SKELETONS
-    */
-
-  let getVertices = function(nodes) {
-    return nodes.reduce((vs, vertex) => {
-      vs[vertex[0]] = new THREE.Vector3(...vertex.slice(3, 6));
-      return vs;
-    }, {});
-  };
-
-  AutoproofreaderWidget.prototype.getSkeleton = function() {
-    let self = this;
-    let run_settings = self.getSettingValues(self.settings.run);
-    let skid = run_settings["skeleton_id"];
-    return CATMAID.fetch(project.id + "/skeletons/" + skid + "/compact-detail")
-      .then(function(skeleton_json) {
-        let arborParser = new CATMAID.ArborParser();
-        let arbor = arborParser.init("compact-skeleton", skeleton_json).arbor;
-        let nodes = getVertices(skeleton_json[0]);
-        return self.skeletonToCSV(arbor, nodes);
-      })
-      .catch(function(error) {
-        CATMAID.handleError(error);
-      });
-  };
-
-  AutoproofreaderWidget.prototype.skeletonToCSV = function(arbor, nodes) {
-    let csv = "";
-    for (let i = 0; i < Object.keys(nodes).length; i++) {
-      let node_key = Object.keys(nodes)[i];
-      csv +=
-        node_key +
-        "," +
-        (typeof arbor.edges[node_key] === "undefined"
-          ? node_key
-          : arbor.edges[node_key]) +
-        "," +
-        nodes[node_key].x +
-        "," +
-        nodes[node_key].y +
-        "," +
-        nodes[node_key].z +
-        "\n";
-    }
-    return csv;
-  };
-
   /*
     --------------------------------------------------------------------------------
     VOLUMES
@@ -1707,14 +1658,30 @@
     this.ongoingTable.clear();
     this.completedTable.clear();
     let self = this;
-    CATMAID.fetch(
-      "ext/autoproofreader/" + project.id + "/autoproofreader-results",
-      "GET"
-    )
-      .then(function(results) {
-        results.forEach(function(result) {
+    let pageSize = 1000;
+    // Results are listed a page at a time, follow the pages until every
+    // result is in the tables
+    let fetchPage = function(page) {
+      return CATMAID.fetch(
+        "ext/autoproofreader/" + project.id + "/autoproofreader-results",
+        "GET",
+        {
+          summary: true,
+          page: page,
+          page_size: pageSize,
+          order_by: "-creation_time"
+        }
+      ).then(function(response) {
+        response.results.forEach(function(result) {
           self.appendOneJob(result);
         });
+        if (page * pageSize < response.count) {
+          return fetchPage(page + 1);
+        }
+      });
+    };
+    fetchPage(1)
+      .then(function() {
         self.ongoingTable.draw();
         self.completedTable.draw();
       })
@@ -1727,9 +1694,7 @@
       completion_time: job.completion_time,
       config: job.config,
       creation_time: job.creation_time,
-      data: job.data,
       edition_time: job.edition_time,
-      errors: job.errors,
       id: job.id,
       model: job.model,
       name: job.name,
@@ -1737,8 +1702,10 @@
       private: job.private,
       project: job.project,
       skeleton: job.skeleton,
-      skeleton_csv: job.skeleton_csv,
-      status: job.status,
+      status:
+        job.status === "partial"
+          ? `partial (${job.partial_nodes} nodes)`
+          : job.status,
       user: job.user,
       volume: job.volume
     };
@@ -1751,10 +1718,32 @@
     }
   };
 
+  AutoproofreaderWidget.prototype.update_reviews = function(
+    result_id,
+    reviews
+  ) {
+    if (this.ranking_result_id !== result_id || !this.rankingTable) {
+      return;
+    }
+    let reviewed = reviews.reduce((acc, review) => {
+      acc[review.node_id] = review.reviewed;
+      return acc;
+    }, {});
+    this.rankingTable.rows().every(function() {
+      let row = this.data();
+      if (row.node_id in reviewed && row.reviewed !== reviewed[row.node_id]) {
+        row.reviewed = reviewed[row.node_id];
+        this.data(row);
+      }
+    });
+    this.rankingTable.draw(false);
+  };
+
   AutoproofreaderWidget.prototype.appendOneNode = function(node) {
     let self = this;
     let row = {
       pk: node.id, // primary key (different from node id since for each proofread skeleton node-ids start at 0)
+      result: node.result,
       node_id: node.node_id,
       parent_id: node.parent_id,
       connectivity_score: node.connectivity_score,
@@ -3325,6 +3314,17 @@
             widget.get_jobs();
           }
         }
+      },
+      "autoproofreader-review-update": function(client, payload) {
+        // Show the reviews of other viewers in the rankings table
+        let autoproofreader_windows = WindowMaker.getOpenWindows(
+          "autoproofreader-widget"
+        );
+        if (autoproofreader_windows) {
+          for (let widget of autoproofreader_windows.values()) {
+            widget.update_reviews(payload.result_id, payload.reviews);
+          }
+        }
       }
     }
   });
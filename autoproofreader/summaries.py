@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""Summaries of the scores of a result.
+
+Overviews of a result, like colour scales or the distribution of its
+scores, only need a few statistics of every score. They are computed once
+when the scores are stored and served without loading the nodes.
+"""
+from collections import OrderedDict
+
+import numpy as np
+
+# Scores summarized for every result
+SUMMARIZED_SCORES = ("branch_score", "connectivity_score")
+
+# Percentiles of every score
+SUMMARY_QUANTILES = (5, 25, 50, 75, 95)
+
+# Number of equally wide bins between the smallest and largest score
+HISTOGRAM_BINS = 20
+
+
+def summarize_scores(values, bins=HISTOGRAM_BINS):
+    """
+    Count, range, mean, quantiles and histogram of the scores of a result.
+    Missing scores (NaN) are left out.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    if len(values) == 0:
+        return OrderedDict(
+            [
+                ("count", 0),
+                ("min", None),
+                ("max", None),
+                ("mean", None),
+                ("quantiles", OrderedDict()),
+                ("histogram", OrderedDict([("edges", []), ("counts", [])])),
+            ]
+        )
+    counts, edges = np.histogram(values, bins=bins)
+    return OrderedDict(
+        [
+            ("count", len(values)),
+            ("min", float(values.min())),
+            ("max", float(values.max())),
+            ("mean", float(values.mean())),
+            (
+                "quantiles",
+                OrderedDict(
+                    (str(q), float(v))
+                    for q, v in zip(
+                        SUMMARY_QUANTILES, np.percentile(values, SUMMARY_QUANTILES)
+                    )
+                ),
+            ),
+            (
+                "histogram",
+                OrderedDict([("edges", edges.tolist()), ("counts", counts.tolist())]),
+            ),
+        ]
+    )
+
+
+def summarize_nodes(columns):
+    """Summaries of every score of decoded nodes (see decode_result_nodes)."""
+    return OrderedDict(
+        (name, summarize_scores(columns[name])) for name in SUMMARIZED_SCORES
+    )
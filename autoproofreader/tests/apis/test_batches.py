@@ -0,0 +1,95 @@
+import json
+import shutil
+import tempfile
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from guardian.shortcuts import assign_perm
+
+from autoproofreader.models import AutoproofreaderResult
+from autoproofreader.tests.common import AutoproofreaderTestCase
+
+BATCHES_URL = "/ext/autoproofreader/{}/autoproofreader-batches"
+
+
+class BatchesTest(AutoproofreaderTestCase):
+    def test_get(self):
+        self.fake_authentication()
+        assign_perm("can_browse", self.test_user, self.test_project)
+
+        for i, status in enumerate(["complete", "computing", "queued", "queued"]):
+            AutoproofreaderResult.objects.create(
+                user_id=3,
+                project_id=3,
+                name="batch_1_{}".format(i),
+                status=status,
+                config_id=1,
+                skeleton_id=1,
+                model_id=1,
+                batch_id=1,
+                errors="",
+            )
+
+        response = self.client.get(
+            BATCHES_URL.format(self.test_project_id), {"batch_id": 1}
+        )
+        self.assertEqual(response.status_code, 200)
+        parsed_response = json.loads(response.content.decode("utf-8"))
+        expected_result = [
+            {
+                "id": 1,
+                "name": "test_batch_1",
+                "config": 1,
+                "max_concurrent_jobs": 2,
+                "user": 3,
+                "project": 3,
+                "creation_time": "2003-01-01T01:01:01.001000Z",
+                "edition_time": "2003-01-01T01:01:01.001000Z",
+                "total": 4,
+                "status_counts": {"complete": 1, "computing": 1, "queued": 2},
+                "progress": 0.25,
+            }
+        ]
+        self.assertEqual(expected_result, parsed_response)
+
+    def test_put_without_skeletons(self):
+        self.fake_authentication()
+        assign_perm("can_queue_compute_task", self.test_user, self.test_project)
+
+        response = self.client.put(BATCHES_URL.format(self.test_project_id))
+        self.assertEqual(response.status_code, 400)
+
+    def test_put_invalid_references(self):
+        self.fake_authentication()
+        assign_perm("can_queue_compute_task", self.test_user, self.test_project)
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+
+        def put(skeleton_ids, **job_config):
+            job_config.setdefault("segmentation_type", "cached_lsd")
+            files = {
+                name: SimpleUploadedFile(name, content)
+                for name, content in (
+                    ("job_config.json", json.dumps(job_config).encode()),
+                    ("sarbor_config.toml", b""),
+                    ("all_settings.toml", b""),
+                )
+            }
+            for i, skeleton_id in enumerate(skeleton_ids):
+                files["skeleton_ids[{}]".format(i)] = skeleton_id
+            with self.settings(MEDIA_ROOT=media):
+                return self.client.put(
+                    BATCHES_URL.format(self.test_project_id),
+                    encode_multipart(BOUNDARY, files),
+                    content_type=MULTIPART_CONTENT,
+                )
+
+        results = AutoproofreaderResult.objects.count()
+        self.assertEqual(put([235]).status_code, 400)
+        self.assertEqual(put([235], model_id=1, server_id=99).status_code, 400)
+        self.assertEqual(put([235, 999999], model_id=1, server_id=1).status_code, 400)
+        self.assertEqual(put(["a"], model_id=1, server_id=1).status_code, 400)
+        self.assertEqual(AutoproofreaderResult.objects.count(), results)
+
+        self.assertEqual(put([235], model_id=1, server_id=1).status_code, 200)
+        self.assertEqual(AutoproofreaderResult.objects.count(), results + 1)
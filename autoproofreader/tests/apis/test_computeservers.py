@@ -23,6 +23,9 @@ class ComputeServerTest(AutoproofreaderTestCase):
                 "ssh_user": "test_user_1",
                 "ssh_key": "test_key_1",
                 "project_whitelist": [],
+                "max_concurrent_jobs": 1,
+                "transport": "ssh",
+                "worker_socket": None,
             },
             {
                 "name": "test_server_2",
@@ -34,6 +37,9 @@ class ComputeServerTest(AutoproofreaderTestCase):
                 "ssh_user": "test_user_2",
                 "ssh_key": "test_key_2",
                 "project_whitelist": [1, 3],
+                "max_concurrent_jobs": 1,
+                "transport": "ssh",
+                "worker_socket": None,
             },
         ]
         self.assertEqual(expected_result, parsed_response)
@@ -54,6 +60,9 @@ class ComputeServerTest(AutoproofreaderTestCase):
                 "ssh_user": "test_user_1",
                 "ssh_key": "test_key_1",
                 "project_whitelist": [],
+                "max_concurrent_jobs": 1,
+                "transport": "ssh",
+                "worker_socket": None,
             }
         ]
         self.assertEqual(expected_result, parsed_response)
@@ -71,6 +80,9 @@ class ComputeServerTest(AutoproofreaderTestCase):
                 "environment_source_path": "test_4_env",
                 "ssh_user": "test_user_4",
                 "project_whitelist": [3],
+                "max_concurrent_jobs": 2,
+                "transport": "local",
+                "worker_socket": "~/.sarbor-worker.sock",
             },
             content_type="application/json",
         )
@@ -94,12 +106,39 @@ class ComputeServerTest(AutoproofreaderTestCase):
             "ssh_user": "test_user_4",
             "ssh_key": "test_server_4",
             "project_whitelist": [3],
+            "max_concurrent_jobs": 2,
+            "transport": "local",
+            "worker_socket": "~/.sarbor-worker.sock",
         }
         # edition time can't be known exactly so check the rest
         self.assertEqual(len(parsed_response), 1)
         for k, v in expected_result.items():
             self.assertEqual(v, parsed_response[0][k])
 
+    def test_put_unknown_transport(self):
+        self.fake_authentication()
+        assign_perm("can_administer", self.test_user, self.test_project)
+        response = self.client.put(
+            COMPUTE_SERVER_URL.format(self.test_project_id),
+            data={"address": "test_server_5.org", "transport": "carrier_pigeon"},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_put_invalid_concurrency(self):
+        self.fake_authentication()
+        assign_perm("can_administer", self.test_user, self.test_project)
+        for max_concurrent_jobs in ("two", 0):
+            response = self.client.put(
+                COMPUTE_SERVER_URL.format(self.test_project_id),
+                data={
+                    "address": "test_server_5.org",
+                    "max_concurrent_jobs": max_concurrent_jobs,
+                },
+                content_type="application/json",
+            )
+            self.assertEqual(response.status_code, 400)
+
     def test_delete(self):
         self.fake_authentication()
         assign_perm("can_administer", self.test_user, self.test_project)
@@ -0,0 +1,69 @@
+import json
+from guardian.shortcuts import assign_perm
+
+from autoproofreader.tests.common import AutoproofreaderTestCase
+
+JOB_METRICS_URL = "/ext/autoproofreader/{}/job-metrics"
+
+
+class JobMetricsTest(AutoproofreaderTestCase):
+    def test_get(self):
+        self.fake_authentication()
+        assign_perm("can_browse", self.test_user, self.test_project)
+
+        response = self.client.get(
+            JOB_METRICS_URL.format(self.test_project_id),
+            {"group_by": "model", "percentiles": [50]},
+        )
+        self.assertEqual(response.status_code, 200)
+        parsed_response = json.loads(response.content.decode("utf-8"))
+        expected_result = [
+            {
+                "group": 1,
+                "stage": "compute",
+                "count": 1,
+                "wall_time": {"50": 100.0},
+                "bytes_transferred": None,
+                "rows_ingested": None,
+                "peak_rss": None,
+            },
+            {
+                "group": 2,
+                "stage": "compute",
+                "count": 1,
+                "wall_time": {"50": 300.0},
+                "bytes_transferred": None,
+                "rows_ingested": None,
+                "peak_rss": None,
+            },
+            {
+                "group": 2,
+                "stage": "ingest",
+                "count": 1,
+                "wall_time": {"50": 2.0},
+                "bytes_transferred": {"50": 1000.0},
+                "rows_ingested": {"50": 5000.0},
+                "peak_rss": {"50": 100000000.0},
+            },
+        ]
+        self.assertEqual(expected_result, parsed_response)
+
+        response = self.client.get(
+            JOB_METRICS_URL.format(self.test_project_id),
+            {"group_by": "skeleton_size", "stage": "compute"},
+        )
+        self.assertEqual(response.status_code, 200)
+        parsed_response = json.loads(response.content.decode("utf-8"))
+        self.assertEqual([m["group"] for m in parsed_response], [100, 1000])
+        self.assertEqual(
+            parsed_response[1]["wall_time"], {"50": 300.0, "90": 300.0, "99": 300.0}
+        )
+
+    def test_get_invalid_group(self):
+        self.fake_authentication()
+        assign_perm("can_browse", self.test_user, self.test_project)
+
+        response = self.client.get(
+            JOB_METRICS_URL.format(self.test_project_id), {"group_by": "user"}
+        )
+        self.assertEqual(response.status_code, 400)
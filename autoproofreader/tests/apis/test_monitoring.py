@@ -0,0 +1,29 @@
+from django.test import override_settings
+
+from autoproofreader.tests.common import AutoproofreaderTestCase
+
+MONITORING_URL = "/ext/autoproofreader/metrics"
+
+
+@override_settings(
+    AUTOPROOFREADER_MONITORING_TOKEN="secret", AUTOPROOFREADER_MONITORING_GPUS=False
+)
+class MonitoringTest(AutoproofreaderTestCase):
+    def test_get(self):
+        response = self.client.get(MONITORING_URL)
+        self.assertEqual(response.status_code, 403)
+
+        response = self.client.get(MONITORING_URL, HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        lines = response.content.decode("utf-8").split("\n")
+        self.assertIn('autoproofreader_jobs{status="computing"} 2', lines)
+        self.assertIn('autoproofreader_jobs{status="queued"} 1', lines)
+        self.assertIn('autoproofreader_queue_depth{server="test_server_1"} 0', lines)
+        self.assertIn('autoproofreader_stage_runs_total{stage="compute"} 2', lines)
+        self.assertIn('autoproofreader_stage_rows_total{stage="ingest"} 5000', lines)
+        self.assertIn("autoproofreader_job_duration_seconds_count 0", lines)
+        self.assertIn(
+            'autoproofreader_request_duration_seconds_count{endpoint="monitoring_metrics",method="GET",status="403"} 1',
+            lines,
+        )
@@ -1,9 +1,22 @@
+import datetime
 import json
+import tempfile
 from guardian.shortcuts import assign_perm
+from django.utils import timezone
 
+from autoproofreader.cache import result_cache
+from autoproofreader.control.proofread_tree_nodes import review_broadcaster
+from autoproofreader.models import (
+    AutoproofreaderResult,
+    ProofreadTreeNodes,
+    ResultSubscription,
+    ResultSummary,
+)
+from autoproofreader.node_arrays import has_node_arrays, write_node_arrays
 from autoproofreader.tests.common import AutoproofreaderTestCase
 
 PROOFREAD_TREE_NODES_URL = "/ext/autoproofreader/{}/proofread-tree-nodes"
+RESULT_SUMMARY_URL = "/ext/autoproofreader/{}/autoproofreader-results/{}/summary"
 
 
 class ProofreadTreeNodesTest(AutoproofreaderTestCase):
@@ -196,3 +209,253 @@ class ProofreadTreeNodesTest(AutoproofreaderTestCase):
             PROOFREAD_TREE_NODES_URL.format(self.test_project_id)
         )
         self.assertEqual(len(json.loads(response.content.decode("utf-8"))), 0)
+
+    def test_patch(self):
+        self.fake_authentication()
+        assign_perm("can_queue_compute_task", self.test_user, self.test_project)
+        assign_perm("can_browse", self.test_user, self.test_project)
+
+        # Toggle a node that has never been reviewed
+        response = self.client.patch(
+            PROOFREAD_TREE_NODES_URL.format(self.test_project_id),
+            data={"node_pk": 3, "reviewed": True},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        parsed_response = json.loads(response.content.decode("utf-8"))
+        self.assertEqual({"reviewed": True}, parsed_response)
+
+        # Toggle a node with an existing review
+        response = self.client.patch(
+            PROOFREAD_TREE_NODES_URL.format(self.test_project_id),
+            data={"node_pk": 2, "reviewed": True},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        parsed_response = json.loads(response.content.decode("utf-8"))
+        self.assertEqual({"reviewed": True}, parsed_response)
+
+        response = self.client.get(
+            PROOFREAD_TREE_NODES_URL.format(self.test_project_id)
+        )
+        parsed_response = json.loads(response.content.decode("utf-8"))
+        self.assertEqual(
+            [False, True, True, False], [node["reviewed"] for node in parsed_response]
+        )
+
+        # Toggle it back
+        response = self.client.patch(
+            PROOFREAD_TREE_NODES_URL.format(self.test_project_id),
+            data={"node_pk": 2, "reviewed": True},
+            content_type="application/json",
+        )
+        parsed_response = json.loads(response.content.decode("utf-8"))
+        self.assertEqual({"reviewed": False}, parsed_response)
+
+    def test_node_arrays(self):
+        self.fake_authentication()
+        assign_perm("can_browse", self.test_user, self.test_project)
+        assign_perm("can_queue_compute_task", self.test_user, self.test_project)
+
+        with tempfile.TemporaryDirectory() as media_root:
+            with self.settings(MEDIA_ROOT=media_root):
+                result = AutoproofreaderResult.objects.get(id=2)
+                write_node_arrays(
+                    result,
+                    [
+                        (1, None, 3, 3, 3, 3, 3, 3, 3, 3),
+                        (2, 1, 4, 4, 4, 4, 4, 4, 4, None),
+                    ],
+                )
+                ProofreadTreeNodes.objects.filter(result_id=2).delete()
+                result.node_storage = "arrays"
+                result.save()
+
+                response = self.client.get(
+                    PROOFREAD_TREE_NODES_URL.format(self.test_project_id),
+                    {"result_id": 2},
+                )
+                self.assertEqual(response.status_code, 200)
+                parsed_response = json.loads(response.content.decode("utf-8"))
+                self.assertEqual([1, 2], [n["node_id"] for n in parsed_response])
+                self.assertEqual([None, 1], [n["parent_id"] for n in parsed_response])
+                self.assertEqual(
+                    [3.0, None], [n["connectivity_score"] for n in parsed_response]
+                )
+                self.assertEqual([None, None], [n["id"] for n in parsed_response])
+
+                # Array stored nodes are reviewed by result and node id
+                response = self.client.patch(
+                    PROOFREAD_TREE_NODES_URL.format(self.test_project_id),
+                    data={"result_id": 2, "node_id": 2, "reviewed": True},
+                    content_type="application/json",
+                )
+                self.assertEqual(response.status_code, 200)
+                parsed_response = json.loads(response.content.decode("utf-8"))
+                self.assertEqual({"reviewed": True}, parsed_response)
+
+                # Without a node_id the node can't be found
+                for data in ({"result_id": 2}, {"result_id": 2, "node_id": "two"}):
+                    data["reviewed"] = True
+                    response = self.client.patch(
+                        PROOFREAD_TREE_NODES_URL.format(self.test_project_id),
+                        data=data,
+                        content_type="application/json",
+                    )
+                    self.assertEqual(response.status_code, 400)
+
+                response = self.client.get(
+                    PROOFREAD_TREE_NODES_URL.format(self.test_project_id),
+                    {"result_id": 2},
+                )
+                parsed_response = json.loads(response.content.decode("utf-8"))
+                self.assertEqual(
+                    [False, True], [n["reviewed"] for n in parsed_response]
+                )
+
+                response = self.client.delete(
+                    PROOFREAD_TREE_NODES_URL.format(self.test_project_id),
+                    data={"result_id": 2},
+                    content_type="application/json",
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertFalse(has_node_arrays(result))
+
+    def test_cached_nodes(self):
+        self.fake_authentication()
+        assign_perm("can_browse", self.test_user, self.test_project)
+        assign_perm("can_queue_compute_task", self.test_user, self.test_project)
+        AutoproofreaderResult.objects.filter(id=1).update(status="complete")
+        result_cache.invalidate()
+
+        def get_nodes():
+            response = self.client.get(
+                PROOFREAD_TREE_NODES_URL.format(self.test_project_id), {"result_id": 1}
+            )
+            self.assertEqual(response.status_code, 200)
+            return json.loads(response.content.decode("utf-8"))
+
+        first = get_nodes()
+        hits = result_cache.stats()["hits"]
+        self.assertEqual(first, get_nodes())
+        self.assertEqual(result_cache.stats()["hits"], hits + 1)
+
+        # Reviewing a node invalidates the cached response
+        self.client.patch(
+            PROOFREAD_TREE_NODES_URL.format(self.test_project_id),
+            data={"node_pk": 1, "reviewed": True},
+            content_type="application/json",
+        )
+        self.assertEqual([True, False], [n["reviewed"] for n in get_nodes()])
+
+        # So does storing new nodes, which updates the result
+        ProofreadTreeNodes.objects.filter(result_id=1).update(branch_score=5)
+        AutoproofreaderResult.objects.filter(id=1).update(edition_time=timezone.now())
+        self.assertEqual([5, 5], [n["branch_score"] for n in get_nodes()])
+
+    def test_summary(self):
+        self.fake_authentication()
+        assign_perm("can_browse", self.test_user, self.test_project)
+        assign_perm("can_queue_compute_task", self.test_user, self.test_project)
+        AutoproofreaderResult.objects.filter(id=1).update(status="complete")
+
+        def get_summary(result_id):
+            response = self.client.get(
+                RESULT_SUMMARY_URL.format(self.test_project_id, result_id)
+            )
+            self.assertEqual(response.status_code, 200)
+            return json.loads(response.content.decode("utf-8"))
+
+        summary = get_summary(1)
+        self.assertEqual(summary["node_count"], 2)
+        self.assertEqual(summary["reviewed_count"], 0)
+        branch = summary["scores"]["branch_score"]
+        self.assertEqual(
+            [branch["count"], branch["min"], branch["max"], branch["mean"]],
+            [2, 1.0, 2.0, 1.5],
+        )
+        self.assertEqual(branch["quantiles"]["50"], 1.5)
+        self.assertEqual(sum(branch["histogram"]["counts"]), 2)
+        self.assertEqual(len(branch["histogram"]["edges"]), 21)
+        # Summaries of complete results are stored
+        self.assertTrue(ResultSummary.objects.filter(result_id=1).exists())
+
+        # Reviews update the stored summary
+        self.client.patch(
+            PROOFREAD_TREE_NODES_URL.format(self.test_project_id),
+            data={"node_pk": 1, "reviewed": True},
+            content_type="application/json",
+        )
+        self.assertEqual(get_summary(1)["reviewed_count"], 1)
+        self.client.patch(
+            PROOFREAD_TREE_NODES_URL.format(self.test_project_id),
+            data={"node_pk": 1, "reviewed": True},
+            content_type="application/json",
+        )
+        self.assertEqual(get_summary(1)["reviewed_count"], 0)
+
+        # The count is taken from the reviews, a count that is off is fixed
+        ResultSummary.objects.filter(result_id=1).update(reviewed_count=7)
+        self.client.patch(
+            PROOFREAD_TREE_NODES_URL.format(self.test_project_id),
+            data={"node_pk": 1, "reviewed": True},
+            content_type="application/json",
+        )
+        self.assertEqual(get_summary(1)["reviewed_count"], 1)
+
+        # Running jobs are summarized from the nodes stored so far
+        summary = get_summary(2)
+        self.assertEqual(summary["scores"]["connectivity_score"]["max"], 4.0)
+        self.assertFalse(ResultSummary.objects.filter(result_id=2).exists())
+
+        # Private results of other users are not visible
+        response = self.client.get(RESULT_SUMMARY_URL.format(self.test_project_id, 3))
+        self.assertEqual(response.status_code, 404)
+
+    def test_review_broadcast(self):
+        self.fake_authentication()
+        assign_perm("can_browse", self.test_user, self.test_project)
+        assign_perm("can_queue_compute_task", self.test_user, self.test_project)
+
+        with self.settings(AUTOPROOFREADER_REVIEW_BROADCAST_DELAY=60):
+            # Viewing the nodes of a result subscribes to its reviews
+            self.client.get(
+                PROOFREAD_TREE_NODES_URL.format(self.test_project_id), {"result_id": 1}
+            )
+            subscription = ResultSubscription.objects.get(
+                result_id=1, user=self.test_user
+            )
+
+            # Subscriptions are only renewed once half their time passed
+            def renew(age):
+                ResultSubscription.objects.filter(id=subscription.id).update(
+                    edition_time=timezone.now() - datetime.timedelta(seconds=age)
+                )
+                edition_time = ResultSubscription.objects.get(
+                    id=subscription.id
+                ).edition_time
+                self.client.get(
+                    PROOFREAD_TREE_NODES_URL.format(self.test_project_id),
+                    {"result_id": 1},
+                )
+                return (
+                    ResultSubscription.objects.get(id=subscription.id).edition_time
+                    != edition_time
+                )
+
+            with self.settings(AUTOPROOFREADER_REVIEW_SUBSCRIPTION_TTL=3600):
+                self.assertFalse(renew(60))
+                self.assertTrue(renew(2400))
+
+            for node_pk in (1, 2, 1):
+                self.client.patch(
+                    PROOFREAD_TREE_NODES_URL.format(self.test_project_id),
+                    data={"node_pk": node_pk, "reviewed": True},
+                    content_type="application/json",
+                )
+            with review_broadcaster.lock:
+                pending = list(review_broadcaster.pending.pop(1).values())
+            review_broadcaster.flush()
+        self.assertEqual(
+            pending, [(1, False, self.test_user.id), (2, True, self.test_user.id)],
+        )
@@ -0,0 +1,71 @@
+import json
+from guardian.shortcuts import assign_perm
+
+from autoproofreader.tests.common import AutoproofreaderTestCase
+
+COMPARE_URL = "/ext/autoproofreader/{}/autoproofreader-results/compare"
+
+
+class ResultComparisonTest(AutoproofreaderTestCase):
+    def test_get(self):
+        self.fake_authentication()
+        assign_perm("can_browse", self.test_user, self.test_project)
+
+        response = self.client.get(
+            COMPARE_URL.format(self.test_project_id), {"result_a": 1, "result_b": 2}
+        )
+        self.assertEqual(response.status_code, 200)
+        parsed_response = json.loads(response.content.decode("utf-8"))
+        self.assertEqual(parsed_response["match"], "node_id")
+        self.assertEqual(parsed_response["matched"], 2)
+        self.assertEqual(
+            parsed_response["scores"]["branch_score"],
+            {
+                "compared": 2,
+                "mean_delta": 2.0,
+                "mean_abs_delta": 2.0,
+                "max_abs_delta": 2.0,
+                "rank_correlation": 1.0,
+            },
+        )
+        self.assertEqual(
+            [
+                (d["node_id_a"], d["score_a"], d["score_b"])
+                for d in parsed_response["disagreements"]
+            ],
+            [(1, 1.0, 3.0), (2, 2.0, 4.0)],
+        )
+
+        # Results 1 and 2 have nodes 2 nm apart along every axis
+        response = self.client.get(
+            COMPARE_URL.format(self.test_project_id),
+            {"result_a": 1, "result_b": 2, "match": "position", "max_distance": 1},
+        )
+        self.assertEqual(response.status_code, 200)
+        parsed_response = json.loads(response.content.decode("utf-8"))
+        self.assertEqual(parsed_response["matched"], 0)
+
+    def test_get_invalid(self):
+        self.fake_authentication()
+        assign_perm("can_browse", self.test_user, self.test_project)
+
+        response = self.client.get(
+            COMPARE_URL.format(self.test_project_id),
+            {"result_a": 1, "result_b": 2, "score": "segment_score"},
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(
+            COMPARE_URL.format(self.test_project_id), {"result_a": 1}
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(
+            COMPARE_URL.format(self.test_project_id),
+            {"result_a": 1, "result_b": 2, "max_distance": 1e9},
+        )
+        self.assertEqual(response.status_code, 400)
+
+        # Private results of other users are not visible
+        response = self.client.get(
+            COMPARE_URL.format(self.test_project_id), {"result_a": 1, "result_b": 3}
+        )
+        self.assertEqual(response.status_code, 404)
@@ -1,10 +1,13 @@
 import json
 from guardian.shortcuts import assign_perm
 
+from autoproofreader.models import AutoproofreaderResult, Blob
 from autoproofreader.tests.common import AutoproofreaderTestCase
 
 RESULTS_URL = "/ext/autoproofreader/{}/autoproofreader-results"
 RESULTS_UUID_URL = "/ext/autoproofreader/{}/autoproofreader-results-uuid"
+RESULT_DETAIL_URL = "/ext/autoproofreader/{}/autoproofreader-results/{}"
+RESULT_CANCEL_URL = "/ext/autoproofreader/{}/autoproofreader-results/{}/cancel"
 
 
 class ResultsTest(AutoproofreaderTestCase):
@@ -22,7 +25,6 @@ class ResultsTest(AutoproofreaderTestCase):
                 "status": "queued",
                 "config": 1,
                 "skeleton": 1,
-                "skeleton_csv": "0,0,1,2,3",
                 "model": 1,
                 "data": "test_1",
                 "completion_time": "2001-01-01T01:01:01.001000Z",
@@ -34,6 +36,19 @@ class ResultsTest(AutoproofreaderTestCase):
                 "private": False,
                 "permanent": True,
                 "errors": "1 error",
+                "node_storage": "rows",
+                "partial_nodes": None,
+                "batch": None,
+                "server": None,
+                "segmentation_type": "",
+                "task_id": None,
+                "time_limit": None,
+                "memory_limit": None,
+                "priority": 1,
+                "start_time": None,
+                "completed_stages": [],
+                "queue_position": None,
+                "estimated_start_time": None,
             },
             {
                 "id": 2,
@@ -41,7 +56,6 @@ class ResultsTest(AutoproofreaderTestCase):
                 "status": "computing",
                 "config": 2,
                 "skeleton": 2,
-                "skeleton_csv": "0,0,1,2,3",
                 "model": 2,
                 "data": "test_2",
                 "completion_time": "2002-06-01T01:01:01.001000Z",
@@ -53,6 +67,19 @@ class ResultsTest(AutoproofreaderTestCase):
                 "private": False,
                 "permanent": True,
                 "errors": "2 errors",
+                "node_storage": "rows",
+                "partial_nodes": None,
+                "batch": None,
+                "server": None,
+                "segmentation_type": "",
+                "task_id": None,
+                "time_limit": None,
+                "memory_limit": None,
+                "priority": 1,
+                "start_time": None,
+                "completed_stages": [],
+                "queue_position": None,
+                "estimated_start_time": None,
             },
         ]
         self.assertEqual(expected_result, parsed_response)
@@ -70,6 +97,7 @@ class ResultsTest(AutoproofreaderTestCase):
                 "config": 1,
                 "skeleton": 1,
                 "skeleton_csv": "0,0,1,2,3",
+                "sample_mapping_csv": None,
                 "model": 1,
                 "data": "test_1",
                 "completion_time": "2001-01-01T01:01:01.001000Z",
@@ -81,10 +109,145 @@ class ResultsTest(AutoproofreaderTestCase):
                 "private": False,
                 "permanent": True,
                 "errors": "1 error",
+                "node_storage": "rows",
+                "partial_nodes": None,
+                "batch": None,
+                "server": None,
+                "segmentation_type": "",
+                "task_id": None,
+                "time_limit": None,
+                "memory_limit": None,
+                "priority": 1,
+                "start_time": None,
+                "completed_stages": [],
+                "queue_position": None,
+                "estimated_start_time": None,
             }
         ]
         self.assertEqual(expected_result, parsed_response)
 
+    def test_get_summary(self):
+        self.fake_authentication()
+        assign_perm("can_browse", self.test_user, self.test_project)
+
+        response = self.client.get(
+            RESULTS_URL.format(self.test_project_id),
+            {"summary": True, "order_by": "-creation_time", "page_size": 1},
+        )
+        self.assertEqual(response.status_code, 200)
+        parsed_response = json.loads(response.content.decode("utf-8"))
+        expected_result = {
+            "count": 2,
+            "results": [
+                {
+                    "id": 2,
+                    "name": "test_result_2",
+                    "status": "computing",
+                    "config": 2,
+                    "skeleton": 2,
+                    "model": 2,
+                    "completion_time": "2002-06-01T01:01:01.001000Z",
+                    "user": 3,
+                    "project": 3,
+                    "creation_time": "2002-02-02T02:02:02.002000Z",
+                    "edition_time": "2003-02-02T02:02:02.002000Z",
+                    "volume": None,
+                    "private": False,
+                    "permanent": True,
+                    "node_storage": "rows",
+                    "partial_nodes": None,
+                    "batch": None,
+                    "queue_position": None,
+                    "estimated_start_time": None,
+                }
+            ],
+        }
+        self.assertEqual(expected_result, parsed_response)
+
+        response = self.client.get(
+            RESULTS_URL.format(self.test_project_id),
+            {"summary": True, "order_by": "-creation_time", "page_size": 1, "page": 2},
+        )
+        parsed_response = json.loads(response.content.decode("utf-8"))
+        self.assertEqual([1], [r["id"] for r in parsed_response["results"]])
+
+        response = self.client.get(
+            RESULTS_URL.format(self.test_project_id),
+            {"summary": True, "status": "queued,complete"},
+        )
+        parsed_response = json.loads(response.content.decode("utf-8"))
+        self.assertEqual(1, parsed_response["count"])
+        self.assertEqual([1], [r["id"] for r in parsed_response["results"]])
+
+        response = self.client.get(
+            RESULTS_URL.format(self.test_project_id),
+            {"summary": True, "skeleton_id": 2},
+        )
+        parsed_response = json.loads(response.content.decode("utf-8"))
+        self.assertEqual([2], [r["id"] for r in parsed_response["results"]])
+
+        response = self.client.get(
+            RESULTS_URL.format(self.test_project_id),
+            {"summary": True, "order_by": "skeleton_csv"},
+        )
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get(
+            RESULTS_URL.format(self.test_project_id), {"summary": True, "page": "last"},
+        )
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get(
+            RESULTS_URL.format(self.test_project_id),
+            {"summary": True, "skeleton_id": "abc"},
+        )
+        self.assertEqual(response.status_code, 400)
+
+        # Cached pages are refreshed when a result on them changes
+        query = {"summary": True, "order_by": "-creation_time", "page_size": 1}
+        self.client.get(RESULTS_URL.format(self.test_project_id), query)
+        AutoproofreaderResult.objects.filter(id=2).update(status="complete")
+        response = self.client.get(RESULTS_URL.format(self.test_project_id), query)
+        parsed_response = json.loads(response.content.decode("utf-8"))
+        self.assertEqual("complete", parsed_response["results"][0]["status"])
+        AutoproofreaderResult.objects.filter(id=2).update(status="computing")
+
+        # Undispatched jobs are listed with their place in the queue
+        AutoproofreaderResult.objects.filter(id=1).update(server_id=1)
+        response = self.client.get(
+            RESULTS_URL.format(self.test_project_id),
+            {"summary": True, "order_by": "id"},
+        )
+        parsed_response = json.loads(response.content.decode("utf-8"))
+        self.assertEqual(
+            [0, None], [r["queue_position"] for r in parsed_response["results"]]
+        )
+        self.assertIsNotNone(parsed_response["results"][0]["estimated_start_time"])
+
+    def test_get_detail(self):
+        self.fake_authentication()
+        assign_perm("can_browse", self.test_user, self.test_project)
+
+        response = self.client.get(RESULT_DETAIL_URL.format(self.test_project_id, 1))
+        self.assertEqual(response.status_code, 200)
+        parsed_response = json.loads(response.content.decode("utf-8"))
+        self.assertEqual("0,0,1,2,3", parsed_response["skeleton_csv"])
+        self.assertEqual("test_1", parsed_response["data"])
+        self.assertEqual("1 error", parsed_response["errors"])
+        self.assertIsNone(parsed_response["sample_mapping_csv"])
+
+        # The sample points of a resampled skeleton are sent along with it
+        AutoproofreaderResult.objects.filter(id=1).update(
+            sample_mapping_blob=Blob.store("1,1\n2,1\n")
+        )
+        response = self.client.get(RESULT_DETAIL_URL.format(self.test_project_id, 1))
+        parsed_response = json.loads(response.content.decode("utf-8"))
+        self.assertEqual("1,1\n2,1\n", parsed_response["sample_mapping_csv"])
+
+        # Private results of other users are not visible
+        response = self.client.get(RESULT_DETAIL_URL.format(self.test_project_id, 3))
+        self.assertEqual(response.status_code, 404)
+
     def test_get_uuid(self):
         self.fake_authentication()
         assign_perm("can_browse", self.test_user, self.test_project)
@@ -156,3 +319,21 @@ class ResultsTest(AutoproofreaderTestCase):
             0,
             json.loads(response.content.decode("utf-8")),
         )
+
+    def test_cancel(self):
+        self.fake_authentication()
+        assign_perm("can_queue_compute_task", self.test_user, self.test_project)
+
+        response = self.client.post(RESULT_CANCEL_URL.format(self.test_project_id, 1))
+        self.assertEqual(response.status_code, 200)
+        parsed_response = json.loads(response.content.decode("utf-8"))
+        self.assertEqual({"success": True, "status": "cancelled"}, parsed_response)
+        self.assertEqual(AutoproofreaderResult.objects.get(id=1).status, "cancelled")
+
+        # Finished jobs can't be cancelled
+        response = self.client.post(RESULT_CANCEL_URL.format(self.test_project_id, 1))
+        self.assertEqual(response.status_code, 400)
+
+        # Nor can jobs of other users
+        response = self.client.post(RESULT_CANCEL_URL.format(self.test_project_id, 3))
+        self.assertEqual(response.status_code, 404)
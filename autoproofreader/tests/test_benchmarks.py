@@ -0,0 +1,48 @@
+import shutil
+import tempfile
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from autoproofreader.benchmarks import (
+    FIRST_NODE_ID,
+    generate_skeleton,
+    write_fake_outputs,
+)
+from autoproofreader.control.autoproofreader import load_outputs, merge_scores
+
+StagedResult = namedtuple("StagedResult", ["staging_dir"])
+
+
+class BenchmarkTests(SimpleTestCase):
+    def setUp(self):
+        self.staging_dir = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(str(self.staging_dir))
+
+    def test_skeleton(self):
+        skeleton = generate_skeleton(5000, seed=1)
+        self.assertEqual(skeleton.node_ids[0], FIRST_NODE_ID)
+        self.assertEqual(skeleton.parents[0], -1)
+        # Parents come before their children and some nodes start branches
+        indices = np.arange(1, 5000)
+        self.assertTrue((skeleton.parents[1:] < indices).all())
+        self.assertGreater((skeleton.parents[1:] != indices - 1).sum(), 0)
+        self.assertTrue((np.bincount(skeleton.parents[1:], minlength=5000) > 1).any())
+
+    def test_outputs(self):
+        skeleton = generate_skeleton(100)
+        write_fake_outputs(skeleton, self.staging_dir)
+        outputs = self.staging_dir / "outputs"
+        self.assertTrue((outputs / "mesh.stl").read_text().startswith("solid"))
+        self.assertTrue((outputs / "segmentations.n5" / "attributes.json").exists())
+
+        nodes, rankings = load_outputs(StagedResult(self.staging_dir))
+        rows = merge_scores(nodes, rankings)
+        self.assertEqual(len(rows), 100)
+        self.assertEqual(rows[0][:2], (FIRST_NODE_ID, None))
+        self.assertIsNone(rows[0][-1])
+        self.assertEqual(rows[1][1], FIRST_NODE_ID)
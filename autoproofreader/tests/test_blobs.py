@@ -0,0 +1,45 @@
+from autoproofreader.models import AutoproofreaderResult, Blob, ConfigFile
+from autoproofreader.tests.common import AutoproofreaderTestCase
+
+
+class BlobTests(AutoproofreaderTestCase):
+    def test_store_and_release(self):
+        blob = Blob.store("1,,0,0,0\n2,1,1,1,1\n")
+        same = Blob.store(b"1,,0,0,0\n2,1,1,1,1\n")
+        self.assertEqual(blob.id, same.id)
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(blob.text, "1,,0,0,0\n2,1,1,1,1\n")
+        self.assertEqual(blob.size, 19)
+
+        Blob.release(blob.id)
+        self.assertTrue(Blob.objects.filter(id=blob.id).exists())
+        Blob.release(blob.id)
+        self.assertFalse(Blob.objects.filter(id=blob.id).exists())
+        # Releasing a deleted blob leaves nothing to do
+        Blob.release(blob.id)
+
+    def test_config_deduplication(self):
+        first = ConfigFile.for_content(3, 3, "[run]\nserver_id = 1\n")
+        second = ConfigFile.for_content(3, 3, "[run]\nserver_id = 1\n")
+        self.assertEqual(first.id, second.id)
+        self.assertEqual(second.content, "[run]\nserver_id = 1\n")
+
+        # Other projects get their own config file sharing the same blob
+        other = ConfigFile.for_content(3, 1, "[run]\nserver_id = 1\n")
+        self.assertNotEqual(first.id, other.id)
+        self.assertEqual(first.blob_id, other.blob_id)
+        self.assertEqual(Blob.objects.get(id=first.blob_id).ref_count, 2)
+
+        # So do other users, whose config files are deleted with them
+        user = ConfigFile.for_content(5, 3, "[run]\nserver_id = 1\n")
+        self.assertNotEqual(first.id, user.id)
+        self.assertEqual(first.blob_id, user.blob_id)
+        self.assertEqual(Blob.objects.get(id=first.blob_id).ref_count, 3)
+
+    def test_result_snapshot(self):
+        result = AutoproofreaderResult.objects.get(id=3)
+        self.assertEqual(result.skeleton_snapshot, "0,0,1,2,3")
+
+        result.delete()
+        self.assertFalse(Blob.objects.filter(id=1).exists())
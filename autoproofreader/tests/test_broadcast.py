@@ -0,0 +1,53 @@
+import threading
+
+from django.test import SimpleTestCase
+
+from autoproofreader.broadcast import ReviewBroadcaster
+
+
+class ReviewBroadcasterTests(SimpleTestCase):
+    def setUp(self):
+        self.sent = []
+        self.done = threading.Event()
+
+    def send(self, result_id, changes):
+        self.sent.append((result_id, changes))
+        self.done.set()
+
+    def test_coalesced(self):
+        broadcaster = ReviewBroadcaster(self.send)
+        broadcaster.add(1, 10, True, 3, delay=60)
+        broadcaster.add(1, 11, True, 3, delay=60)
+        broadcaster.add(2, 10, True, 4, delay=60)
+        # Only the last state of a node is sent
+        broadcaster.add(1, 10, False, 4, delay=60)
+        broadcaster.flush()
+        self.assertEqual(
+            self.sent, [(1, [(10, False, 4), (11, True, 3)]), (2, [(10, True, 4)])],
+        )
+        self.assertIsNone(broadcaster.timer)
+
+    def test_delay(self):
+        broadcaster = ReviewBroadcaster(self.send)
+        broadcaster.add(1, 10, True, 3, delay=0.05)
+        self.assertTrue(self.done.wait(10))
+        self.assertEqual(self.sent, [(1, [(10, True, 3)])])
+
+        # Later changes start a new batch
+        self.done.clear()
+        broadcaster.add(1, 10, False, 3, delay=0.05)
+        self.assertTrue(self.done.wait(10))
+        self.assertEqual(self.sent[1], (1, [(10, False, 3)]))
+
+    def test_failed_send(self):
+        def send(result_id, changes):
+            if result_id == 1:
+                raise ValueError("No channel layer")
+            self.send(result_id, changes)
+
+        broadcaster = ReviewBroadcaster(send)
+        broadcaster.add(1, 10, True, 3, delay=60)
+        broadcaster.add(2, 10, True, 3, delay=60)
+        with self.assertLogs("autoproofreader.broadcast", level="ERROR"):
+            broadcaster.flush()
+        self.assertEqual(self.sent, [(2, [(10, True, 3)])])
@@ -0,0 +1,46 @@
+from django.test import SimpleTestCase
+
+from autoproofreader.cache import ByteLRUCache
+
+
+class ByteLRUCacheTests(SimpleTestCase):
+    def test_eviction(self):
+        cache = ByteLRUCache(10)
+        cache.set(("a", 1), "aaaa")
+        cache.set(("b", 1), "bbbb")
+        # touch a so that b is the least recently used entry
+        self.assertEqual(cache.get(("a", 1)), "aaaa")
+        cache.set(("c", 1), "cccc")
+
+        self.assertIsNone(cache.get(("b", 1)))
+        self.assertEqual(cache.get(("a", 1)), "aaaa")
+        self.assertEqual(cache.get(("c", 1)), "cccc")
+
+        stats = cache.stats()
+        self.assertEqual(stats["size"], 8)
+        self.assertEqual(stats["hits"], 3)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["evictions"], 1)
+
+        # Values larger than the cache are never stored
+        cache.set(("d", 1), "d" * 11)
+        self.assertIsNone(cache.get(("d", 1)))
+        self.assertEqual(cache.stats()["entries"], 2)
+
+    def test_invalidation(self):
+        cache = ByteLRUCache(100)
+        cache.set(("a", 1), "a1", fingerprint=1)
+        cache.set(("a", 2), "a2")
+        cache.set(("b", 1), "b1")
+
+        # A different fingerprint means the entry is stale
+        self.assertIsNone(cache.get(("a", 1), fingerprint=2))
+        self.assertEqual(cache.stats()["invalidations"], 1)
+
+        cache.invalidate("a")
+        self.assertIsNone(cache.get(("a", 2)))
+        self.assertEqual(cache.get(("b", 1)), "b1")
+
+        cache.invalidate(owner=1)
+        self.assertIsNone(cache.get(("b", 1)))
+        self.assertEqual(cache.stats()["size"], 0)
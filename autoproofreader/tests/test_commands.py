@@ -1,7 +1,13 @@
 from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.apps import apps
+from django.db import connection
 from django.db.models import Q
 import datetime
+import json
+import os
+import tempfile
+from unittest import mock
 
 from autoproofreader.tests.common import AutoproofreaderTestCase
 from autoproofreader.models import AutoproofreaderResult
@@ -66,3 +72,32 @@ class CommandsTests(AutoproofreaderTestCase):
         self.assertEqual(
             len(AutoproofreaderResult.objects.filter(old & Q(permanent=False))), 0
         )
+
+    def test_benchmark(self):
+        n_results = AutoproofreaderResult.objects.count()
+        output, path = tempfile.mkstemp(suffix=".json")
+        os.close(output)
+        call_command(
+            "benchmark_autoproofreader",
+            "--project-id=3",
+            "--user-id=3",
+            "--skeleton-id=1",
+            "--sizes=50",
+            "--repeat=1",
+            "--output={}".format(path),
+        )
+        with open(path) as f:
+            report = json.load(f)
+        os.remove(path)
+
+        self.assertEqual(len(report["runs"]), 18)
+        stages = {(run["storage"], run["stage"]) for run in report["runs"]}
+        self.assertIn(("rows", "ingest"), stages)
+        self.assertIn(("arrays", "serialize"), stages)
+        # Nothing is left behind
+        self.assertEqual(AutoproofreaderResult.objects.count(), n_results)
+
+    def test_loadtest_database(self):
+        with mock.patch.dict(connection.settings_dict, {"NAME": "catmaid"}):
+            with self.assertRaises(CommandError):
+                call_command("loadtest_autoproofreader", "--project-id=3")
@@ -0,0 +1,152 @@
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from autoproofreader import comparison
+from autoproofreader.comparison import (
+    compare_nodes,
+    match_by_node_id,
+    match_by_position,
+    rank,
+    rank_correlation,
+)
+
+
+def make_columns(node_ids, positions, branch_scores, connectivity_scores=None):
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+    if connectivity_scores is None:
+        connectivity_scores = np.full(len(node_ids), np.nan)
+    return {
+        "node_id": np.asarray(node_ids, dtype=np.int64),
+        "x": positions[:, 0],
+        "y": positions[:, 1],
+        "z": positions[:, 2],
+        "branch_score": np.asarray(branch_scores, dtype=np.float64),
+        "connectivity_score": np.asarray(connectivity_scores, dtype=np.float64),
+    }
+
+
+class ComparisonTests(SimpleTestCase):
+    def test_match_by_node_id(self):
+        index_a, index_b = match_by_node_id(
+            np.array([5, 3, 9, 1]), np.array([1, 2, 3, 4, 5])
+        )
+        self.assertEqual(index_a.tolist(), [3, 1, 0])
+        self.assertEqual(index_b.tolist(), [0, 2, 4])
+
+    def test_match_by_position(self):
+        rng = np.random.RandomState(4)
+        positions_a = rng.uniform(0, 5000, (2000, 3))
+        positions_b = rng.uniform(-200, 5200, (1500, 3))
+        index_a, index_b, distances = match_by_position(positions_a, positions_b, 300)
+
+        # Same as comparing every pair of nodes
+        all_distances = np.linalg.norm(
+            positions_a[:, np.newaxis] - positions_b[np.newaxis], axis=2
+        )
+        expected_a = np.flatnonzero(all_distances.min(axis=1) <= 300)
+        self.assertEqual(index_a.tolist(), expected_a.tolist())
+        self.assertTrue(np.allclose(distances, all_distances[expected_a].min(axis=1)))
+        self.assertTrue(np.allclose(distances, all_distances[index_a, index_b]))
+
+        empty = match_by_position(positions_a, np.empty((0, 3)), 300)
+        self.assertEqual([len(e) for e in empty], [0, 0, 0])
+
+        # Chunks pairing too many nodes are split up
+        with mock.patch.object(comparison, "MAX_CANDIDATE_PAIRS", 50):
+            split = match_by_position(positions_a, positions_b, 300)
+        self.assertEqual(split[0].tolist(), index_a.tolist())
+        self.assertEqual(split[1].tolist(), index_b.tolist())
+
+        # A single node can't be paired with too many nodes
+        with mock.patch.object(comparison, "MAX_CANDIDATE_PAIRS", 2):
+            with self.assertRaises(ValueError):
+                match_by_position(np.zeros((1, 3)), np.zeros((3, 3)), 300)
+
+    def test_rank_correlation(self):
+        self.assertEqual(
+            rank(np.array([3.0, 1.0, 3.0, 2.0])).tolist(), [3.5, 1, 3.5, 2]
+        )
+        x = np.array([1.0, 2.0, 3.0, 4.0, 5.0])
+        self.assertAlmostEqual(rank_correlation(x, x ** 3), 1)
+        self.assertAlmostEqual(rank_correlation(x, -x), -1)
+        self.assertAlmostEqual(
+            rank_correlation(x, np.array([2.0, 1.0, 4.0, 3.0, 5.0])), 0.8
+        )
+        self.assertIsNone(rank_correlation(x, np.ones(5)))
+        self.assertIsNone(rank_correlation(x[:1], x[:1]))
+
+    def test_compare_node_ids(self):
+        positions = np.arange(15).reshape(5, 3)
+        a = make_columns(
+            [1, 2, 3, 4, 5],
+            positions,
+            [0.9, 0.8, 0.5, 0.2, 0.1],
+            [0.1, 0.2, np.nan, 0.4, 0.5],
+        )
+        b = make_columns(
+            [5, 4, 3, 2, 1],
+            positions[::-1],
+            [0.1, 0.6, 0.5, 0.3, 0.9],
+            [0.5, 0.4, 0.3, 0.2, 0.1],
+        )
+        comparison = compare_nodes(a, b, top_k=2)
+        self.assertEqual(comparison["match"], "node_id")
+        self.assertEqual(comparison["matched"], 5)
+        self.assertEqual(comparison["unmatched_a"], 0)
+        self.assertIsNone(comparison["mean_distance"])
+
+        branch = comparison["scores"]["branch_score"]
+        self.assertEqual(branch["compared"], 5)
+        self.assertAlmostEqual(branch["mean_delta"], -0.02)
+        self.assertAlmostEqual(branch["max_abs_delta"], 0.5)
+        # Nodes without a connectivity score are left out
+        self.assertEqual(comparison["scores"]["connectivity_score"]["compared"], 4)
+        self.assertAlmostEqual(
+            comparison["scores"]["connectivity_score"]["rank_correlation"], 1
+        )
+
+        disagreements = comparison["disagreements"]
+        self.assertEqual([d["node_id_a"] for d in disagreements], [2, 4])
+        self.assertAlmostEqual(disagreements[0]["delta"], -0.5)
+        self.assertEqual(disagreements[0]["review_order_a"], 2)
+        self.assertEqual(disagreements[0]["review_order_b"], 4)
+        self.assertEqual(
+            [disagreements[0][axis] for axis in ("x", "y", "z")], [3, 4, 5]
+        )
+
+    def test_compare_positions(self):
+        # b was resampled, its nodes sit between those of a
+        a = make_columns(
+            [1, 2, 3, 4],
+            [[0, 0, 0], [100, 0, 0], [200, 0, 0], [5000, 0, 0]],
+            [0.1, 0.2, 0.3, 0.4],
+        )
+        b = make_columns([10, 20], [[40, 0, 0], [180, 0, 0]], [0.5, 0.2])
+        comparison = compare_nodes(a, b, max_distance=100)
+        self.assertEqual(comparison["match"], "position")
+        self.assertEqual(comparison["matched"], 3)
+        self.assertEqual(comparison["unmatched_a"], 1)
+        self.assertEqual(comparison["unmatched_b"], 0)
+        self.assertAlmostEqual(comparison["mean_distance"], (40 + 60 + 20) / 3)
+        self.assertEqual(
+            [(d["node_id_a"], d["node_id_b"]) for d in comparison["disagreements"]],
+            [(1, 10), (2, 10), (3, 20)],
+        )
+
+        forced = compare_nodes(a, b, match="node_id")
+        self.assertEqual(forced["matched"], 0)
+        self.assertEqual(forced["disagreements"], [])
+        self.assertIsNone(forced["scores"]["branch_score"]["mean_delta"])
+
+    def test_invalid(self):
+        a = make_columns([1], [0, 0, 0], [0.5])
+        with self.assertRaises(ValueError):
+            compare_nodes(a, a, match="nearest")
+        with self.assertRaises(ValueError):
+            compare_nodes(a, a, score="segment_score")
+        with self.assertRaises(ValueError):
+            compare_nodes(a, a, max_distance=0)
+        with self.assertRaises(ValueError):
+            compare_nodes(a, a, max_distance=1e9)
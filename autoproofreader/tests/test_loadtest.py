@@ -0,0 +1,82 @@
+import os
+import shutil
+import subprocess
+import tempfile
+from pathlib import Path
+
+from django.test import SimpleTestCase
+
+from autoproofreader.benchmarks import generate_skeleton, write_skeleton_csv
+from autoproofreader.loadtest import LoadStats, write_fake_compute_server
+
+
+class LoadTestTests(SimpleTestCase):
+    def setUp(self):
+        self.work_dir = Path(tempfile.mkdtemp())
+        bin_dir = write_fake_compute_server(self.work_dir, compute_delay=0)
+        self.env = dict(
+            os.environ, PATH="{}{}{}".format(bin_dir, os.pathsep, os.environ["PATH"])
+        )
+
+    def tearDown(self):
+        shutil.rmtree(str(self.work_dir))
+
+    def run_script(self, script):
+        return subprocess.run(
+            "/bin/bash",
+            input=script,
+            stdout=subprocess.PIPE,
+            encoding="utf8",
+            env=self.env,
+            check=True,
+        ).stdout
+
+    def test_fake_compute_server(self):
+        local = self.work_dir / "local" / "job_a"
+        local.mkdir(parents=True)
+        write_skeleton_csv(generate_skeleton(50), local / "skeleton.csv")
+        (local / "sarbor_config.toml").write_text("")
+
+        out = self.run_script(
+            "scp -i key -pr {} guest@fake:results/job_a\n".format(local)
+            + "ssh -i key guest@fake\n"
+            + "source env.sh\n"
+            + "sarbor-error-detector --skeleton-csv ~/results/job_a/skeleton.csv "
+            + "--sarbor-config ~/results/job_a/sarbor_config.toml "
+            + "--output-file results/job_a/outputs cached-lsd\n"
+            + "ls results/job_a/outputs"
+        )
+        self.assertEqual(
+            out.split(),
+            ["mesh.stl", "nodes.obj", "partial", "rankings.obj", "segmentations.n5"],
+        )
+
+        # Copying outputs back replaces those of an earlier attempt
+        for _ in range(2):
+            self.run_script(
+                "scp -i key -r guest@fake:results/job_a/* {}\n".format(local)
+            )
+        self.assertTrue((local / "outputs" / "nodes.obj").exists())
+
+    def test_fake_nvidia_smi(self):
+        out = self.run_script(
+            "ssh -o BatchMode=yes -i key guest@fake\n"
+            + "nvidia-smi --query-gpu=index --format=csv,noheader,nounits"
+        )
+        self.assertEqual(len(out.strip().split("\n")), 2)
+        self.assertEqual(len(out.split("\n")[0].split(", ")), 9)
+
+    def test_stats(self):
+        stats = LoadStats()
+        for i in range(100):
+            stats.record("nodes", (i + 1) / 1000, 200, 3)
+        stats.record("submit", 0.5, 400, 10)
+        summary = stats.summary(10)
+        self.assertEqual(list(summary.keys()), ["nodes", "submit"])
+        self.assertEqual(summary["nodes"]["requests"], 100)
+        self.assertEqual(summary["nodes"]["errors"], 0)
+        self.assertAlmostEqual(summary["nodes"]["throughput"], 10)
+        self.assertAlmostEqual(summary["nodes"]["p50_ms"], 50.5)
+        self.assertAlmostEqual(summary["nodes"]["p99_ms"], 99.01)
+        self.assertEqual(summary["submit"]["errors"], 1)
+        self.assertEqual(summary["submit"]["max_queries"], 10)
@@ -0,0 +1,60 @@
+import threading
+import time
+
+from django.test import SimpleTestCase
+
+from autoproofreader.monitoring import BackgroundCache, Histogram, format_labels
+
+
+class MonitoringTests(SimpleTestCase):
+    def test_histogram(self):
+        histogram = Histogram("latency_seconds", "Latency.", ("endpoint",), (0.1, 1))
+        for value in (0.05, 0.1, 0.5, 5):
+            histogram.observe(("results",), value)
+        histogram.observe(("nodes",), 0.5)
+
+        lines = histogram.render().split("\n")
+        self.assertEqual(
+            lines[:2],
+            ["# HELP latency_seconds Latency.", "# TYPE latency_seconds histogram"],
+        )
+        self.assertEqual(
+            lines[7:],
+            [
+                'latency_seconds_bucket{endpoint="results",le="0.1"} 2',
+                'latency_seconds_bucket{endpoint="results",le="1"} 3',
+                'latency_seconds_bucket{endpoint="results",le="+Inf"} 4',
+                'latency_seconds_sum{endpoint="results"} 5.65',
+                'latency_seconds_count{endpoint="results"} 4',
+            ],
+        )
+        self.assertEqual(lines[3], 'latency_seconds_bucket{endpoint="nodes",le="1"} 1')
+
+    def test_labels(self):
+        self.assertEqual(format_labels({}), "")
+        self.assertEqual(
+            format_labels({"server": 'a "b"\\c'}), '{server="a \\"b\\"\\\\c"}'
+        )
+
+    def test_background_cache(self):
+        started, done = threading.Event(), threading.Event()
+        values = iter([["first"], ["second"]])
+
+        def compute():
+            started.set()
+            done.wait(5)
+            return next(values)
+
+        with self.settings(AUTOPROOFREADER_MONITORING_SLOW_TTL=0):
+            cache = BackgroundCache(
+                compute, "AUTOPROOFREADER_MONITORING_SLOW_TTL", 300, empty=[]
+            )
+            # Callers don't wait for the value to be computed
+            self.assertEqual(cache.get(), [])
+            self.assertTrue(started.wait(5))
+            self.assertEqual(cache.get(), [])
+            done.set()
+            while cache._refreshing:
+                time.sleep(0.01)
+            # The last value is served while the next one is computed
+            self.assertEqual(cache.get(), ["first"])
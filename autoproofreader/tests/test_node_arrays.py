@@ -0,0 +1,49 @@
+import json
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from autoproofreader.node_arrays import NO_PARENT, encode_node_columns
+
+
+class NodeArraysTests(SimpleTestCase):
+    def test_encode_node_columns(self):
+        rng = np.random.RandomState(3)
+        n = 50
+        columns = {
+            "node_id": rng.randint(0, 10 ** 12, n).astype(np.int64),
+            "parent_id": np.where(
+                rng.rand(n) < 0.2, NO_PARENT, rng.randint(0, 10 ** 6, n)
+            ).astype(np.int64),
+            "x": (rng.randn(n) * 1e6).astype(np.float32),
+            "branch_score": rng.rand(n).astype(np.float32),
+            "connectivity_score": np.where(rng.rand(n) < 0.3, np.nan, rng.rand(n)),
+            "reviewed": rng.rand(n) < 0.5,
+            "creation_time": np.asarray(
+                ["2019-01-0{}T00:00:00Z".format(i % 9 + 1) for i in range(n)]
+            ),
+            "id": None,
+            "result": 4,
+            "project": "{project}",
+        }
+
+        nodes = []
+        for i in range(n):
+            node = {}
+            for name, values in columns.items():
+                if not isinstance(values, np.ndarray):
+                    node[name] = values
+                    continue
+                value = values[i].item()
+                if name == "parent_id" and value == NO_PARENT:
+                    value = None
+                elif value != value:
+                    value = None
+                node[name] = value
+            nodes.append(node)
+        self.assertEqual(
+            encode_node_columns(columns), json.dumps(nodes, sort_keys=True, indent=4)
+        )
+
+        empty = {name: np.empty(0) for name in ("node_id", "x")}
+        self.assertEqual(encode_node_columns(empty), "[]")
@@ -0,0 +1,132 @@
+import shutil
+import tempfile
+from pathlib import Path
+
+from django.test import SimpleTestCase
+
+from autoproofreader.control.autoproofreader import get_exit_error, get_job_limits
+from autoproofreader.transports import PROCESS_MARKER, LocalTransport, SSHTransport
+
+
+class PackingTests(SimpleTestCase):
+    def setUp(self):
+        self.media = Path(tempfile.mkdtemp())
+        self.contexts = []
+        for job_name in ("job_a", "job_b"):
+            local_temp_dir = self.media / job_name
+            local_temp_dir.mkdir()
+            for f in ("skeleton.csv", "sarbor_config.toml", "cached_lsd_config.toml"):
+                (local_temp_dir / f).write_text("")
+            self.contexts.append(
+                {
+                    "server": {
+                        "address": "gpu.example.org",
+                        "results_dir": "results",
+                        "env_source": "env/bin/activate",
+                    },
+                    "ssh_key": "key",
+                    "ssh_user": "guest",
+                    "job_name": job_name,
+                    "job_type": "cached_lsd",
+                    "local_temp_dir": local_temp_dir,
+                    "result_id": len(self.contexts) + 1,
+                    "time_limit": None,
+                    "memory_limit": None,
+                }
+            )
+
+        self.transport = SSHTransport()
+
+    def tearDown(self):
+        shutil.rmtree(str(self.media))
+
+    def test_pack_commands(self):
+        setup = self.transport.stage_in_command(self.contexts)
+        self.assertEqual(setup.count("scp"), 1)
+        self.assertTrue(setup.endswith("guest@gpu.example.org:results"))
+
+        compute = self.transport.compute_command(self.contexts)
+        self.assertEqual(compute.count("ssh "), 1)
+        self.assertEqual(compute.count("source "), 1)
+        self.assertEqual(compute.count("sarbor-error-detector"), 2)
+        self.assertIn("results/job_b/outputs", compute)
+
+        fetch = self.transport.stage_out_command(self.contexts)
+        self.assertEqual(fetch.count("scp"), 1)
+        self.assertIn("guest@gpu.example.org:results/job_a ", fetch)
+        self.assertTrue(fetch.strip().endswith(str(self.media)))
+
+    def test_single_job_commands(self):
+        setup = self.transport.stage_in_command(self.contexts[:1])
+        self.assertTrue(setup.endswith("guest@gpu.example.org:results/job_a"))
+        fetch = self.transport.stage_out_command(self.contexts[:1])
+        self.assertIn("guest@gpu.example.org:results/job_a/* ", fetch)
+
+    def test_process_groups(self):
+        self.contexts[1]["time_limit"] = 3600
+        self.contexts[1]["memory_limit"] = 2 * 1024 ** 3
+        compute = self.transport.compute_command(self.contexts)
+        self.assertEqual(compute.count("setsid bash -c"), 2)
+        self.assertIn('echo "{} pid 1 $$"'.format(PROCESS_MARKER), compute)
+        self.assertIn('echo "{} exit 2 $?"'.format(PROCESS_MARKER), compute)
+        self.assertIn("ulimit -v 2097152; timeout --kill-after=60 3600 sarbor", compute)
+
+        self.assertIsNone(get_exit_error(self.contexts[1], 0))
+        self.assertEqual(
+            get_exit_error(self.contexts[1], 124),
+            "Exceeded the time limit of 3600 seconds",
+        )
+        self.assertEqual(
+            get_exit_error(self.contexts[0], 1),
+            "sarbor-error-detector exited with status 1",
+        )
+
+    def test_job_limits(self):
+        with self.settings(AUTOPROOFREADER_JOB_TIME_LIMIT=600):
+            self.assertEqual(
+                get_job_limits({"memory_limit": "1024"}),
+                {"time_limit": 600, "memory_limit": 1024},
+            )
+        self.assertEqual(
+            get_job_limits({"time_limit": 60.0}),
+            {"time_limit": 60, "memory_limit": None},
+        )
+        # Limits end up in shell commands
+        for limit in ("60; rm -rf ~", 0, -5, 1.5, True, [60]):
+            with self.assertRaises(ValueError):
+                get_job_limits({"time_limit": limit})
+
+    def test_local_commands(self):
+        transport = LocalTransport()
+        self.assertFalse(transport.copies_files)
+        compute = transport.compute_command(self.contexts)
+        self.assertNotIn("ssh ", compute)
+        self.assertEqual(compute.count("source env/bin/activate"), 1)
+        # sarbor reads and writes the job directories in MEDIA_ROOT
+        self.assertIn(
+            "--skeleton-csv {}".format(self.media / "job_b" / "skeleton.csv"), compute
+        )
+        self.assertIn(
+            "--output-file {}".format(self.media / "job_b" / "outputs"), compute
+        )
+        self.assertIn('echo "{} exit 2 $?"'.format(PROCESS_MARKER), compute)
+
+        cleanup = transport.cleanup_command(self.contexts)
+        self.assertNotIn("ssh ", cleanup)
+        self.assertIn(str(self.media / "job_a"), cleanup)
+        self.assertEqual(
+            transport.kill_command(self.contexts[0], 123), "kill -TERM -- -123"
+        )
+
+    def test_worker_commands(self):
+        for context in self.contexts:
+            context["server"]["worker_socket"] = "~/.sarbor-worker.sock"
+        compute = self.transport.compute_command(self.contexts)
+        self.assertEqual(
+            compute.count(
+                "sarbor-worker --socket ~/.sarbor-worker.sock run sarbor-error-detector "
+            ),
+            2,
+        )
+        compute = LocalTransport().compute_command(self.contexts)
+        self.assertIn("sarbor-worker --socket ~/.sarbor-worker.sock run ", compute)
@@ -0,0 +1,62 @@
+import shutil
+import tempfile
+import time
+
+from django.test import SimpleTestCase, override_settings
+
+from autoproofreader.profiling import (
+    list_profiles,
+    profile_name,
+    profile_path,
+    profiling,
+)
+
+
+def busy_wait(seconds):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        pass
+
+
+class ProfilingTests(SimpleTestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.settings = override_settings(
+            MEDIA_ROOT=self.media,
+            AUTOPROOFREADER_PROFILE_INTERVAL=0.001,
+            AUTOPROOFREADER_PROFILE_MAX_FILES=2,
+        )
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.media)
+
+    def test_disabled(self):
+        with profiling(False, [profile_name("request", "test")]):
+            busy_wait(0.01)
+        self.assertEqual(list_profiles(), [])
+
+    def test_profile(self):
+        name = profile_name("request", "Some API")
+        self.assertTrue(name.startswith("request-Some_API-"))
+        with profiling(True, [name]):
+            busy_wait(0.05)
+
+        path = profile_path(name)
+        lines = path.read_text().strip().split("\n")
+        self.assertTrue(lines[0].startswith("# "))
+        # The busiest stack comes first and ends in the profiled function
+        stack, count = lines[1].rsplit(" ", 1)
+        self.assertIn("busy_wait", stack.split(";")[-1])
+        self.assertGreater(int(count), 0)
+        self.assertIsNone(profile_path("../" + name))
+
+    def test_bounded(self):
+        for i in range(3):
+            with profiling(True, [profile_name("result", i)]):
+                busy_wait(0.005)
+            time.sleep(0.01)
+        names = [p["name"] for p in list_profiles()]
+        self.assertEqual(len(names), 2)
+        self.assertTrue(names[0].startswith("result-2-"))
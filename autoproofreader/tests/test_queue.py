@@ -0,0 +1,99 @@
+import shutil
+import tempfile
+
+from autoproofreader.control.autoproofreader import (
+    dispatch_jobs,
+    get_queue,
+    get_queue_estimates,
+)
+from autoproofreader.models import AutoproofreaderResult, ComputeServer
+from autoproofreader.tests.common import AutoproofreaderTestCase
+
+
+class QueueTests(AutoproofreaderTestCase):
+    def create_job(self, name, user_id, priority=1, task_id=None, model_id=1):
+        return AutoproofreaderResult.objects.create(
+            user_id=user_id,
+            project_id=3,
+            name=name,
+            status="queued",
+            config_id=1,
+            skeleton_id=1,
+            model_id=model_id,
+            server_id=1,
+            priority=priority,
+            task_id=task_id,
+            errors="",
+        )
+
+    def test_fair_share(self):
+        self.create_job("running", 3, task_id="task")
+        first = self.create_job("first", 3)
+        second = self.create_job("second", 3)
+        other = self.create_job("other", 5)
+        urgent = self.create_job("urgent", 3, priority=2)
+
+        queue, n_tasks = get_queue(1)
+        self.assertEqual(n_tasks, 1)
+        # High priority jobs go first, then users with fewer jobs ahead
+        self.assertEqual(
+            [r.id for r in queue], [urgent.id, other.id, first.id, second.id]
+        )
+
+    def test_estimates(self):
+        server = ComputeServer.objects.get(id=1)
+        server.max_concurrent_jobs = 2
+        server.save()
+        self.create_job("running", 3, task_id="task")
+        first = self.create_job("first", 3)
+        second = self.create_job("second", 5)
+
+        estimates = get_queue_estimates(server)
+        self.assertEqual(estimates[first.id][0], 1)
+        self.assertEqual(estimates[second.id][0], 0)
+        # One free slot, the second job in line waits for a running one
+        self.assertLess(estimates[second.id][1], estimates[first.id][1])
+
+    def test_packing(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        with self.settings(MEDIA_ROOT=media):
+            jobs = [self.create_job("job_{}".format(i), 3) for i in range(5)]
+            other_model = self.create_job("other_model", 5, model_id=2)
+            for job in jobs + [other_model]:
+                job.staging_dir.mkdir()
+                (job.staging_dir / "skeleton.csv").write_text("1,,0,0,0\n")
+
+            # Small jobs of the same model share a task, even without a batch
+            dispatch_jobs(1)
+            tasks = [
+                AutoproofreaderResult.objects.get(id=job.id).task_id
+                for job in jobs + [other_model]
+            ]
+            self.assertIsNotNone(tasks[0])
+            self.assertEqual(tasks[:4], [tasks[0]] * 4)
+            self.assertEqual(tasks[4:], [None, None])
+
+    def test_unstaged_jobs(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        with self.settings(MEDIA_ROOT=media):
+            missing = self.create_job("missing", 3)
+            job = self.create_job("job", 3)
+            job.staging_dir.mkdir()
+            (job.staging_dir / "skeleton.csv").write_text("1,,0,0,0\n")
+
+            # A job without its files fails, the queue moves on
+            dispatch_jobs(1)
+            missing.refresh_from_db()
+            self.assertEqual(missing.status, "failed")
+            self.assertIn("skeleton.csv", missing.errors)
+            self.assertIsNotNone(AutoproofreaderResult.objects.get(id=job.id).task_id)
+
+    def test_dispatch_without_server(self):
+        # Jobs of deleted servers are left alone
+        dispatch_jobs(None)
+        dispatch_jobs(1000)
+        self.assertFalse(
+            AutoproofreaderResult.objects.filter(task_id__isnull=False).exists()
+        )
@@ -0,0 +1,85 @@
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from autoproofreader.benchmarks import generate_skeleton, write_skeleton_csv
+from autoproofreader.resampling import (
+    path_lengths,
+    read_skeleton_csv,
+    resample,
+    resample_skeleton_csv,
+)
+
+
+class ResamplingTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(str(self.directory))
+
+    def test_line(self):
+        # Eleven nodes 10 nm apart, from the root to a leaf
+        parents = np.arange(-1, 10)
+        positions = np.zeros((11, 3))
+        positions[:, 0] = np.arange(11) * 10
+        mapping, samples, sample_parents, sample_positions = resample(
+            parents, positions, 25
+        )
+        self.assertEqual(mapping.tolist(), [0, 1, 1, 3, 3, 5, 5, 5, 8, 8, 10])
+        self.assertEqual(samples.tolist(), [0, 1, 3, 5, 8, 10])
+        self.assertEqual(sample_parents.tolist(), [-1, 0, 1, 3, 5, 8])
+        self.assertEqual(sample_positions[:, 0].tolist(), [0, 15, 35, 60, 85, 100])
+
+    def test_skeleton(self):
+        skeleton = generate_skeleton(5000, seed=3)
+        lengths = path_lengths(skeleton.parents, skeleton.positions)
+        mapping, samples, sample_parents, _ = resample(
+            skeleton.parents, skeleton.positions, 400
+        )
+        self.assertLess(len(samples), 5000 / 3)
+
+        # Roots, branch points and leaves are kept
+        n_children = np.bincount(skeleton.parents[1:], minlength=5000)
+        key = np.flatnonzero(n_children != 1)
+        self.assertTrue(np.all(mapping[key] == key))
+        self.assertEqual(mapping[0], 0)
+
+        # Nodes are mapped to a sample point at or above them, close by
+        self.assertTrue(np.all(lengths[mapping] <= lengths))
+        self.assertTrue(np.all(lengths - lengths[mapping] < 400))
+        # Samples form a tree along the skeleton
+        self.assertEqual(np.sum(sample_parents < 0), 1)
+        has_parent = sample_parents >= 0
+        self.assertTrue(
+            np.all(lengths[sample_parents[has_parent]] < lengths[samples[has_parent]])
+        )
+
+    def test_csv(self):
+        skeleton = generate_skeleton(1000)
+        path = self.directory / "skeleton.csv"
+        write_skeleton_csv(skeleton, path)
+        rows = resample_skeleton_csv(path, 300).split()
+        self.assertEqual(len(rows), 1000)
+
+        node_ids, parents, _ = read_skeleton_csv(path)
+        sample_ids = {int(row.split(",")[1]) for row in rows}
+        self.assertEqual(sorted(sample_ids), node_ids.tolist())
+        # Sample points are real treenodes of the skeleton
+        self.assertTrue(sample_ids <= set(skeleton.node_ids.tolist()))
+        self.assertEqual(np.sum(parents < 0), 1)
+
+    def test_invalid(self):
+        path = self.directory / "skeleton.csv"
+        path.write_text("1,2,0,0,0\n2,1,1,0,0\n")
+        with self.assertRaises(ValueError):
+            resample_skeleton_csv(path, 100)
+        path.write_text("1,1,0,0,0\n2,3,1,0,0\n")
+        with self.assertRaises(ValueError):
+            resample_skeleton_csv(path, 100)
+        path.write_text("1,,0,0,0\n2,1,1,0,0\n")
+        with self.assertRaises(ValueError):
+            resample_skeleton_csv(path, 0)
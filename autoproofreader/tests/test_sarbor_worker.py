@@ -0,0 +1,140 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from django.test import SimpleTestCase
+
+from autoproofreader import sarbor_worker
+
+LOADED = []
+
+
+def load_model(path):
+    LOADED.append(path)
+    return {"path": path}
+
+
+class SarborWorkerTests(SimpleTestCase):
+    def setUp(self):
+        self.work_dir = Path(tempfile.mkdtemp())
+        self.socket = str(self.work_dir / "worker.sock")
+        self.start_daemon("--preload", "--command", "json-tool=json.tool:main")
+
+    def start_daemon(self, *args, **kwargs):
+        self.daemon = subprocess.Popen(
+            self.worker("serve", *args),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            **kwargs
+        )
+        for _ in range(100):
+            if Path(self.socket).exists():
+                break
+            time.sleep(0.05)
+
+    def tearDown(self):
+        self.daemon.kill()
+        self.daemon.wait()
+        shutil.rmtree(str(self.work_dir))
+
+    def worker(self, *args):
+        return [sys.executable, sarbor_worker.__file__, "--socket", self.socket] + list(
+            args
+        )
+
+    def test_run(self):
+        (self.work_dir / "job.json").write_text('{"b": 1, "a": 2}')
+        job = subprocess.run(
+            self.worker("run", "json-tool", "--sort-keys", "job.json"),
+            cwd=str(self.work_dir),
+            stdout=subprocess.PIPE,
+            timeout=30,
+        )
+        self.assertEqual(job.returncode, 0)
+        self.assertEqual(
+            job.stdout.decode().split(), ["{", '"a":', "2,", '"b":', "1", "}"]
+        )
+
+        # Exit statuses of failing jobs are passed on
+        job = subprocess.run(
+            self.worker("run", "json-tool", "missing.json"),
+            cwd=str(self.work_dir),
+            stderr=subprocess.PIPE,
+            timeout=30,
+        )
+        self.assertEqual(job.returncode, 2)
+        self.assertIn(b"missing.json", job.stderr)
+
+    def test_unknown_command(self):
+        job = subprocess.run(
+            self.worker("run", "sarbor-error-detector"),
+            stderr=subprocess.PIPE,
+            timeout=30,
+        )
+        self.assertEqual(job.returncode, 1)
+        self.assertIn(b"sarbor-worker:", job.stderr)
+
+    def test_without_daemon(self):
+        self.daemon.kill()
+        self.daemon.wait()
+        Path(self.socket).unlink()
+        job = subprocess.run(self.worker("run", "sh", "-c", "exit 3"), timeout=30)
+        self.assertEqual(job.returncode, 3)
+
+    def test_resident_models(self):
+        # Like sarbor, the job imports the loader by name when it is preloaded
+        (self.work_dir / "fake_loader.py").write_text(
+            "import os\n\ndef load(path):\n    return os.getpid()\n"
+        )
+        (self.work_dir / "fake_sarbor.py").write_text(
+            "import sys\n"
+            "from fake_loader import load\n\n"
+            "def main():\n"
+            "    print(load(sys.argv[sys.argv.index('--model-weights-file') + 1]))\n"
+        )
+        self.daemon.kill()
+        self.daemon.wait()
+        Path(self.socket).unlink()
+        env = dict(os.environ, PYTHONPATH=str(self.work_dir))
+        self.start_daemon(
+            "--preload",
+            "fake_sarbor",
+            "--command",
+            "fake-sarbor=fake_sarbor:main",
+            "--model-loader",
+            "fake_loader:load",
+            env=env,
+        )
+        job = subprocess.run(
+            self.worker("run", "fake-sarbor", "--model-weights-file", "model.h5"),
+            cwd=str(self.work_dir),
+            stdout=subprocess.PIPE,
+            env=env,
+            timeout=30,
+        )
+        self.assertEqual(job.returncode, 0)
+        # The model was loaded by the daemon, not by the job
+        self.assertEqual(int(job.stdout), self.daemon.pid)
+
+    def test_model_cache(self):
+        del LOADED[:]
+        cache = sarbor_worker.ModelCache(__name__ + ":load_model", max_models=1)
+        try:
+            cache.load("/models/a")
+            cache.load("/models/a")
+            self.assertEqual(LOADED, ["/models/a"])
+            # Jobs get the resident model instead of loading it again
+            self.assertEqual(load_model("/models/a"), {"path": "/models/a"})
+            self.assertEqual(LOADED, ["/models/a"])
+
+            cache.load("/models/b")
+            self.assertEqual(list(cache.models), ["/models/b"])
+            load_model("/models/a")
+            self.assertEqual(LOADED, ["/models/a", "/models/b", "/models/a"])
+        finally:
+            globals()["load_model"] = cache.loader
@@ -0,0 +1,114 @@
+import pickle
+import shutil
+import tempfile
+
+from autoproofreader.benchmarks import generate_skeleton, write_fake_outputs
+from autoproofreader.control.autoproofreader import (
+    TransientJobError,
+    ingest_partial,
+    ingest_scores,
+    run_pack_stage,
+)
+from autoproofreader.metrics import JobMetrics
+from autoproofreader.models import (
+    AutoproofreaderResult,
+    JobStageMetric,
+    ProofreadTreeNodes,
+)
+from autoproofreader.tests.common import AutoproofreaderTestCase
+
+
+class StageTests(AutoproofreaderTestCase):
+    def test_pack_stage(self):
+        results = list(AutoproofreaderResult.objects.filter(id__in=[1, 2]))
+        results[0].completed_stages = ["stage_in"]
+        results[0].save()
+        contexts = [{"result_id": result.id} for result in results]
+        metrics = JobMetrics(results)
+        commands = []
+
+        def command(pending):
+            commands.append([c["result_id"] for c in pending])
+            return "true"
+
+        # Only jobs that did not complete the stage yet run it
+        run_pack_stage(
+            results, contexts, "stage_in", command, metrics, transferred=lambda r: 10
+        )
+        self.assertEqual(commands, [[2]])
+        self.assertEqual(
+            AutoproofreaderResult.objects.get(id=2).completed_stages, ["stage_in"]
+        )
+
+        run_pack_stage(results, contexts, "stage_in", command, metrics)
+        self.assertEqual(commands, [[2]])
+
+        # Every stage run is measured once
+        metric = JobStageMetric.objects.get(stage="stage_in")
+        self.assertEqual(metric.result_id, 2)
+        self.assertEqual(metric.bytes_transferred, 10)
+        self.assertGreaterEqual(metric.wall_time, 0)
+        self.assertGreater(metric.peak_rss, 0)
+
+        # Failed commands are retried later and leave the stage incomplete
+        with self.assertRaises(TransientJobError):
+            run_pack_stage(
+                results, contexts, "stage_out", lambda pending: "exit 1", metrics
+            )
+        self.assertEqual(
+            AutoproofreaderResult.objects.get(id=1).completed_stages, ["stage_in"]
+        )
+
+    def test_partial_ingest(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        with self.settings(MEDIA_ROOT=media, AUTOPROOFREADER_NODE_STORAGE="rows"):
+            result = AutoproofreaderResult.objects.get(id=2)
+            write_fake_outputs(generate_skeleton(30), result.staging_dir)
+            outputs = result.staging_dir / "outputs"
+            with (outputs / "nodes.obj").open("rb") as f:
+                nodes = pickle.load(f)
+            with (outputs / "rankings.obj").open("rb") as f:
+                rankings = pickle.load(f)
+            partial = outputs / "partial"
+            partial.mkdir()
+
+            def write_chunk(i, start, end):
+                with (partial / "chunk_{}.obj".format(i)).open("wb") as f:
+                    pickle.dump((nodes[start:end], rankings[start:end]), f)
+
+            write_chunk(0, 0, 10)
+            write_chunk(1, 10, 15)
+            self.assertEqual(ingest_partial(result, 0), 2)
+            result.refresh_from_db()
+            self.assertEqual(result.status, "partial")
+            self.assertEqual(result.partial_nodes, 15)
+
+            # Later chunks are appended, chunks are ordered by their number
+            write_chunk(10, 20, 30)
+            write_chunk(2, 15, 20)
+            self.assertEqual(ingest_partial(result, 2), 4)
+            result.refresh_from_db()
+            self.assertEqual(result.partial_nodes, 30)
+            self.assertEqual(
+                ProofreadTreeNodes.objects.filter(result=result).count(), 30
+            )
+
+            # A retried job starts over
+            self.assertEqual(ingest_partial(result, 0), 4)
+            self.assertEqual(
+                ProofreadTreeNodes.objects.filter(result=result).count(), 30
+            )
+
+            # The complete nodes replace the partial ones
+            self.assertEqual(ingest_scores(result), 30)
+            self.assertEqual(
+                ProofreadTreeNodes.objects.filter(result=result).count(), 30
+            )
+
+            # Jobs that are done are left alone
+            result.status = "cancelled"
+            result.save()
+            self.assertEqual(ingest_partial(result, 3), 3)
+            result.refresh_from_db()
+            self.assertEqual(result.status, "cancelled")
@@ -0,0 +1,34 @@
+import numpy as np
+from django.test import SimpleTestCase
+
+from autoproofreader.summaries import summarize_nodes, summarize_scores
+
+
+class SummaryTests(SimpleTestCase):
+    def test_summarize_scores(self):
+        summary = summarize_scores(np.arange(101, dtype=np.float64), bins=4)
+        self.assertEqual(summary["count"], 101)
+        self.assertEqual(
+            [summary["min"], summary["max"], summary["mean"]], [0, 100, 50]
+        )
+        self.assertEqual(
+            summary["quantiles"],
+            {"5": 5.0, "25": 25.0, "50": 50.0, "75": 75.0, "95": 95.0},
+        )
+        self.assertEqual(summary["histogram"]["edges"], [0, 25, 50, 75, 100])
+        self.assertEqual(summary["histogram"]["counts"], [25, 25, 25, 26])
+
+    def test_missing_scores(self):
+        summaries = summarize_nodes(
+            {
+                "branch_score": np.array([0.5, 0.5]),
+                "connectivity_score": np.array([np.nan, np.nan]),
+            }
+        )
+        branch = summaries["branch_score"]
+        self.assertEqual(branch["count"], 2)
+        self.assertEqual(sum(branch["histogram"]["counts"]), 2)
+        connectivity = summaries["connectivity_score"]
+        self.assertEqual(connectivity["count"], 0)
+        self.assertIsNone(connectivity["max"])
+        self.assertEqual(connectivity["histogram"]["counts"], [])
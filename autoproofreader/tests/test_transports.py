@@ -0,0 +1,270 @@
+import os
+import pickle
+import shutil
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+from django.test import SimpleTestCase
+from django.test.utils import override_settings
+
+from autoproofreader.benchmarks import generate_skeleton, write_skeleton_csv
+from autoproofreader.loadtest import write_fake_compute_server
+from autoproofreader.transports import (
+    PROCESS_MARKER,
+    SlurmTransport,
+    process_group_command,
+    slurm_time,
+)
+
+
+@override_settings(AUTOPROOFREADER_SLURM_POLL_INTERVAL=0.1)
+class SlurmTransportTests(SimpleTestCase):
+    def setUp(self):
+        self.work_dir = Path(tempfile.mkdtemp())
+        bin_dir = write_fake_compute_server(self.work_dir / "cluster", compute_delay=0)
+        self.env = dict(
+            os.environ, PATH="{}{}{}".format(bin_dir, os.pathsep, os.environ["PATH"])
+        )
+        self.remote = self.work_dir / "cluster" / "remote"
+        self.contexts = []
+        for job_name in ("job_a", "job_b"):
+            local_temp_dir = self.work_dir / "media" / job_name
+            local_temp_dir.mkdir(parents=True)
+            write_skeleton_csv(generate_skeleton(50), local_temp_dir / "skeleton.csv")
+            for f in ("sarbor_config.toml", "cached_lsd_config.toml"):
+                (local_temp_dir / f).write_text("")
+            self.contexts.append(
+                {
+                    "server": {
+                        "address": "login.cluster.org",
+                        "results_dir": "results",
+                        "env_source": "env.sh",
+                    },
+                    "ssh_key": "key",
+                    "ssh_user": "guest",
+                    "job_name": job_name,
+                    "job_type": "cached_lsd",
+                    "local_temp_dir": local_temp_dir,
+                    "result_id": len(self.contexts) + 1,
+                    "time_limit": None,
+                    "memory_limit": None,
+                }
+            )
+        self.transport = SlurmTransport()
+
+    def tearDown(self):
+        shutil.rmtree(str(self.work_dir))
+
+    def run_script(self, script):
+        """Run a script like run_bash_streaming, returns the process lines."""
+        out = subprocess.run(
+            "/bin/bash",
+            input=script,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            encoding="utf8",
+            env=self.env,
+            check=True,
+        ).stdout
+        return [
+            line.split()[1:]
+            for line in out.split("\n")
+            if line.startswith(PROCESS_MARKER)
+        ]
+
+    def test_pack(self):
+        self.run_script(self.transport.stage_in_command(self.contexts))
+        lines = self.run_script(self.transport.compute_command(self.contexts))
+        self.assertEqual(
+            sorted(lines),
+            [
+                ["exit", "1", "0"],
+                ["exit", "2", "0"],
+                ["pid", "1", "1"],
+                ["pid", "2", "2"],
+            ],
+        )
+        for job_name in ("job_a", "job_b"):
+            outputs = self.remote / "results" / job_name / "outputs"
+            self.assertTrue((outputs / "nodes.obj").exists())
+
+        self.run_script(self.transport.stage_out_command(self.contexts))
+        for context in self.contexts:
+            self.assertTrue((context["local_temp_dir"] / "outputs").exists())
+
+    def test_partial(self):
+        self.run_script(self.transport.stage_in_command(self.contexts))
+        self.run_script(self.transport.compute_command(self.contexts))
+
+        # Only chunks written since the last poll are copied
+        self.run_script(self.transport.partial_command(self.contexts, {1: 0, 2: 2}))
+        for context, expected in zip(self.contexts, (["0", "1", "2", "3"], ["2", "3"])):
+            partial = context["local_temp_dir"] / "outputs" / "partial"
+            self.assertEqual(
+                sorted(path.stem.split("_")[1] for path in partial.iterdir()), expected
+            )
+        nodes = []
+        for path in (
+            self.contexts[0]["local_temp_dir"] / "outputs" / "partial"
+        ).iterdir():
+            with path.open("rb") as f:
+                nodes.extend(pickle.load(f)[0])
+        self.assertEqual(len(nodes), 50)
+
+        # Polling without new chunks copies nothing
+        self.run_script(self.transport.partial_command(self.contexts, {1: 4, 2: 4}))
+
+    def test_resume(self):
+        contexts = self.contexts[:1]
+        self.run_script(self.transport.stage_in_command(contexts))
+        self.run_script(self.transport.compute_command(contexts))
+
+        # A retried task waits for the batch job it submitted before
+        contexts[0]["remote_pid"] = 1
+        command = self.transport.compute_command(contexts)
+        self.assertNotIn("sbatch", command)
+        self.assertEqual(
+            self.run_script(command), [["pid", "1", "1"], ["exit", "1", "0"]]
+        )
+
+    def test_poll_errors(self):
+        contexts = self.contexts[:1]
+        self.run_script(self.transport.stage_in_command(contexts))
+        self.run_script(self.transport.compute_command(contexts))
+        contexts[0]["remote_pid"] = 1
+        slurm_dir = self.remote / ".slurm"
+
+        # Failed squeue calls are retried
+        (slurm_dir / "squeue_errors").write_text("3")
+        self.assertEqual(
+            self.run_script(self.transport.compute_command(contexts)),
+            [["pid", "1", "1"], ["exit", "1", "0"]],
+        )
+
+        # Without the exit file sarbor wrote, its state is looked up with sacct
+        (self.remote / "results" / "job_a" / "slurm_exit_code").unlink()
+        self.assertEqual(
+            self.run_script(self.transport.compute_command(contexts)),
+            [["pid", "1", "1"], ["exit", "1", "0"]],
+        )
+        (slurm_dir / "1.exit").write_text("3")
+        self.assertEqual(
+            self.run_script(self.transport.compute_command(contexts))[-1],
+            ["exit", "1", "3"],
+        )
+
+        # The poll gives up if squeue keeps failing, the task is retried
+        (slurm_dir / "squeue_errors").write_text("100")
+        with self.assertRaises(subprocess.CalledProcessError):
+            self.run_script(self.transport.compute_command(contexts))
+
+    def test_failed_submission(self):
+        # sarbor fails without its inputs on the cluster
+        lines = self.run_script(self.transport.compute_command(self.contexts[:1]))
+        self.assertEqual(lines[-1][:2], ["exit", "1"])
+        self.assertNotEqual(lines[-1][2], "0")
+
+    def test_options(self):
+        self.contexts[0]["time_limit"] = 5400
+        self.contexts[0]["memory_limit"] = 8 * 1024 ** 3
+        with self.settings(
+            AUTOPROOFREADER_SLURM_GPUS=2,
+            AUTOPROOFREADER_SLURM_OPTIONS="--partition=gpu",
+        ):
+            command = self.transport.sbatch_command(self.contexts[0])
+        self.assertIn("--gres=gpu:2", command)
+        self.assertIn("--time=1:30:00", command)
+        self.assertIn("--mem=8192M", command)
+        self.assertIn("--partition=gpu", command)
+        self.assertEqual(slurm_time(59), "0:00:59")
+
+        kill = self.transport.kill_command(self.contexts[0], 12)
+        self.assertIn("scancel 12", kill)
+        self.assertIn("rm -rf results/job_a", kill)
+
+
+class ProcessGroupTests(SimpleTestCase):
+    def setUp(self):
+        self.work_dir = Path(tempfile.mkdtemp())
+        self.exit_file = self.work_dir / "exit_code"
+        self.context = {"result_id": 7, "time_limit": None, "memory_limit": None}
+
+    def tearDown(self):
+        # Lets processes left by a failed test finish
+        (self.work_dir / "release").touch()
+        shutil.rmtree(str(self.work_dir))
+
+    def process_lines(self, out):
+        return [
+            line.split()[1:]
+            for line in out.split("\n")
+            if line.startswith(PROCESS_MARKER)
+        ]
+
+    def test_reattach(self):
+        release = self.work_dir / "release"
+        command = "(while [ ! -f {} ]; do sleep 0.05; done; exit 3)".format(release)
+        first = subprocess.Popen(
+            [
+                "/bin/bash",
+                "-c",
+                process_group_command(self.context, command, self.exit_file),
+            ],
+            stdout=subprocess.PIPE,
+            encoding="utf8",
+        )
+        _, _, pid = first.stdout.readline().split()[1:]
+        # The connection is lost, the process group keeps running
+        first.kill()
+        first.wait()
+
+        self.context["remote_pid"] = int(pid)
+        retry = subprocess.Popen(
+            [
+                "/bin/bash",
+                "-c",
+                process_group_command(self.context, command, self.exit_file),
+            ],
+            stdout=subprocess.PIPE,
+            encoding="utf8",
+        )
+        self.assertEqual(
+            self.process_lines(retry.stdout.readline()), [["pid", "7", pid]]
+        )
+        release.touch()
+        out, _ = retry.communicate(timeout=30)
+        self.assertEqual(self.process_lines(out), [["exit", "7", "3"]])
+
+        # A job that finished while disconnected isn't run again
+        out = subprocess.run(
+            [
+                "/bin/bash",
+                "-c",
+                process_group_command(self.context, "(exit 5)", self.exit_file),
+            ],
+            stdout=subprocess.PIPE,
+            encoding="utf8",
+        ).stdout
+        self.assertEqual(self.process_lines(out), [["exit", "7", "3"]])
+
+        # One that is gone without an exit status starts over
+        for _ in range(100):
+            try:
+                os.killpg(int(pid), 0)
+            except ProcessLookupError:
+                break
+            time.sleep(0.05)
+        self.exit_file.unlink()
+        out = subprocess.run(
+            [
+                "/bin/bash",
+                "-c",
+                process_group_command(self.context, "(exit 5)", self.exit_file),
+            ],
+            stdout=subprocess.PIPE,
+            encoding="utf8",
+        ).stdout
+        self.assertEqual(self.process_lines(out)[-1], ["exit", "7", "5"])
+        self.assertEqual(self.exit_file.read_text().strip(), "5")
@@ -0,0 +1,69 @@
+import gzip
+import shutil
+import tempfile
+from pathlib import Path
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, override_settings
+
+from catmaid.models import Treenode
+
+from autoproofreader.tests.common import AutoproofreaderTestCase
+from autoproofreader.uploads import (
+    SkeletonCSVValidator,
+    export_skeleton,
+    stream_upload,
+)
+
+
+class UploadTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(str(self.directory))
+
+    def test_skeleton_validator(self):
+        validator = SkeletonCSVValidator()
+        validator.feed("1,1,0.5,0,0\n2,")
+        validator.feed("1,1,1,1\n3,,2,2,2")
+        validator.close()
+        self.assertEqual(validator.rows, 3)
+
+        validator = SkeletonCSVValidator()
+        validator.feed("1,1,0,0,0\n")
+        self.assertRaises(ValueError, validator.feed, "2,1,a,0,0\n")
+        self.assertRaises(ValueError, SkeletonCSVValidator().close)
+
+    def test_stream_gzip_upload(self):
+        content = "".join("{},1,0,0,0\n".format(i) for i in range(1, 1000))
+        upload = SimpleUploadedFile("skeleton.csv.gz", gzip.compress(content.encode()))
+        path = stream_upload(upload, self.directory)
+        self.assertEqual(path.name, "skeleton.csv")
+        self.assertEqual(path.read_text(), content)
+
+    @override_settings(AUTOPROOFREADER_MAX_CONFIG_SIZE=10)
+    def test_size_limit(self):
+        upload = SimpleUploadedFile("job_config.json", b'{"skeleton_id": 1}')
+        self.assertRaises(ValueError, stream_upload, upload, self.directory)
+
+    def test_invalid_uploads(self):
+        upload = SimpleUploadedFile("job_config.json", b"\xff\xfe")
+        self.assertRaises(ValueError, stream_upload, upload, self.directory)
+        upload = SimpleUploadedFile("volume.toml.gz", b"not gzip")
+        self.assertRaises(ValueError, stream_upload, upload, self.directory)
+
+
+class SkeletonExportTests(AutoproofreaderTestCase):
+    def test_export_skeleton(self):
+        directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, str(directory))
+
+        path = export_skeleton(235, self.test_project_id, directory)
+        rows = [line.split(",") for line in path.read_text().splitlines()]
+        nodes = Treenode.objects.filter(skeleton_id=235)
+        self.assertEqual(len(rows), nodes.count())
+        root = nodes.get(parent__isnull=True)
+        self.assertIn([str(root.id), str(root.id)], [row[:2] for row in rows])
+
+        self.assertRaises(ValueError, export_skeleton, 235, 1, directory)
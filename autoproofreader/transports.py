@@ -0,0 +1,479 @@
+# -*- coding: utf-8 -*-
+"""How the files of jobs get to a compute server and how sarbor runs there.
+
+Every compute server names a transport, which builds the bash scripts run
+for the stages of its jobs. The ssh transport copies job files to the
+server with scp and runs sarbor over ssh. The local transport runs sarbor
+as a subprocess of the worker, reading and writing the job directory in
+MEDIA_ROOT directly, for servers that share a host or file system with
+the celery workers. Nothing has to be copied there, so its jobs skip the
+stage_in and stage_out stages. The slurm transport copies files like the
+ssh transport, but submits sarbor as a batch job to a SLURM cluster.
+"""
+from pathlib import Path
+
+from django.conf import settings
+
+# Prefix of the lines reporting the remote process of a job
+PROCESS_MARKER = "AUTOPROOFREADER_PROCESS"
+
+# Seconds between checks whether a reattached process group finished
+REATTACH_POLL_INTERVAL = 1
+
+
+def sarbor_command(context, job_dir, output_file):
+    """
+    Run sarbor on the files of a job in job_dir, through the warm worker of
+    the server if it has one.
+    """
+    server = context["server"]
+    job_type = context["job_type"]
+    files = {}
+    for f in context["local_temp_dir"].iterdir():
+        files[f.name.split(".")[0]] = Path(job_dir, f.name)
+
+    if job_type == "diluvian":
+        extra_parameters = (
+            "--model-weights-file {model_file} "
+            + "--model-training-config {model_config_file} "
+            + "--model-job-config {job_config_file} "
+            + "--volume-file {volume_file} "
+        ).format(
+            **{
+                "model_file": server["model_file"],
+                "model_config_file": files["model_config"],
+                "job_config_file": files["diluvian_config"],
+                "volume_file": files["volume"],
+            }
+        )
+    elif job_type == "cached_lsd":
+        extra_parameters = "--cached-lsd-config {} ".format(files["cached_lsd_config"])
+    else:
+        extra_parameters = ""
+
+    worker = ""
+    if server.get("worker_socket", None):
+        worker = "sarbor-worker --socket {} run ".format(server["worker_socket"])
+
+    return (
+        worker
+        + "sarbor-error-detector "
+        + "--skeleton-csv {skeleton_file} "
+        + "--sarbor-config {sarbor_config} "
+        + "--output-file {output_file} "
+        + "{segmentation_type} "
+        + "{type_parameters}"
+    ).format(
+        **{
+            "skeleton_file": files["skeleton"],
+            "sarbor_config": files["sarbor_config"],
+            "output_file": output_file,
+            "segmentation_type": job_type.replace("_", "-"),
+            "type_parameters": extra_parameters,
+        }
+    )
+
+
+def process_group_command(context, command, exit_file):
+    """
+    Run sarbor in its own process group within the job's limits. The pid of
+    the group and the exit status are reported on stdout, so the job can be
+    killed on the server later on. The exit status is also written to
+    exit_file, so a retried task whose connection was lost waits for the
+    process group it started before instead of starting sarbor again.
+    """
+    if context["time_limit"]:
+        command = "timeout --kill-after=60 {} {}".format(context["time_limit"], command)
+    if context["memory_limit"]:
+        command = "ulimit -v {}; {}".format(context["memory_limit"] // 1024, command)
+    start = (
+        "rm -f {exit_file}\n"
+        # The pid is reported from within the new session, a retry looking
+        # for the process group then always finds it
+        + "setsid bash -c '"
+        + 'echo "{marker} pid {result_id} $$"; '
+        + "{command}; code=$?; echo $code > {exit_file}; exit $code' &\n"
+        + "wait $!\n"
+        + 'echo "{marker} exit {result_id} $?"'
+    )
+    pid = context.get("remote_pid", None)
+    if pid is not None:
+        # Reattach to the process group of an interrupted attempt if it is
+        # still running or finished since, start over if it is gone
+        start = (
+            "if [ -f {exit_file} ]; then\n"
+            + 'echo "{marker} exit {result_id} $(cat {exit_file})"\n'
+            + "elif kill -0 -- -{pid} 2>/dev/null; then\n"
+            + 'echo "{marker} pid {result_id} {pid}"\n'
+            + "while kill -0 -- -{pid} 2>/dev/null && [ ! -f {exit_file} ]; do "
+            + "sleep {interval}; done\n"
+            + 'echo "{marker} exit {result_id} $(cat {exit_file} 2>/dev/null || echo 1)"\n'
+            + "else\n"
+            + start
+            + "\nfi"
+        )
+    return start.format(
+        command=command,
+        exit_file=exit_file,
+        marker=PROCESS_MARKER,
+        result_id=context["result_id"],
+        pid=pid,
+        interval=REATTACH_POLL_INTERVAL,
+    )
+
+
+class SSHTransport(object):
+    """Copies job files with scp and runs sarbor over ssh."""
+
+    name = "ssh"
+    copies_files = True
+
+    def stage_in_command(self, contexts):
+        # copy temp files from django local temp media storage to server temp storage
+        # A single job directory is copied to its job name, several are copied
+        # into the results directory at once, keeping their names.
+        context = contexts[0]
+        target = context["server"]["results_dir"]
+        if len(contexts) == 1:
+            target = "{}/{}".format(target, context["job_name"])
+        return (
+            "scp -i {ssh_key} -pr {local_dirs} "
+            + "{ssh_user}@{server_address}:{target}"
+        ).format(
+            **{
+                "local_dirs": " ".join(str(c["local_temp_dir"]) for c in contexts),
+                "server_address": context["server"]["address"],
+                "target": target,
+                "ssh_key": context["ssh_key"],
+                "ssh_user": context["ssh_user"],
+            }
+        )
+
+    def sarbor_command(self, context):
+        results_dir, job_name = context["server"]["results_dir"], context["job_name"]
+        return sarbor_command(
+            context,
+            Path("~/", results_dir, job_name),
+            Path(results_dir, job_name, "outputs"),
+        )
+
+    def compute_command(self, contexts):
+        # connect to the server and run the autoproofreader algorithm on the provided
+        # skeletons. Packed jobs share one connection and environment setup.
+        context = contexts[0]
+        return (
+            "ssh -i {ssh_key} {ssh_user}@{server}\n"
+            + "source {server_ff_env_path}\n"
+            + "{sarbor_commands}"
+        ).format(
+            **{
+                "ssh_key": context["ssh_key"],
+                "ssh_user": context["ssh_user"],
+                "server": context["server"]["address"],
+                "server_ff_env_path": context["server"]["env_source"],
+                "sarbor_commands": "\n".join(
+                    process_group_command(
+                        c,
+                        self.sarbor_command(c),
+                        "{}/{}/exit_code".format(
+                            c["server"]["results_dir"], c["job_name"]
+                        ),
+                    )
+                    for c in contexts
+                ),
+            }
+        )
+
+    def stage_out_command(self, contexts):
+        # Copy the numpy file containing the volume mesh and the csv containing the node
+        # connections predicted by the autoproofreader run.
+        context = contexts[0]
+        remote = "{}@{}:{}".format(
+            context["ssh_user"],
+            context["server"]["address"],
+            context["server"]["results_dir"],
+        )
+        if len(contexts) == 1:
+            sources = "{}/{}/*".format(remote, context["job_name"])
+            target = context["local_temp_dir"]
+        else:
+            # Outputs of packed jobs are kept apart by their job directories
+            sources = " ".join("{}/{}".format(remote, c["job_name"]) for c in contexts)
+            target = context["local_temp_dir"].parent
+        return "scp -i {ssh_key} -r {sources} {target}\n".format(
+            ssh_key=context["ssh_key"], sources=sources, target=target
+        )
+
+    def partial_command(self, contexts, chunks):
+        """
+        Copy the chunks of rankings written to outputs/partial of running
+        jobs since the last call. chunks maps the result id of a job to the
+        number of its chunks copied before. New chunks are sent as one tar
+        stream, unpacked into the local job directories.
+        """
+        context = contexts[0]
+        listings = " ".join(
+            "ls -v {}/outputs/partial/chunk_*.obj 2>/dev/null | tail -n +{};".format(
+                c["job_name"], chunks[c["result_id"]] + 1
+            )
+            for c in contexts
+        )
+        return (
+            "ssh -n -i {ssh_key} {ssh_user}@{server} "
+            + "'cd {results_dir} && {{ {listings} }} | tar -cf - -T -' "
+            + "| tar -xf - -C {target}"
+        ).format(
+            **{
+                "ssh_key": context["ssh_key"],
+                "ssh_user": context["ssh_user"],
+                "server": context["server"]["address"],
+                "results_dir": context["server"]["results_dir"],
+                "listings": listings,
+                "target": context["local_temp_dir"].parent,
+            }
+        )
+
+    def cleanup_command(self, contexts):
+        context = contexts[0]
+        return (
+            "rm -r {local_temp_dirs}\n"
+            + "ssh -i {ssh_key} {ssh_user}@{server}\n"
+            + "rm -r {server_job_dirs}"
+        ).format(
+            **{
+                "ssh_key": context["ssh_key"],
+                "ssh_user": context["ssh_user"],
+                "server": context["server"]["address"],
+                "server_job_dirs": " ".join(
+                    "{}/{}".format(c["server"]["results_dir"], c["job_name"])
+                    for c in contexts
+                ),
+                "local_temp_dirs": " ".join(str(c["local_temp_dir"]) for c in contexts),
+            }
+        )
+
+    def kill_command(self, context, pid):
+        """Kill the remote process group of a job and remove its files there."""
+        commands = [
+            "ssh -i {} {}@{}".format(
+                context["ssh_key"], context["ssh_user"], context["server"]["address"]
+            )
+        ]
+        if pid is not None:
+            commands.append("kill -TERM -- -{}".format(pid))
+        commands.append(
+            "rm -rf {}/{}".format(context["server"]["results_dir"], context["job_name"])
+        )
+        return "\n".join(commands)
+
+    def gpu_command(self, server, query):
+        """Run a query like nvidia-smi on the server, failing fast if it is down."""
+        return (
+            "ssh -o BatchMode=yes -o ConnectTimeout=10 -i {}/{} {}@{}\n".format(
+                settings.SSH_KEY_PATH, server.ssh_key, server.ssh_user, server.address
+            )
+            + query
+        )
+
+
+class LocalTransport(object):
+    """Runs sarbor as a subprocess of the worker on the job directory itself."""
+
+    name = "local"
+    copies_files = False
+
+    def sarbor_command(self, context):
+        job_dir = context["local_temp_dir"]
+        return sarbor_command(context, job_dir, job_dir / "outputs")
+
+    def compute_command(self, contexts):
+        commands = []
+        env_source = contexts[0]["server"]["env_source"]
+        if env_source:
+            commands.append("source {}".format(env_source))
+        commands.extend(
+            process_group_command(
+                c, self.sarbor_command(c), c["local_temp_dir"] / "exit_code"
+            )
+            for c in contexts
+        )
+        return "\n".join(commands)
+
+    def partial_command(self, contexts, chunks):
+        """sarbor writes its chunks to the local job directories already."""
+        return "true"
+
+    def cleanup_command(self, contexts):
+        return "rm -r {}".format(" ".join(str(c["local_temp_dir"]) for c in contexts))
+
+    def kill_command(self, context, pid):
+        """Kill the process group of a job, its files are removed by the caller."""
+        if pid is None:
+            return "true"
+        return "kill -TERM -- -{}".format(pid)
+
+    def gpu_command(self, server, query):
+        return query
+
+
+# Failed squeue calls in a row before the compute stage gives up
+SLURM_POLL_RETRIES = 10
+
+# Waits for the batch jobs in the slurm_jobs array, indexed by result id, and
+# reports the exit status of each. squeue errors are retried on the next poll,
+# the script gives up after SLURM_POLL_RETRIES failed polls in a row so the task is
+# retried and waits for the same jobs again. Jobs that left the queue report
+# the exit status sarbor wrote next to its outputs, or the state and exit code
+# slurm accounted for them if that file isn't visible (yet).
+SLURM_POLL = """squeue_errors=0
+while [ ${{#slurm_jobs[@]}} -gt 0 ]; do
+for result in "${{!slurm_jobs[@]}}"; do
+job=${{slurm_jobs[$result]}}
+if ! queued=$(squeue -h -j $job -o %T 2>&1); then
+case "$queued" in
+*"Invalid job id"*) queued= ;;
+*)
+echo "squeue failed for job $job: $queued" >&2
+squeue_errors=$((squeue_errors + 1))
+if [ $squeue_errors -ge {retries} ]; then exit 1; fi
+continue ;;
+esac
+fi
+squeue_errors=0
+case "$queued" in
+""|COMPLETED|FAILED|CANCELLED|TIMEOUT|OUT_OF_MEMORY|NODE_FAIL|BOOT_FAIL|PREEMPTED|DEADLINE) ;;
+*) continue ;;
+esac
+if [ -f "${{slurm_exit_files[$result]}}" ]; then
+code=$(cat "${{slurm_exit_files[$result]}}")
+else
+accounted=$(sacct -n -X -P -j $job -o State,ExitCode 2>/dev/null | head -n 1)
+state=${{accounted%%|*}}
+exit_code=${{accounted##*|}}
+case "${{state%% *}}" in
+COMPLETED|FAILED) code=${{exit_code%%:*}} ;;
+TIMEOUT) code=124 ;;
+OUT_OF_MEMORY) code=137 ;;
+CANCELLED|NODE_FAIL|BOOT_FAIL|PREEMPTED|DEADLINE) code=1 ;;
+*) continue ;;
+esac
+fi
+echo "{marker} exit $result $code"
+unset "slurm_jobs[$result]"
+done
+if [ ${{#slurm_jobs[@]}} -gt 0 ]; then sleep {interval}; fi
+done"""
+
+
+def slurm_time(seconds):
+    """A time limit in the hours:minutes:seconds format of sbatch."""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return "{}:{:02d}:{:02d}".format(hours, minutes, seconds)
+
+
+class SlurmTransport(SSHTransport):
+    """
+    Submits jobs to a SLURM cluster with sbatch from its login node. Job
+    files are copied to the results directory on storage shared by the
+    cluster and sarbor runs as a batch job on a GPU node. The compute stage
+    polls squeue until every job of the pack is finished. The id of the
+    batch job is stored as the remote pid of a job, so a retried task
+    waits for the batch job it already submitted instead of submitting
+    it again.
+    """
+
+    name = "slurm"
+
+    def exit_file(self, context):
+        return "{}/{}/slurm_exit_code".format(
+            context["server"]["results_dir"], context["job_name"]
+        )
+
+    def sbatch_command(self, context):
+        options = [
+            "--parsable",
+            "--job-name=autoproofreader_{}".format(context["result_id"]),
+            "--output={}/{}/slurm.log".format(
+                context["server"]["results_dir"], context["job_name"]
+            ),
+            "--gres=gpu:{}".format(getattr(settings, "AUTOPROOFREADER_SLURM_GPUS", 1)),
+        ]
+        if context["time_limit"]:
+            options.append("--time={}".format(slurm_time(context["time_limit"])))
+        if context["memory_limit"]:
+            options.append("--mem={}M".format(context["memory_limit"] // 1024 ** 2))
+        extra_options = getattr(settings, "AUTOPROOFREADER_SLURM_OPTIONS", "")
+        if extra_options:
+            options.append(extra_options)
+        wrapped = "source {}; {}; code=\\$?; echo \\$code > {}; exit \\$code".format(
+            context["server"]["env_source"],
+            self.sarbor_command(context),
+            self.exit_file(context),
+        )
+        return 'sbatch {} --wrap="{}" | cut -d ";" -f 1'.format(
+            " ".join(options), wrapped
+        )
+
+    def compute_command(self, contexts):
+        context = contexts[0]
+        commands = [
+            "ssh -i {} {}@{}".format(
+                context["ssh_key"], context["ssh_user"], context["server"]["address"]
+            ),
+            "declare -A slurm_jobs slurm_exit_files",
+        ]
+        for c in contexts:
+            result_id = c["result_id"]
+            if c.get("remote_pid", None) is not None:
+                commands.append("job={}".format(c["remote_pid"]))
+            else:
+                commands.append("job=$({})".format(self.sbatch_command(c)))
+            commands.extend(
+                [
+                    'if [ -z "$job" ]; then',
+                    'echo "{} exit {} 1"'.format(PROCESS_MARKER, result_id),
+                    "else",
+                    'echo "{} pid {} $job"'.format(PROCESS_MARKER, result_id),
+                    "slurm_jobs[{}]=$job".format(result_id),
+                    "slurm_exit_files[{}]={}".format(result_id, self.exit_file(c)),
+                    "fi",
+                ]
+            )
+        commands.append(
+            SLURM_POLL.format(
+                marker=PROCESS_MARKER,
+                interval=getattr(settings, "AUTOPROOFREADER_SLURM_POLL_INTERVAL", 30),
+                retries=SLURM_POLL_RETRIES,
+            )
+        )
+        return "\n".join(commands)
+
+    def kill_command(self, context, pid):
+        """Cancel the batch job of a job and remove its files on the cluster."""
+        commands = [
+            "ssh -i {} {}@{}".format(
+                context["ssh_key"], context["ssh_user"], context["server"]["address"]
+            )
+        ]
+        if pid is not None:
+            commands.append("scancel {}".format(pid))
+        commands.append(
+            "rm -rf {}/{}".format(context["server"]["results_dir"], context["job_name"])
+        )
+        return "\n".join(commands)
+
+
+TRANSPORTS = {"ssh": SSHTransport, "local": LocalTransport, "slurm": SlurmTransport}
+
+
+def get_transport(server):
+    """The transport of a compute server."""
+    try:
+        return TRANSPORTS[server.transport]()
+    except KeyError:
+        raise ValueError(
+            "Unknown transport {} of compute server {}, expected one of {}".format(
+                server.transport, server.name, ", ".join(sorted(TRANSPORTS))
+            )
+        )
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""Streaming of uploaded job files into the job staging directory.
+
+Uploads are written to disk chunk by chunk instead of being read into
+memory. Files whose name ends in `.gz` are decompressed on the fly and
+stored without the suffix. Every file is checked to be utf-8 and to stay
+below a size limit while it is written, skeleton.csv is additionally
+checked row by row. If no skeleton.csv is uploaded, it is exported from
+the treenode table instead. If the optional `toml` package is installed, toml
+configs are parsed once they are written.
+"""
+import codecs
+import zlib
+
+from django.conf import settings
+from django.db import connection
+
+try:
+    import toml
+except ImportError:
+    toml = None
+
+# Snapshot of a skeleton in the format the widget uploads: the parent of
+# the root node is the root node itself
+SKELETON_EXPORT_QUERY = """
+    COPY (
+        SELECT id, COALESCE(parent_id, id), location_x, location_y, location_z
+        FROM treenode
+        WHERE skeleton_id = {skeleton_id} AND project_id = {project_id}
+        ORDER BY id
+    ) TO STDOUT WITH (FORMAT csv)
+"""
+
+# Bytes of decompressed output produced per step, keeps gzip bombs bounded
+DECOMPRESS_CHUNK_SIZE = 1024 * 1024
+
+
+class SkeletonCSVValidator(object):
+    """
+    Incrementally checks text of a skeleton csv with rows of
+    (node_id, parent_id, x, y, z). The parent id of a root node may be
+    empty or the id of the node itself.
+    """
+
+    def __init__(self):
+        self.line = ""
+        self.rows = 0
+
+    def feed(self, text):
+        lines = (self.line + text).split("\n")
+        self.line = lines.pop()
+        for line in lines:
+            self._check(line)
+
+    def close(self):
+        if len(self.line) > 0:
+            self._check(self.line)
+        self.line = ""
+        if self.rows == 0:
+            raise ValueError("skeleton.csv contains no nodes")
+
+    def _check(self, line):
+        line = line.strip()
+        if len(line) == 0:
+            return
+        self.rows += 1
+        values = line.split(",")
+        if len(values) != 5:
+            raise ValueError(
+                "skeleton.csv row {} has {} columns, expected 5".format(
+                    self.rows, len(values)
+                )
+            )
+        try:
+            int(values[0])
+            if len(values[1].strip()) > 0:
+                int(values[1])
+            for value in values[2:]:
+                float(value)
+        except ValueError:
+            raise ValueError("skeleton.csv row {} is malformed".format(self.rows))
+
+
+def max_upload_size(name):
+    """Maximum size in bytes of an uploaded file after decompression."""
+    if name == "skeleton.csv":
+        return getattr(settings, "AUTOPROOFREADER_MAX_SKELETON_SIZE", 1024 ** 3)
+    return getattr(settings, "AUTOPROOFREADER_MAX_CONFIG_SIZE", 1024 ** 2)
+
+
+def upload_name(upload):
+    """Name a file is stored as, i.e. without a .gz suffix."""
+    if upload.name.endswith(".gz"):
+        return upload.name[: -len(".gz")]
+    return upload.name
+
+
+def _gunzip(chunks):
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        for chunk in chunks:
+            while len(chunk) > 0:
+                yield decompressor.decompress(chunk, DECOMPRESS_CHUNK_SIZE)
+                chunk = decompressor.unconsumed_tail
+        yield decompressor.flush()
+    except zlib.error as e:
+        raise ValueError("Invalid gzip upload: {}".format(e))
+    if not decompressor.eof:
+        raise ValueError("Truncated gzip upload")
+
+
+def stream_upload(upload, directory):
+    """
+    Write an uploaded file to directory in chunks, returns the path it
+    was written to. Raises ValueError if the file is too large, not valid
+    utf-8, or not a valid skeleton or config.
+    """
+    name = upload_name(upload)
+    limit = max_upload_size(name)
+    chunks = upload.chunks()
+    if name != upload.name:
+        chunks = _gunzip(chunks)
+
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    validator = SkeletonCSVValidator() if name == "skeleton.csv" else None
+    path = directory / name
+    size = 0
+    with path.open("wb") as f:
+        for chunk in chunks:
+            size += len(chunk)
+            if size > limit:
+                raise ValueError(
+                    "{} is larger than the limit of {} bytes".format(name, limit)
+                )
+            try:
+                text = decoder.decode(chunk)
+            except UnicodeDecodeError:
+                raise ValueError("{} is not valid utf-8".format(name))
+            if validator is not None:
+                validator.feed(text)
+            f.write(chunk)
+    try:
+        decoder.decode(b"", final=True)
+    except UnicodeDecodeError:
+        raise ValueError("{} is not valid utf-8".format(name))
+    if validator is not None:
+        validator.close()
+    if toml is not None and name.endswith(".toml"):
+        try:
+            toml.loads(path.read_text())
+        except toml.TomlDecodeError as e:
+            raise ValueError("{} is not valid toml: {}".format(name, e))
+    return path
+
+
+def export_skeleton(skeleton_id, project_id, directory):
+    """
+    Write a skeleton.csv snapshot of a skeleton to directory, streamed
+    from the database with a single COPY.
+    """
+    path = directory / "skeleton.csv"
+    query = SKELETON_EXPORT_QUERY.format(
+        skeleton_id=int(skeleton_id), project_id=int(project_id)
+    )
+    with path.open("w") as f, connection.cursor() as cursor:
+        cursor.copy_expert(query, f)
+    if path.stat().st_size == 0:
+        raise ValueError(
+            "Skeleton {} has no nodes in project {}".format(skeleton_id, project_id)
+        )
+    return path
@@ -5,16 +5,36 @@ from django.conf.urls import url
 from autoproofreader.control import (
     compute_server,
     autoproofreader,
+    batch,
+    cache_stats,
+    download_profile,
     is_installed,
     diluvian_model,
     image_volume_config,
+    job_metrics,
+    monitoring_metrics,
+    profiles,
     proofread_tree_nodes,
+    result_comparison,
 )
+from autoproofreader.monitoring import instrument_urlpatterns
 
 app_name = "autoproofreader"
 
 urlpatterns = [url(r"^is-installed$", is_installed)]
 
+# Operational metrics
+urlpatterns += [url(r"^metrics$", monitoring_metrics)]
+
+# Profiles of views and job stages
+urlpatterns += [
+    url(r"^(?P<project_id>\d+)/profiles$", profiles),
+    url(r"^(?P<project_id>\d+)/profiles/(?P<name>[\w.-]+)$", download_profile),
+]
+
+# Result cache
+urlpatterns += [url(r"^(?P<project_id>\d+)/cache-stats$", cache_stats)]
+
 # Skeleton flood filling
 urlpatterns += [
     url(
@@ -23,6 +43,17 @@ urlpatterns += [
     )
 ]
 
+# Batches of flood filling jobs
+urlpatterns += [
+    url(
+        r"^(?P<project_id>\d+)/autoproofreader-batches$",
+        batch.AutoproofreaderBatchAPI.as_view(),
+    )
+]
+
+# Resources used by flood filling jobs
+urlpatterns += [url(r"^(?P<project_id>\d+)/job-metrics$", job_metrics.get_job_metrics)]
+
 # Compute Servers
 urlpatterns += [
     url(
@@ -46,6 +77,23 @@ urlpatterns += [
         r"^(?P<project_id>\d+)/autoproofreader-results$",
         autoproofreader.AutoproofreaderResultAPI.as_view(),
     ),
+    url(
+        r"^(?P<project_id>\d+)/autoproofreader-results/(?P<result_id>\d+)$",
+        autoproofreader.AutoproofreaderResultDetailAPI.as_view(),
+    ),
+    url(
+        r"^(?P<project_id>\d+)/autoproofreader-results/(?P<result_id>\d+)/cancel$",
+        autoproofreader.cancel_result,
+    ),
+    url(
+        r"^(?P<project_id>\d+)/autoproofreader-results/(?P<result_id>\d+)/summary$",
+        proofread_tree_nodes.get_result_summary,
+    ),
+    url(
+        r"^(?P<project_id>\d+)/autoproofreader-results/compare$",
+        result_comparison.compare_results,
+    ),
+    url(r"^(?P<project_id>\d+)/autoproofreader-queue$", autoproofreader.get_job_queue),
     url(
         r"^(?P<project_id>\d+)/autoproofreader-results-uuid$",
         autoproofreader.get_result_uuid,
@@ -67,3 +115,6 @@ urlpatterns += [
         proofread_tree_nodes.ProofreadTreeNodeAPI.as_view(),
     )
 ]
+
+# Latency of every endpoint
+instrument_urlpatterns(urlpatterns)
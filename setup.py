@@ -13,6 +13,9 @@ setup(
     version='0.0.1',
     packages=find_packages(exclude='travis'),
     include_package_data=True,
+    extras_require={
+        'zstd': ['zstandard'],
+    },
     license='MIT license',
     description='A django app which acts as a drop-in extension for CATMAID.',
     long_description=README,